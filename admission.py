@@ -0,0 +1,205 @@
+"""
+上游请求准入控制
+
+在发起 responses.create 之前限制全局与每个模型的并发上游请求数，
+超出时在有界队列中等待；队列已满或等待超时则立即拒绝，
+由接口返回 429 / 503 并附带 Retry-After，避免突发流量打满上游网关后所有用户一起报错。
+"""
+import asyncio
+import math
+import time
+from collections import deque
+from typing import Any, Optional
+
+
+def parse_model_limits(value: str) -> dict[str, int]:
+    """
+    解析每个模型的并发上限
+
+    Args:
+        value: 形如 "g5.2=16,g4o=32" 的配置
+
+    Returns:
+        dict[str, int]: 模型 -> 并发上限
+    """
+    limits: dict[str, int] = {}
+    for item in value.split(","):
+        if not item.strip():
+            continue
+        model, _, limit = item.partition("=")
+        if not limit.strip():
+            raise ValueError(f"无效的模型并发配置: {item}")
+        limits[model.strip()] = int(limit)
+    return limits
+
+
+class AdmissionRejected(Exception):
+    """请求未获准入"""
+
+    def __init__(self, message: str, status_code: int, retry_after: int):
+        super().__init__(message)
+        # 429：等待队列已满；503：排队超时
+        self.status_code = status_code
+        # 建议客户端重试前等待的秒数
+        self.retry_after = retry_after
+
+
+class AdmissionPermit:
+    """一个上游请求名额，上游请求结束时释放"""
+
+    def __init__(self, controller: "AdmissionController", model: str):
+        self.model = model
+        self.acquired_at = time.monotonic()
+        # 已交给读取上游的任务，由其在上游结束时释放
+        self.handed_off = False
+        self._controller = controller
+        self._released = False
+
+    def release(self) -> None:
+        """释放名额（可重复调用）"""
+        if not self._released:
+            self._released = True
+            self._controller._release(self)
+
+
+class _Waiter:
+    __slots__ = ("model", "future")
+
+    def __init__(self, model: str, future: asyncio.Future):
+        self.model = model
+        self.future = future
+
+
+class AdmissionController:
+    """
+    全局与按模型的并发上限
+
+    排队的请求按到达顺序获准；某个模型已满时，后面其他模型的请求可以越过它，
+    避免一个模型的积压阻塞所有模型。上限为 0 表示不限制。
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int = 0,
+        model_limits: Optional[dict[str, int]] = None,
+        max_queue: int = 256,
+        queue_timeout: float = 10.0,
+    ):
+        """
+        Args:
+            max_concurrency: 全局并发上游请求数上限
+            model_limits: 模型 -> 并发上限，未列出的模型只受全局上限约束
+            max_queue: 最多排队的请求数，超出时返回 429
+            queue_timeout: 最长排队秒数，超时返回 503
+        """
+        self.max_concurrency = max_concurrency
+        self.model_limits = model_limits or {}
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._active = 0
+        self._active_by_model: dict[str, int] = {}
+        self._waiters: deque[_Waiter] = deque()
+        # 名额平均持有时间（EWMA），用于估算 Retry-After
+        self._hold_time = 1.0
+        self.admitted = 0
+        self.queued = 0
+        self.rejected_full = 0
+        self.rejected_timeout = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    def _has_capacity(self, model: str) -> bool:
+        if self.max_concurrency and self._active >= self.max_concurrency:
+            return False
+        limit = self.model_limits.get(model, 0)
+        return not limit or self._active_by_model.get(model, 0) < limit
+
+    def _grant(self, model: str) -> AdmissionPermit:
+        self._active += 1
+        self._active_by_model[model] = self._active_by_model.get(model, 0) + 1
+        self.admitted += 1
+        return AdmissionPermit(self, model)
+
+    def _retry_after(self, model: str) -> int:
+        # 按平均持有时间估算排到队尾需要的秒数
+        limits = [x for x in (self.max_concurrency, self.model_limits.get(model, 0)) if x]
+        capacity = min(limits) if limits else 1
+        return max(1, math.ceil(self._hold_time * (len(self._waiters) + 1) / capacity))
+
+    async def acquire(self, model: str) -> AdmissionPermit:
+        """
+        申请一个上游请求名额
+
+        Args:
+            model: 使用的模型
+
+        Returns:
+            AdmissionPermit: 名额凭证
+
+        Raises:
+            AdmissionRejected: 等待队列已满（429）或排队超时（503）
+        """
+        # 有空闲名额且没有人排队时直接获准
+        if not self._waiters and self._has_capacity(model):
+            return self._grant(model)
+        if len(self._waiters) >= self.max_queue:
+            self.rejected_full += 1
+            raise AdmissionRejected("服务繁忙，等待队列已满", 429, self._retry_after(model))
+
+        waiter = _Waiter(model, asyncio.get_running_loop().create_future())
+        self._waiters.append(waiter)
+        self.queued += 1
+        started = time.monotonic()
+        try:
+            return await asyncio.wait_for(asyncio.shield(waiter.future), self.queue_timeout)
+        except (TimeoutError, asyncio.CancelledError) as e:
+            if waiter.future.done() and not waiter.future.cancelled():
+                # 获准与超时同时发生：名额已经分配，交还后再继续抛出
+                waiter.future.result().release()
+            else:
+                waiter.future.cancel()
+                self._waiters.remove(waiter)
+            if isinstance(e, TimeoutError):
+                self.rejected_timeout += 1
+                raise AdmissionRejected("服务繁忙，排队超时", 503, self._retry_after(model)) from None
+            raise
+        finally:
+            waited = time.monotonic() - started
+            self.wait_seconds += waited
+            self.max_wait_seconds = max(self.max_wait_seconds, waited)
+
+    def _release(self, permit: AdmissionPermit) -> None:
+        self._active -= 1
+        self._active_by_model[permit.model] -= 1
+        if not self._active_by_model[permit.model]:
+            del self._active_by_model[permit.model]
+        self._hold_time = 0.9 * self._hold_time + 0.1 * (time.monotonic() - permit.acquired_at)
+        self._dispatch()
+
+    def _dispatch(self) -> None:
+        # 按到达顺序唤醒排队中有空闲名额的请求
+        for waiter in list(self._waiters):
+            if self.max_concurrency and self._active >= self.max_concurrency:
+                break
+            if self._has_capacity(waiter.model):
+                self._waiters.remove(waiter)
+                waiter.future.set_result(self._grant(waiter.model))
+
+    def stats(self) -> dict[str, Any]:
+        """并发、排队与拒绝统计"""
+        return {
+            "max_concurrency": self.max_concurrency,
+            "model_limits": self.model_limits,
+            "active": self._active,
+            "active_by_model": dict(self._active_by_model),
+            "queue_length": len(self._waiters),
+            "max_queue": self.max_queue,
+            "admitted": self.admitted,
+            "queued": self.queued,
+            "rejected_queue_full": self.rejected_full,
+            "rejected_timeout": self.rejected_timeout,
+            "wait_seconds": self.wait_seconds,
+            "avg_wait_seconds": self.wait_seconds / self.queued if self.queued else 0.0,
+            "max_wait_seconds": self.max_wait_seconds,
+            "avg_hold_seconds": self._hold_time,
+        }
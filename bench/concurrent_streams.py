@@ -0,0 +1,65 @@
+"""
+并发流式对话基准测试
+
+对比“在 async 生成器中迭代同步客户端”（旧实现）与异步客户端（当前实现）
+在同一个事件循环上承载 N 个并发 SSE 流时的总耗时。
+
+运行方式（在项目根目录）：
+    python -m bench.concurrent_streams --streams 200 --delay 0.005
+"""
+import argparse
+import asyncio
+import time
+from typing import AsyncGenerator
+
+from openai import OpenAI
+
+import main
+from bench.fake_upstream import build_events, fake_async_client, fake_sync_client
+
+
+async def legacy_chat_stream(client: OpenAI, question: str, model: str) -> AsyncGenerator[str, None]:
+    """旧实现：同步迭代上游流，每次读取都会阻塞事件循环"""
+    response = client.responses.create(model=model, input=question, stream=True)
+    for event in response:
+        yield event.type
+
+
+async def drain(stream: AsyncGenerator) -> int:
+    """消费整个流，返回帧数"""
+    count = 0
+    async for _ in stream:
+        count += 1
+    return count
+
+
+async def run(streams: int, delay: float) -> None:
+    events = build_events()
+    ideal = len(events) * delay
+
+    sync_client = fake_sync_client(events, delay)
+    start = time.perf_counter()
+    await asyncio.gather(*[
+        drain(legacy_chat_stream(sync_client, "hi", "g4o")) for _ in range(streams)
+    ])
+    legacy = time.perf_counter() - start
+
+    async_client = fake_async_client(events, delay)
+    start = time.perf_counter()
+    await asyncio.gather(*[
+        drain(main.generate_chat_stream(async_client, f"hi {i}", f"bench-{i}", "g4o")) for i in range(streams)
+    ])
+    current = time.perf_counter() - start
+    await async_client.close()
+
+    print(f"并发流数: {streams}, 单流理想耗时: {ideal:.3f}s")
+    print(f"同步客户端（旧）: {legacy:.3f}s  ≈ {legacy / ideal:.1f} 倍单流耗时（串行）")
+    print(f"异步客户端（新）: {current:.3f}s  ≈ {current / ideal:.1f} 倍单流耗时")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--streams", type=int, default=50)
+    parser.add_argument("--delay", type=float, default=0.005)
+    args = parser.parse_args()
+    asyncio.run(run(args.streams, args.delay))
@@ -0,0 +1,121 @@
+"""
+客户端断开后上游连接的释放时间
+
+启动真实的 uvicorn 服务（上游为本地伪造的 Responses 流），N 个客户端收到 created 后
+立即断开，测量所有上游连接被关闭所需的时间。分两种场景：
+- streaming: 上游正在持续输出 delta
+- stalled: 上游在 created 之后长时间没有事件（模拟推理 / 联网搜索）
+
+运行方式（在项目根目录）：
+    python -m bench.disconnect --clients 20 --grace 0
+"""
+import argparse
+import asyncio
+import socket
+import time
+from typing import AsyncIterator
+
+import httpx
+import uvicorn
+from openai import AsyncOpenAI
+
+import main
+from bench.fake_upstream import build_events, encode_event
+
+
+class UpstreamCounter:
+    """统计伪造上游中仍在发送的流"""
+
+    def __init__(self):
+        self.open = 0
+        self.closed_at: list[float] = []
+
+
+def tracked_client(counter: UpstreamCounter, delay: float, stall: float) -> AsyncOpenAI:
+    """
+    构造连接到伪造上游的异步客户端，上游流关闭时记录时间
+
+    Args:
+        counter: 上游流计数
+        delay: 事件间隔（秒）
+        stall: created 之后的停顿秒数
+    """
+    events = build_events(text="压" * 2000)
+
+    async def body() -> AsyncIterator[bytes]:
+        counter.open += 1
+        try:
+            for i, event in enumerate(events):
+                await asyncio.sleep(stall if i == 1 else delay)
+                yield encode_event(event)
+        finally:
+            counter.open -= 1
+            counter.closed_at.append(time.perf_counter())
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        return httpx.Response(200, headers={"content-type": "text/event-stream"}, content=body())
+
+    return AsyncOpenAI(
+        base_url="http://fake-upstream/v1",
+        api_key="fake",
+        http_client=httpx.AsyncClient(transport=httpx.MockTransport(handler)),
+    )
+
+
+async def disconnect_after_created(http: httpx.AsyncClient, url: str, i: int) -> float:
+    """发起对话，收到 created 后断开，返回断开时间"""
+    async with http.stream("POST", url, json={"question": f"bench {i}", "session_id": f"bench-{i}"}) as response:
+        async for line in response.aiter_lines():
+            if '"created"' in line:
+                break
+    return time.perf_counter()
+
+
+async def scenario(name: str, port: int, clients: int, delay: float, stall: float, timeout: float) -> None:
+    counter = UpstreamCounter()
+    client = tracked_client(counter, delay, stall)
+    main.app.dependency_overrides[main.get_async_client] = lambda: client
+    url = f"http://127.0.0.1:{port}/api/chat"
+    async with httpx.AsyncClient(timeout=None) as http:
+        disconnected = await asyncio.gather(*[disconnect_after_created(http, url, i) for i in range(clients)])
+    last = max(disconnected)
+    deadline = last + timeout
+    while counter.open and time.perf_counter() < deadline:
+        await asyncio.sleep(0.01)
+    if counter.open:
+        print(f"{name:<10} 超过 {timeout:.0f}s 后仍有 {counter.open} 个上游流未关闭")
+    else:
+        released = [closed - last for closed in counter.closed_at]
+        print(f"{name:<10} {clients} 个上游流全部关闭，最晚 {max(released):.3f}s（断开后）")
+    await client.close()
+
+
+async def run(clients: int, delay: float, stall: float, grace: float, timeout: float) -> None:
+    main.response_cache = None
+    main.broadcasts.grace = grace
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(main.app, host="127.0.0.1", port=port, log_level="warning"))
+    serve = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.01)
+
+    print(f"RESUME_GRACE_SECONDS={grace}, DISCONNECT_CHECK_SECONDS={main.Config.DISCONNECT_CHECK_SECONDS}")
+    await scenario("streaming", port, clients, delay, delay, timeout)
+    await scenario("stalled", port, clients, delay, stall, timeout)
+    print(main.broadcasts.consumer_stats())
+
+    server.should_exit = True
+    await serve
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--clients", type=int, default=20)
+    parser.add_argument("--delay", type=float, default=0.005)
+    parser.add_argument("--stall", type=float, default=60.0)
+    parser.add_argument("--grace", type=float, default=main.Config.RESUME_GRACE_SECONDS)
+    parser.add_argument("--timeout", type=float, default=30.0)
+    args = parser.parse_args()
+    asyncio.run(run(args.clients, args.delay, args.stall, args.grace, args.timeout))
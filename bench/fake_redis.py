@@ -0,0 +1,185 @@
+"""
+进程内的 RESP 服务（Redis 的本地替身）
+
+支持 RedisSessionStore 用到的命令（delay 可模拟慢回复）：PING、AUTH、SELECT、GET、SET（EX / PX）、DEL、SCAN（MATCH / COUNT）、
+DBSIZE、INFO stats；键按 TTL 惰性过期，过期数计入 INFO 的 expired_keys。
+不需要安装 Redis 就可以检查会话存储的 RESP 客户端。
+
+运行方式（在项目根目录）：
+    python -m bench.fake_redis            # 启动替身并对 RedisSessionStore 执行 get / set / delete / TTL 检查
+    python -m bench.fake_redis --serve    # 只启动替身，供 SESSION_BACKEND=redis 的服务连接
+"""
+import argparse
+import asyncio
+import fnmatch
+import time
+from typing import Any, Optional
+
+from session_store import RedisError, RedisSessionStore
+
+
+def encode_reply(value: Any) -> bytes:
+    """编码一个 RESP 回复（str 为简单字符串，bytes 为批量字符串，RedisError 为错误）"""
+    if value is None:
+        return b"$-1\r\n"
+    if isinstance(value, RedisError):
+        return b"-" + str(value).encode() + b"\r\n"
+    if isinstance(value, int):
+        return b":%d\r\n" % value
+    if isinstance(value, str):
+        return b"+" + value.encode() + b"\r\n"
+    if isinstance(value, bytes):
+        return b"$%d\r\n%s\r\n" % (len(value), value)
+    return b"*%d\r\n" % len(value) + b"".join(encode_reply(item) for item in value)
+
+
+class FakeRedis:
+    """RESP 服务替身（单个数据库，数据只在内存中）"""
+
+    def __init__(self, password: Optional[str] = None):
+        self.password = password
+        # 键 -> (值, 过期的 monotonic 时间，None 表示不过期)
+        self.data: dict[bytes, tuple[bytes, Optional[float]]] = {}
+        self.expired = 0
+        self.commands = 0
+        # 每条命令回复前等待的秒数（模拟慢服务）
+        self.delay = 0.0
+        self._server: Optional[asyncio.Server] = None
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> int:
+        """启动服务，返回监听的端口"""
+        self._server = await asyncio.start_server(self._handle, host, port)
+        return self._server.sockets[0].getsockname()[1]
+
+    async def stop(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+
+    def _alive(self, key: bytes) -> Optional[bytes]:
+        entry = self.data.get(key)
+        if entry is None:
+            return None
+        if entry[1] is not None and entry[1] <= time.monotonic():
+            del self.data[key]
+            self.expired += 1
+            return None
+        return entry[0]
+
+    async def _read_command(self, reader: asyncio.StreamReader) -> Optional[list[bytes]]:
+        line = await reader.readline()
+        if not line:
+            return None
+        if not line.startswith(b"*"):
+            # 内联命令（如 redis-cli 的 PING）
+            return line.split()
+        args = []
+        for _ in range(int(line[1:-2])):
+            length = int((await reader.readline())[1:-2])
+            args.append((await reader.readexactly(length + 2))[:-2])
+        return args
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        authed = self.password is None
+        try:
+            while (args := await self._read_command(reader)) is not None:
+                if not args:
+                    continue
+                self.commands += 1
+                name = args[0].upper().decode()
+                if name == "AUTH":
+                    authed = args[1].decode() == self.password
+                    reply = "OK" if authed else RedisError("WRONGPASS invalid password")
+                elif not authed:
+                    reply = RedisError("NOAUTH Authentication required.")
+                else:
+                    reply = self.execute(name, args[1:])
+                if self.delay:
+                    await asyncio.sleep(self.delay)
+                writer.write(encode_reply(reply))
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    def execute(self, name: str, args: list[bytes]) -> Any:
+        """执行一条命令，返回回复的值"""
+        if name == "PING":
+            return "PONG"
+        if name == "SELECT":
+            return "OK"
+        if name == "GET":
+            return self._alive(args[0])
+        if name == "SET":
+            expires_at = None
+            options = [arg.upper() for arg in args[2:]]
+            if b"EX" in options:
+                expires_at = time.monotonic() + int(args[2 + options.index(b"EX") + 1])
+            elif b"PX" in options:
+                expires_at = time.monotonic() + int(args[2 + options.index(b"PX") + 1]) / 1000
+            self.data[args[0]] = (args[1], expires_at)
+            return "OK"
+        if name == "DEL":
+            return sum(1 for key in args if self._alive(key) is not None and self.data.pop(key, None))
+        if name == "DBSIZE":
+            return sum(1 for key in list(self.data) if self._alive(key) is not None)
+        if name == "SCAN":
+            # 一次返回全部匹配的键，游标总是 0
+            options = [arg.upper() for arg in args[1:]]
+            pattern = args[1 + options.index(b"MATCH") + 1].decode() if b"MATCH" in options else "*"
+            keys = [key for key in list(self.data) if self._alive(key) is not None]
+            return [b"0", [key for key in keys if fnmatch.fnmatchcase(key.decode(), pattern)]]
+        if name == "INFO":
+            return f"# Stats\r\nevicted_keys:0\r\nexpired_keys:{self.expired}\r\n".encode()
+        return RedisError(f"ERR unknown command '{name}'")
+
+
+async def check() -> None:
+    """对 RedisSessionStore 执行 get / set / delete / TTL / 计数 / 取消检查"""
+    server = FakeRedis(password="secret")
+    port = await server.start()
+    store = RedisSessionStore(f"redis://:secret@127.0.0.1:{port}/1", max_entries=100, ttl=0.2)
+    try:
+        assert await store.get("a") is None
+        await store.set("a", "resp_1")
+        await store.set("b", "resp_2")
+        assert await store.get("a") == "resp_1"
+        # 同一个库中的其他键不计入会话数
+        server.data[b"other:key"] = (b"x", None)
+        assert await store.size() == 2, await store.size()
+        # 等待回复时被取消：迟到的回复不能被下一条命令读到
+        server.delay = 0.1
+        try:
+            await asyncio.wait_for(store.get("a"), 0.02)
+        except asyncio.TimeoutError:
+            pass
+        server.delay = 0.0
+        assert await store.get("b") == "resp_2", "取消后读到了上一条命令的回复"
+        assert await store.delete("b") is True
+        assert await store.delete("b") is False
+        await asyncio.sleep(0.3)
+        assert await store.get("a") is None, "TTL 过期后仍能读到会话"
+        stats = await store.stats()
+        assert stats["size"] == 0 and stats["expirations"] >= 1, stats
+        print(f"RedisSessionStore 检查通过（{server.commands} 条命令）：{stats}")
+    finally:
+        await store.close()
+        await server.stop()
+
+
+async def serve(host: str, port: int, password: Optional[str]) -> None:
+    server = FakeRedis(password)
+    port = await server.start(host, port)
+    print(f"RESP 替身监听 {host}:{port}")
+    await asyncio.Event().wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--serve", action="store_true", help="只启动替身")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=6379)
+    parser.add_argument("--password", default=None)
+    args = parser.parse_args()
+    asyncio.run(serve(args.host, args.port, args.password) if args.serve else check())
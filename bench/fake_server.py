@@ -0,0 +1,190 @@
+"""
+本地伪造的 Responses API 服务（真实 HTTP 服务，供压测使用）
+
+POST /v1/responses 按配置的延迟与 token 速率回放一次完整的流式回答：
+created（首事件延迟）→ 推理摘要 → 联网搜索（搜索耗时）→ 文本增量 → completed。
+也可以用 --events 回放录制的事件流（JSONL，每行一个 Responses 流式事件的 JSON，
+即 event.model_dump_json() 的输出），每个请求替换为新的 response_id。
+每个流的帧在启动时预先编码，服务本身的开销很小，压测结果反映的是被测服务。
+
+运行方式（在项目根目录）：
+    python -m bench.fake_server --port 8100 --first-event-ms 300 --token-rate 50 --tokens 200
+被测服务使用 OPENAI_BASE_URL=http://127.0.0.1:8100/v1 OPENAI_API_KEY=fake
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import random
+from typing import AsyncIterator, Optional
+
+import uvicorn
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Route
+
+from bench.fake_upstream import build_events, encode_event
+
+# 按 token 速率发送的增量事件
+DELTA_EVENTS = ("response.output_text.delta", "response.reasoning_summary_text.delta")
+
+
+def load_events(path: str) -> list[dict]:
+    """读取录制的事件流（JSONL）"""
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+class StreamPlan:
+    """一次回答的预编码帧与每帧发送前的等待时间"""
+
+    def __init__(
+        self,
+        events: list[dict],
+        first_event: float,
+        token_rate: float,
+        search: float,
+        jitter: float = 0.0,
+    ):
+        """
+        Args:
+            events: 事件序列
+            first_event: 首个事件（created）前的延迟（秒）
+            token_rate: 每秒发送的增量事件数（0 表示不限速）
+            search: 每次联网搜索 searching 到 completed 的耗时（秒）
+            jitter: 首事件延迟与搜索耗时的随机浮动比例（0~1）
+        """
+        created = next((e for e in events if e["type"] == "response.created"), None)
+        self.response_id = created["response"]["id"] if created else None
+        self.frames = [encode_event(event) for event in events]
+        self.delays: list[float] = []
+        self.jittered: list[bool] = []
+        interval = 1.0 / token_rate if token_rate > 0 else 0.0
+        for i, event in enumerate(events):
+            if i == 0:
+                delay, jittered = first_event, True
+            elif event["type"] in DELTA_EVENTS:
+                delay, jittered = interval, False
+            elif event["type"] == "response.web_search_call.completed":
+                delay, jittered = search, True
+            else:
+                delay, jittered = 0.0, False
+            self.delays.append(delay)
+            self.jittered.append(jittered)
+        self.jitter = jitter
+        self.ideal = sum(self.delays)
+
+    async def stream(self, response_id: str) -> AsyncIterator[bytes]:
+        """按计划发送，response_id 替换为本次请求的 ID"""
+        old = f'"{self.response_id}"'.encode()
+        new = f'"{response_id}"'.encode()
+        for frame, delay, jittered in zip(self.frames, self.delays, self.jittered):
+            if jittered and self.jitter:
+                delay *= 1 + random.uniform(-self.jitter, self.jitter)
+            if delay > 0:
+                await asyncio.sleep(delay)
+            if self.response_id is not None and old in frame:
+                frame = frame.replace(old, new)
+            yield frame
+
+
+def create_app(plan: StreamPlan) -> Starlette:
+    """
+    创建伪造的 Responses API 应用
+
+    Args:
+        plan: 每个请求回放的流
+    """
+    counter = itertools.count()
+    served = {"requests": 0, "active": 0}
+
+    async def create_response(request: Request) -> StreamingResponse:
+        await request.body()
+        served["requests"] += 1
+
+        async def body() -> AsyncIterator[bytes]:
+            served["active"] += 1
+            try:
+                async for frame in plan.stream(f"resp_load_{next(counter)}"):
+                    yield frame
+            finally:
+                served["active"] -= 1
+
+        return StreamingResponse(body(), media_type="text/event-stream")
+
+    async def stats(request: Request) -> JSONResponse:
+        return JSONResponse({**served, "ideal_stream_seconds": plan.ideal})
+
+    return Starlette(routes=[
+        Route("/v1/responses", create_response, methods=["POST"]),
+        Route("/stats", stats),
+    ])
+
+
+def build_plan(
+    tokens: int = 200,
+    chunk: int = 4,
+    reasoning_tokens: int = 0,
+    web_searches: int = 0,
+    first_event_ms: float = 300.0,
+    token_rate: float = 50.0,
+    search_ms: float = 1500.0,
+    jitter: float = 0.0,
+    events_path: Optional[str] = None,
+) -> StreamPlan:
+    """
+    按参数构造回放计划
+
+    Args:
+        tokens: 回答的增量事件数
+        chunk: 每个增量事件的字符数
+        reasoning_tokens: 推理摘要的增量事件数
+        web_searches: 联网搜索次数
+        first_event_ms: 首事件延迟（毫秒）
+        token_rate: 每秒增量事件数
+        search_ms: 每次联网搜索耗时（毫秒）
+        jitter: 延迟的随机浮动比例
+        events_path: 录制的事件流，指定时忽略 tokens / chunk / reasoning_tokens / web_searches
+
+    Returns:
+        StreamPlan: 回放计划
+    """
+    if events_path:
+        events = load_events(events_path)
+    else:
+        text = ("这是一段用于压测的回答文本。" * (tokens * chunk // 14 + 1))[:tokens * chunk]
+        reasoning = ("先分析问题再组织回答。" * (reasoning_tokens * chunk // 11 + 1))[:reasoning_tokens * chunk]
+        events = build_events(text=text, reasoning=reasoning, web_searches=web_searches, chunk=chunk)
+    return StreamPlan(events, first_event_ms / 1000, token_rate, search_ms / 1000, jitter)
+
+
+def add_plan_arguments(parser: argparse.ArgumentParser) -> None:
+    """回放计划的命令行参数（压测脚本复用）"""
+    parser.add_argument("--tokens", type=int, default=200, help="回答的增量事件数")
+    parser.add_argument("--chunk", type=int, default=4, help="每个增量事件的字符数")
+    parser.add_argument("--reasoning-tokens", type=int, default=0, help="推理摘要的增量事件数")
+    parser.add_argument("--web-searches", type=int, default=0, help="联网搜索次数")
+    parser.add_argument("--first-event-ms", type=float, default=300.0, help="首事件延迟（毫秒）")
+    parser.add_argument("--token-rate", type=float, default=50.0, help="每个流每秒的增量事件数，0 表示不限速")
+    parser.add_argument("--search-ms", type=float, default=1500.0, help="每次联网搜索耗时（毫秒）")
+    parser.add_argument("--jitter", type=float, default=0.0, help="首事件延迟与搜索耗时的随机浮动比例")
+    parser.add_argument("--events", default=None, help="回放录制的事件流（JSONL）")
+
+
+def plan_from_args(args: argparse.Namespace) -> StreamPlan:
+    return build_plan(
+        args.tokens, args.chunk, args.reasoning_tokens, args.web_searches,
+        args.first_event_ms, args.token_rate, args.search_ms, args.jitter, args.events,
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100)
+    add_plan_arguments(parser)
+    args = parser.parse_args()
+    plan = plan_from_args(args)
+    print(f"伪造上游: {len(plan.frames)} 个事件/流，单流理想耗时 {plan.ideal:.2f}s")
+    uvicorn.run(create_app(plan), host=args.host, port=args.port, log_level="warning")
@@ -0,0 +1,141 @@
+"""
+本地伪造的 Responses API 上游（基于 httpx.MockTransport）
+
+用于基准测试，不产生任何真实的模型调用费用。
+"""
+import asyncio
+import json
+import time
+from typing import AsyncIterator, Iterator
+
+import httpx
+from openai import OpenAI, AsyncOpenAI
+
+
+def build_events(
+    text: str = "你好，这是一个用于压测的回答。",
+    response_id: str = "resp_fake",
+    reasoning: str = "",
+    web_searches: int = 0,
+    chunk: int = 1,
+) -> list[dict]:
+    """
+    构造一次完整回答的 Responses 流式事件序列
+
+    Args:
+        text: 回答文本，每 chunk 个字符一个 delta 事件
+        response_id: response.created 中的响应 ID
+        reasoning: 推理摘要文本，为空表示没有推理输出
+        web_searches: 回答前的联网搜索次数
+        chunk: 每个 delta 事件的字符数
+
+    Returns:
+        list[dict]: 事件列表（与 Responses API 的 JSON 结构一致）
+    """
+    response = {"id": response_id, "object": "response", "status": "in_progress", "output": []}
+    events: list[dict] = []
+
+    def add(event_type: str, **fields) -> None:
+        events.append({"type": event_type, "sequence_number": len(events), **fields})
+
+    def deltas(event_type: str, value: str, **fields) -> None:
+        for i in range(0, len(value), chunk):
+            add(event_type, delta=value[i:i + chunk], **fields)
+
+    add("response.created", response=response)
+    add("response.in_progress", response=response)
+    index = 0
+    if reasoning:
+        item = {"id": "rs_fake", "type": "reasoning", "summary": []}
+        part = {"type": "summary_text", "text": ""}
+        where = {"item_id": "rs_fake", "output_index": index, "summary_index": 0}
+        add("response.output_item.added", output_index=index, item=item)
+        add("response.reasoning_summary_part.added", part=part, **where)
+        deltas("response.reasoning_summary_text.delta", reasoning, **where)
+        add("response.reasoning_summary_text.done", text=reasoning, **where)
+        add("response.reasoning_summary_part.done", part={**part, "text": reasoning}, **where)
+        add("response.output_item.done", output_index=index,
+            item={**item, "summary": [{"type": "summary_text", "text": reasoning}]})
+        index += 1
+    for n in range(web_searches):
+        item = {"id": f"ws_fake_{n}", "type": "web_search_call", "status": "in_progress",
+                "action": {"type": "search", "query": "fake"}}
+        where = {"item_id": f"ws_fake_{n}", "output_index": index}
+        add("response.output_item.added", output_index=index, item=item)
+        add("response.web_search_call.in_progress", **where)
+        add("response.web_search_call.searching", **where)
+        add("response.web_search_call.completed", **where)
+        add("response.output_item.done", output_index=index, item={**item, "status": "completed"})
+        index += 1
+    where = {"item_id": "msg_fake", "output_index": index, "content_index": 0}
+    add("response.output_item.added", output_index=index,
+        item={"id": "msg_fake", "type": "message", "role": "assistant", "status": "in_progress", "content": []})
+    add("response.content_part.added", part={"type": "output_text", "text": "", "annotations": []}, **where)
+    deltas("response.output_text.delta", text, **where)
+    add("response.output_text.done", text=text, **where)
+    add("response.content_part.done", part={"type": "output_text", "text": text, "annotations": []}, **where)
+    add("response.output_item.done", output_index=index,
+        item={"id": "msg_fake", "type": "message", "role": "assistant", "status": "completed", "content": []})
+    add("response.completed", response={**response, "status": "completed"})
+    return events
+
+
+def encode_event(event: dict) -> bytes:
+    """将单个事件编码为 SSE 帧"""
+    return f"event: {event['type']}\ndata: {json.dumps(event, ensure_ascii=False)}\n\n".encode()
+
+
+def async_transport(events: list[dict], delay: float) -> httpx.MockTransport:
+    """
+    异步上游：每个事件之间 await asyncio.sleep(delay)
+
+    Args:
+        events: 要回放的事件序列
+        delay: 事件间隔（秒）
+    """
+    async def body() -> AsyncIterator[bytes]:
+        for event in events:
+            await asyncio.sleep(delay)
+            yield encode_event(event)
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        return httpx.Response(200, headers={"content-type": "text/event-stream"}, content=body())
+
+    return httpx.MockTransport(handler)
+
+
+def sync_transport(events: list[dict], delay: float) -> httpx.MockTransport:
+    """
+    同步上游：每个事件之间 time.sleep(delay)（模拟阻塞式读取）
+
+    Args:
+        events: 要回放的事件序列
+        delay: 事件间隔（秒）
+    """
+    def body() -> Iterator[bytes]:
+        for event in events:
+            time.sleep(delay)
+            yield encode_event(event)
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        return httpx.Response(200, headers={"content-type": "text/event-stream"}, content=body())
+
+    return httpx.MockTransport(handler)
+
+
+def fake_async_client(events: list[dict], delay: float) -> AsyncOpenAI:
+    """构造连接到伪造上游的异步客户端"""
+    return AsyncOpenAI(
+        base_url="http://fake-upstream/v1",
+        api_key="fake",
+        http_client=httpx.AsyncClient(transport=async_transport(events, delay)),
+    )
+
+
+def fake_sync_client(events: list[dict], delay: float) -> OpenAI:
+    """构造连接到伪造上游的同步客户端"""
+    return OpenAI(
+        base_url="http://fake-upstream/v1",
+        api_key="fake",
+        http_client=httpx.Client(transport=sync_transport(events, delay)),
+    )
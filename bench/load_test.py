@@ -0,0 +1,239 @@
+"""
+/api/chat 离线压测
+
+启动伪造的 Responses API 服务（bench.fake_server）与被测服务（uvicorn main:app，独立进程），
+以 --streams 个并发 SSE 会话发起共 --requests 次对话，统计：
+- 吞吐：每秒完成的对话数、每秒转发的 delta 帧数与字节数
+- 首字延迟（TTFT，发起请求到收到第一个 delta 帧）与首帧（created）延迟的分位数
+- 被测进程每个流消耗的 CPU 时间、每个并发流占用的内存（RSS 峰值增量 / 并发数）
+CPU 与内存读取 /proc（仅 Linux）。
+
+运行方式（在项目根目录）：
+    python -m bench.load_test --streams 200 --requests 1000 --token-rate 50 --tokens 200
+压测已经启动的服务：
+    python -m bench.load_test --target http://127.0.0.1:8000 --pid <服务进程 ID>
+"""
+import argparse
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import time
+from typing import Optional
+
+import httpx
+import numpy as np
+
+from bench.fake_server import add_plan_arguments
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def wait_ready(url: str, process: Optional[subprocess.Popen], timeout: float = 30.0) -> None:
+    """等待服务可以响应请求"""
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as http:
+        while time.monotonic() < deadline:
+            if process is not None and process.poll() is not None:
+                raise RuntimeError(f"{url} 启动失败（退出码 {process.returncode}）")
+            try:
+                await http.get(url)
+                return
+            except httpx.TransportError:
+                await asyncio.sleep(0.1)
+    raise RuntimeError(f"{url} 启动超时")
+
+
+class ProcessSampler:
+    """读取 /proc 中进程的 CPU 时间与 RSS"""
+
+    def __init__(self, pid: int):
+        self.pid = pid
+        self.ticks = os.sysconf("SC_CLK_TCK")
+        self.peak_rss = 0
+
+    def cpu_seconds(self) -> float:
+        with open(f"/proc/{self.pid}/stat") as f:
+            # 进程名可能含空格，从最后一个 ')' 之后开始按字段切分
+            fields = f.read().rsplit(")", 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / self.ticks
+
+    def rss_bytes(self) -> int:
+        with open(f"/proc/{self.pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+        return 0
+
+    async def sample(self, interval: float = 0.05) -> None:
+        """持续记录 RSS 峰值（由调用方取消）"""
+        while True:
+            self.peak_rss = max(self.peak_rss, self.rss_bytes())
+            await asyncio.sleep(interval)
+
+
+class Result:
+    """一次对话的测量结果"""
+
+    __slots__ = ("created", "ttft", "duration", "deltas", "bytes", "error")
+
+    def __init__(self):
+        self.created: Optional[float] = None
+        self.ttft: Optional[float] = None
+        self.duration = 0.0
+        self.deltas = 0
+        self.bytes = 0
+        self.error: Optional[str] = None
+
+
+async def one_chat(http: httpx.AsyncClient, url: str, i: int) -> Result:
+    """发起一次对话并读完整个 SSE 流"""
+    result = Result()
+    started = time.perf_counter()
+    try:
+        # 每个请求使用不同的问题与会话，避免命中回答缓存或被合并
+        payload = {"question": f"压测问题 {i}", "session_id": f"load-{i}"}
+        async with http.stream("POST", url, json=payload) as response:
+            if response.status_code != 200:
+                result.error = f"HTTP {response.status_code}"
+                return result
+            async for line in response.aiter_lines():
+                result.bytes += len(line) + 1
+                if not line.startswith("data: "):
+                    continue
+                if '"type":"delta"' in line:
+                    result.deltas += 1
+                    if result.ttft is None:
+                        result.ttft = time.perf_counter() - started
+                elif '"type":"created"' in line:
+                    result.created = time.perf_counter() - started
+                elif '"type":"error"' in line:
+                    result.error = line[6:]
+    except httpx.HTTPError as e:
+        result.error = repr(e)
+    finally:
+        result.duration = time.perf_counter() - started
+    return result
+
+
+def percentiles(values: list[float]) -> str:
+    if not values:
+        return "-"
+    p50, p90, p99 = np.percentile(np.array(values) * 1000, [50, 90, 99])
+    return f"p50 {p50:.1f}ms  p90 {p90:.1f}ms  p99 {p99:.1f}ms  max {max(values) * 1000:.1f}ms"
+
+
+async def load(target: str, streams: int, requests: int, sampler: Optional[ProcessSampler]) -> None:
+    url = f"{target}/api/chat"
+    semaphore = asyncio.Semaphore(streams)
+    limits = httpx.Limits(max_connections=streams, max_keepalive_connections=streams)
+
+    async def limited(http: httpx.AsyncClient, i: int) -> Result:
+        async with semaphore:
+            return await one_chat(http, url, i)
+
+    sampling = None
+    if sampler is not None:
+        baseline_rss = sampler.rss_bytes()
+        sampler.peak_rss = baseline_rss
+        cpu_before = sampler.cpu_seconds()
+        sampling = asyncio.create_task(sampler.sample())
+    started = time.perf_counter()
+    async with httpx.AsyncClient(timeout=None, limits=limits) as http:
+        results = await asyncio.gather(*[limited(http, i) for i in range(requests)])
+    wall = time.perf_counter() - started
+    if sampling is not None:
+        sampling.cancel()
+        cpu = sampler.cpu_seconds() - cpu_before
+
+    ok = [r for r in results if r.error is None]
+    errors = [r for r in results if r.error is not None]
+    deltas = sum(r.deltas for r in results)
+    sent = sum(r.bytes for r in results)
+    print(f"并发流: {streams}  对话数: {requests}  成功: {len(ok)}  失败: {len(errors)}  总耗时: {wall:.2f}s")
+    if errors:
+        print(f"  失败示例: {errors[0].error}")
+    print(f"吞吐: {len(ok) / wall:.1f} 对话/s  {deltas / wall:.0f} delta 帧/s  {sent / wall / 1024 / 1024:.2f} MiB/s")
+    print(f"首帧 created: {percentiles([r.created for r in ok if r.created is not None])}")
+    print(f"首字 TTFT:    {percentiles([r.ttft for r in ok if r.ttft is not None])}")
+    print(f"整个流:       {percentiles([r.duration for r in ok])}")
+    if sampler is not None:
+        print(f"被测进程 CPU: {cpu:.2f}s（{cpu / wall * 100:.0f}% 单核），每个流 {cpu / requests * 1000:.2f}ms")
+        growth = sampler.peak_rss - baseline_rss
+        print(
+            f"被测进程内存: 基线 {baseline_rss / 1024 / 1024:.1f} MiB，峰值 {sampler.peak_rss / 1024 / 1024:.1f} MiB，"
+            f"每个并发流 {growth / min(streams, requests) / 1024:.1f} KiB"
+        )
+    else:
+        print("未指定 --pid，跳过 CPU 与内存统计")
+
+
+async def load_quietly(target: str, requests: int) -> None:
+    """预热（建立连接、首次导入与解析的开销不计入结果）"""
+    async with httpx.AsyncClient(timeout=None) as http:
+        await asyncio.gather(*[one_chat(http, f"{target}/api/chat", -1 - i) for i in range(requests)])
+
+
+async def run(args: argparse.Namespace) -> None:
+    processes: list[subprocess.Popen] = []
+    try:
+        target = args.target
+        pid = args.pid
+        if target is None:
+            upstream_port = free_port()
+            upstream = subprocess.Popen([
+                sys.executable, "-m", "bench.fake_server", "--port", str(upstream_port),
+                "--tokens", str(args.tokens), "--chunk", str(args.chunk),
+                "--reasoning-tokens", str(args.reasoning_tokens), "--web-searches", str(args.web_searches),
+                "--first-event-ms", str(args.first_event_ms), "--token-rate", str(args.token_rate),
+                "--search-ms", str(args.search_ms), "--jitter", str(args.jitter),
+                *(["--events", args.events] if args.events else []),
+            ])
+            processes.append(upstream)
+            await wait_ready(f"http://127.0.0.1:{upstream_port}/stats", upstream)
+
+            port = free_port()
+            env = {
+                **os.environ,
+                "OPENAI_BASE_URL": f"http://127.0.0.1:{upstream_port}/v1",
+                "OPENAI_BASE_URLS": "",
+                "OPENAI_API_KEY": "fake",
+                "RESPONSE_CACHE_ENABLED": "false",
+                "ADMISSION_MAX_CONCURRENCY": str(args.admission),
+                "UPSTREAM_MAX_CONNECTIONS": str(max(100, args.streams)),
+                "UPSTREAM_MAX_KEEPALIVE": str(max(20, args.streams)),
+            }
+            server = subprocess.Popen(
+                [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+                env=env,
+            )
+            processes.append(server)
+            target = f"http://127.0.0.1:{port}"
+            pid = server.pid
+            await wait_ready(f"{target}/api/session/stats", server)
+
+        sampler = ProcessSampler(pid) if pid is not None and os.path.exists(f"/proc/{pid}") else None
+        if args.warmup:
+            await load_quietly(target, min(args.streams, args.warmup))
+        await load(target, args.streams, args.requests, sampler)
+    finally:
+        for process in reversed(processes):
+            process.terminate()
+            process.wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--streams", type=int, default=100, help="并发 SSE 会话数")
+    parser.add_argument("--requests", type=int, default=500, help="对话总数")
+    parser.add_argument("--warmup", type=int, default=10, help="正式压测前的预热对话数")
+    parser.add_argument("--admission", type=int, default=0, help="被测服务的 ADMISSION_MAX_CONCURRENCY（0 不限制）")
+    parser.add_argument("--target", default=None, help="压测已经启动的服务（不启动伪造上游与被测服务）")
+    parser.add_argument("--pid", type=int, default=None, help="--target 服务的进程 ID，用于统计 CPU 与内存")
+    add_plan_arguments(parser)
+    asyncio.run(run(parser.parse_args()))
@@ -0,0 +1,153 @@
+"""
+本地检索引擎基准测试
+
+生成 N 个合成分块（中英文混合、词频服从 Zipf 分布，文件带 category / date attributes），
+分批写入（每批一个分段），测量重新打开（内存映射）后的检索延迟分位数：
+无过滤、eq 过滤、and(eq, gte) 过滤、高选择性过滤；
+并与扫描全部 IVF 簇的精确检索比较前 10 条结果的召回率。
+
+运行方式（在项目根目录）：
+    python -m bench.local_search --chunks 1000000
+"""
+import argparse
+import os
+import random
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+from local_search import LocalVectorStore
+
+_ALPHABET = "的一是不了人我在有他这中大来上个国到说们为子和你地出道也时年得就那要下以生会自着去之过家学对可她里后小么心多天而能好都然没日于起还发成事只作当想看文无开手十用主行方又如前所本见经头面公同三已老从动两长知民样现分将外但身些与高意进把法此实回二理美点月明社长"
+_LETTERS = "abcdefghijklmnopqrstuvwxyz"
+CATEGORIES = ["finance", "hr", "legal", "support", "sales", "it", "ops", "product"]
+
+
+def vocabulary(size: int, rng: random.Random) -> list[str]:
+    words = set()
+    while len(words) < size:
+        if rng.random() < 0.7:
+            words.add("".join(rng.choices(_ALPHABET, k=rng.randint(2, 4))))
+        else:
+            words.add("".join(rng.choices(_LETTERS, k=rng.randint(3, 9))))
+    return sorted(words)
+
+
+def percentiles(samples: list[float]) -> str:
+    p50, p90, p99 = np.percentile(np.array(samples) * 1000, [50, 90, 99])
+    return f"p50 {p50:.2f}ms  p90 {p90:.2f}ms  p99 {p99:.2f}ms"
+
+
+def main(
+    chunks: int,
+    segment_chunks: int,
+    chunks_per_file: int,
+    words: int,
+    queries: int,
+    recall_queries: int,
+    directory: str,
+) -> None:
+    rng = random.Random(0)
+    np_rng = np.random.default_rng(0)
+    vocab = np.array(vocabulary(50_000, rng), dtype=object)
+    # Zipf 分布的词频（截断到词表大小）
+    ranks = np.arange(1, len(vocab) + 1)
+    weights = 1.0 / ranks ** 1.05
+    weights /= weights.sum()
+
+    store = LocalVectorStore(directory, max_segments=1_000_000)
+    sampled: list[str] = []
+    started = time.perf_counter()
+    file_index = 0
+    for start in range(0, chunks, segment_chunks):
+        count = min(segment_chunks, chunks - start)
+        picks = vocab[np_rng.choice(len(vocab), size=(count, words), p=weights)]
+        texts = [" ".join(row) for row in picks]
+        documents = []
+        for offset in range(0, count, chunks_per_file):
+            documents.append({
+                "file_id": f"file_{file_index}",
+                "filename": f"doc_{file_index}.txt",
+                "attributes": {
+                    "category": CATEGORIES[file_index % len(CATEGORIES)],
+                    "date": 1_600_000_000 + file_index * 600,
+                },
+                "chunks": texts[offset:offset + chunks_per_file],
+            })
+            file_index += 1
+        store.add_files(documents)
+        sampled.extend(rng.sample(texts, min(len(texts), queries // max(1, chunks // segment_chunks) + 1)))
+        print(f"  已写入 {start + count:,} 个分块（{time.perf_counter() - started:.1f}s）")
+    elapsed = time.perf_counter() - started
+    size = sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(directory) for name in names)
+    print(f"写入 {chunks:,} 个分块 / {file_index:,} 个文件: {elapsed:.1f}s（{chunks / elapsed:,.0f} 分块/秒），"
+          f"索引 {size / 1024 / 1024:.0f} MiB")
+
+    # 重新打开：数组以内存映射方式加载
+    started = time.perf_counter()
+    store = LocalVectorStore(directory)
+    print(f"打开索引: {(time.perf_counter() - started) * 1000:.0f}ms，{store.stats()}")
+    exact = LocalVectorStore(directory, nprobe=1_000_000)
+
+    median_date = 1_600_000_000 + file_index * 300
+    cases = {
+        "无过滤": None,
+        "eq": {"type": "eq", "key": "category", "value": "finance"},
+        "and(eq, gte)": {"type": "and", "filters": [
+            {"type": "eq", "key": "category", "value": "finance"},
+            {"type": "gte", "key": "date", "value": median_date},
+        ]},
+        "高选择性（1 个文件）": {"type": "eq", "key": "date", "value": median_date},
+    }
+    # 查询：取分块中的 3 个连续词，四分之一的查询删掉最长词的最后一个字符（模拟拼写错误）
+    questions = []
+    for text in sampled[:queries]:
+        tokens = text.split()
+        i = rng.randrange(max(1, len(tokens) - 3))
+        tokens = tokens[i:i + 3]
+        if rng.random() < 0.25:
+            longest = max(range(len(tokens)), key=lambda j: len(tokens[j]))
+            tokens[longest] = tokens[longest][:-1]
+        questions.append(" ".join(tokens))
+    for name, filters in cases.items():
+        for question in questions[:10]:
+            store.search(question, filters, 10)
+        latencies = []
+        returned = 0
+        recalled = expected = 0
+        for i, question in enumerate(questions):
+            started = time.perf_counter()
+            results = store.search(question, filters, 10)
+            latencies.append(time.perf_counter() - started)
+            returned += len(results)
+            if i < recall_queries:
+                truth = {(r["file_id"], r["content"][0]["text"]) for r in exact.search(question, filters, 10)}
+                recalled += len(truth & {(r["file_id"], r["content"][0]["text"]) for r in results})
+                expected += len(truth)
+        print(
+            f"{name}: {percentiles(latencies)}，平均返回 {returned / len(questions):.1f} 条，"
+            f"召回率 {recalled / max(expected, 1):.3f}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chunks", type=int, default=1_000_000, help="分块总数")
+    parser.add_argument("--segment-chunks", type=int, default=125_000, help="每个分段的分块数")
+    parser.add_argument("--chunks-per-file", type=int, default=50, help="每个文件的分块数")
+    parser.add_argument("--words", type=int, default=40, help="每个分块的词数")
+    parser.add_argument("--queries", type=int, default=200, help="每种过滤条件的查询次数")
+    parser.add_argument("--recall-queries", type=int, default=50, help="每种过滤条件与精确检索比较的查询数")
+    parser.add_argument("--dir", default=None, help="索引目录（默认临时目录，结束后删除）")
+    args = parser.parse_args()
+    directory = args.dir or tempfile.mkdtemp(prefix="local_search_bench_")
+    try:
+        main(
+            args.chunks, args.segment_chunks, args.chunks_per_file, args.words,
+            args.queries, args.recall_queries, directory,
+        )
+    finally:
+        if args.dir is None:
+            shutil.rmtree(directory, ignore_errors=True)
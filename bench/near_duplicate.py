@@ -0,0 +1,71 @@
+"""
+近似重复索引基准测试
+
+写入 N 个随机问题，测量近似重复（改写过的已缓存问题）与未命中查询的延迟分位数。
+
+运行方式（在项目根目录）：
+    python -m bench.near_duplicate --entries 1000000
+"""
+import argparse
+import random
+import time
+
+import numpy as np
+
+from near_duplicate import NearDuplicateIndex, context_id
+
+_ALPHABET = "的一是不了人我在有他这中大来上个国到说们为子和你地出道也时年得就那要下以生会自着去之过家学对可她里后小么心多天而能好都然没日于起还发成事只作当想看文无开手十用主行方又如前所本见经头面公同三已老从动两长知民样现分将外但身些与高意进把法此实回二理美点月明社长"
+
+
+def random_question(rng: random.Random) -> str:
+    return "".join(rng.choices(_ALPHABET, k=rng.randint(12, 40))) + "？"
+
+
+def rephrase(question: str, rng: random.Random) -> str:
+    """改写问题：改变标点、空白和语气词"""
+    return " " + question.rstrip("？") + rng.choice(["", "?", "呢？", "。。"])
+
+
+def percentile(samples: list[float], p: float) -> float:
+    return float(np.percentile(samples, p)) * 1000
+
+
+def main(entries: int, queries: int) -> None:
+    rng = random.Random(0)
+    index = NearDuplicateIndex(max_entries=entries)
+    context = context_id("g4o", [{"type": "web_search_preview"}], {"effort": "medium"})
+    questions = []
+
+    start = time.perf_counter()
+    for i in range(entries):
+        question = random_question(rng)
+        index.add(question, context, f"{i:064x}")
+        if i % max(1, entries // queries) == 0:
+            questions.append((question, f"{i:064x}"))
+    elapsed = time.perf_counter() - start
+    print(f"写入 {entries:,} 条: {elapsed:.1f}s ({entries / elapsed:,.0f} 条/秒)")
+
+    for name, make_query in [
+        ("近似重复", lambda q: rephrase(q, rng)),
+        ("未命中", lambda q: random_question(rng)),
+    ]:
+        latencies = []
+        found = 0
+        for question, key in questions[:queries]:
+            query = make_query(question)
+            start = time.perf_counter()
+            result = index.lookup(query, context)
+            latencies.append(time.perf_counter() - start)
+            found += result is not None and result[0] == key
+        print(
+            f"{name}: p50 {percentile(latencies, 50):.3f}ms, p99 {percentile(latencies, 99):.3f}ms, "
+            f"找回原问题 {found}/{len(latencies)}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--entries", type=int, default=1_000_000)
+    parser.add_argument("--queries", type=int, default=2000)
+    args = parser.parse_args()
+    main(args.entries, args.queries)
@@ -0,0 +1,93 @@
+"""
+SSE 编码器微基准
+
+对比原先的 if/elif + f-string 翻译方式与 sse.py 的查表 + 预编码方式，
+输出每秒可编码的事件数。
+
+运行方式（在项目根目录）：
+    python -m bench.sse_encoder --rounds 2000
+"""
+import argparse
+import time
+from types import SimpleNamespace
+from typing import Any, Callable
+
+from bench.fake_upstream import build_events
+from sse import DELTA_TYPES, FrameCoalescer, encode_event
+
+
+def to_event(data: dict) -> Any:
+    """将事件字典转换为可按属性访问的对象"""
+    return SimpleNamespace(**{
+        k: SimpleNamespace(**v) if isinstance(v, dict) else v for k, v in data.items()
+    })
+
+
+def legacy_encode(event: Any) -> str:
+    """原实现的翻译逻辑（逐个 delta 发送）"""
+    if event.type == "response.created":
+        return f'data: {{"type": "created", "id": "{event.response.id}"}}\n\n'
+    elif event.type == "response.in_progress":
+        return f'data: {{"type": "in_progress"}}\n\n'
+    elif event.type == "response.output_item.added":
+        return f'data: {{"type": "output_item_added"}}\n\n'
+    elif event.type == "response.content_part.added":
+        return f'data: {{"type": "content_part_added"}}\n\n'
+    elif event.type == "response.output_text.delta":
+        import json
+        text = json.dumps(event.delta)
+        return f'data: {{"type": "delta", "text": {text}}}\n\n'
+    elif event.type == "response.output_text.done":
+        return f'data: {{"type": "text_done"}}\n\n'
+    elif event.type == "response.content_part.done":
+        return f'data: {{"type": "content_part_done"}}\n\n'
+    elif event.type == "response.output_item.done":
+        return f'data: {{"type": "output_item_done"}}\n\n'
+    elif event.type == "response.completed":
+        return f'data: {{"type": "completed"}}\n\n'
+    return f'data: {{"type": "unknown", "event": "{str(event)}"}}\n\n'
+
+
+def legacy_run(events: list[Any]) -> int:
+    writes = 0
+    for event in events:
+        legacy_encode(event).encode()
+        writes += 1
+    return writes
+
+
+def table_run(events: list[Any]) -> int:
+    writes = 0
+    coalescer = FrameCoalescer(window_ms=30, max_bytes=1024)
+    for event in events:
+        kind = DELTA_TYPES.get(event.type)
+        if kind is not None:
+            data = coalescer.add_delta(kind, event.delta)
+        else:
+            data = coalescer.add_frame(encode_event(event))
+        if data:
+            writes += 1
+    if coalescer.flush():
+        writes += 1
+    return writes
+
+
+def measure(name: str, run: Callable[[list[Any]], int], events: list[Any], rounds: int) -> None:
+    start = time.perf_counter()
+    writes = 0
+    for _ in range(rounds):
+        writes += run(events)
+    elapsed = time.perf_counter() - start
+    total = len(events) * rounds
+    print(f"{name}: {total / elapsed:,.0f} 事件/秒, 每次回答 {writes // rounds} 次写出")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rounds", type=int, default=2000)
+    args = parser.parse_args()
+
+    text = "流式输出的压测文本。" * 30
+    events = [to_event(e) for e in build_events(text=text)]
+    measure("if/elif + f-string", legacy_run, events, args.rounds)
+    measure("查表 + 预编码", table_run, events, args.rounds)
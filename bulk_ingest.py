@@ -0,0 +1,290 @@
+"""
+目录 / glob 批量入库
+
+并发（有上限）计算哈希并上传文件内容，已登记的内容直接复用 file_id，
+已在目标 vector store 中的内容跳过；其余文件按 file batch 一次加入 vector store，
+每个文件带各自的 attributes（默认 source = 相对路径、date = 修改时间），
+用指数退避轮询 batch 状态，而不是逐个文件阻塞轮询。
+
+运行方式（在项目根目录）：
+    python -m bulk_ingest "data/**/*.pdf" --attributes '{"category": "finance"}' --concurrency 8
+"""
+import argparse
+import asyncio
+import glob
+import json
+import os
+import time
+from pathlib import Path
+from typing import Any, Optional
+
+from openai import AsyncOpenAI
+
+from file_registry import FileRegistry, hash_file
+
+# 单个 file batch 最多包含的文件数（API 上限）
+MAX_BATCH_FILES = 2000
+# batch 的终止状态
+BATCH_DONE = ("completed", "failed", "cancelled")
+
+
+def _within(path: str, root: str) -> bool:
+    """path 的真实路径是否在 root 的真实路径之下（解析符号链接）"""
+    real_root = os.path.realpath(root)
+    return os.path.commonpath([os.path.realpath(path), real_root]) == real_root
+
+
+def resolve_pattern(root: str, pattern: str) -> str:
+    """
+    把请求中的 pattern 限定在允许读取的根目录下
+
+    Args:
+        root: 允许读取的根目录
+        pattern: 相对 root 的目录或 glob
+
+    Returns:
+        str: root 下的目录或 glob
+
+    Raises:
+        ValueError: pattern 是绝对路径、包含 ..，或其中不含通配符的目录经符号链接指向 root 之外
+    """
+    parts = Path(pattern).parts
+    if os.path.isabs(pattern) or os.path.splitdrive(pattern)[0]:
+        raise ValueError(f"pattern 必须是相对路径: {pattern}")
+    if ".." in parts:
+        raise ValueError(f"pattern 不能包含 ..: {pattern}")
+    # 通配符之前的部分是确定的目录，先检查它没有经符号链接离开 root
+    prefix = []
+    for part in parts:
+        if any(char in part for char in "*?["):
+            break
+        prefix.append(part)
+    if not _within(os.path.join(root, *prefix), root):
+        raise ValueError(f"pattern 指向允许读取的目录之外: {pattern}")
+    return os.path.join(root, pattern)
+
+
+def collect_files(pattern: str, root: Optional[str] = None) -> list[str]:
+    """
+    展开要入库的文件
+
+    Args:
+        pattern: 目录（递归包含其中所有文件）或 glob（支持 **）
+        root: 只保留真实路径在该目录之下的文件（排除经符号链接指向外部的文件），None 表示不限制
+
+    Returns:
+        list[str]: 排序后的文件路径
+    """
+    if os.path.isdir(pattern):
+        pattern = os.path.join(pattern, "**", "*")
+    paths = [path for path in glob.glob(pattern, recursive=True) if os.path.isfile(path)]
+    if root is not None:
+        paths = [path for path in paths if _within(path, root)]
+    return sorted(paths)
+
+
+def source_root(pattern: str, paths: list[str]) -> str:
+    """计算 source（相对路径）的根目录：目录本身，或匹配文件的公共父目录"""
+    if os.path.isdir(pattern):
+        return pattern
+    root = os.path.commonpath(paths or ["."])
+    return root if os.path.isdir(root) else os.path.dirname(root)
+
+
+def file_attributes(path: str, root: str, common: dict[str, Any], manifest: dict[str, dict]) -> dict[str, Any]:
+    """单个文件的 attributes：默认值 < 公共 attributes < 清单中该文件的 attributes"""
+    relative = os.path.relpath(path, root)
+    return {
+        "source": relative,
+        "date": int(os.path.getmtime(path)),
+        **common,
+        **manifest.get(relative, {}),
+    }
+
+
+class IngestReport:
+    """批量入库的统计"""
+
+    def __init__(self, total: int):
+        self.total = total
+        self.started = time.monotonic()
+        # 新上传内容的文件数与字节数
+        self.uploaded = 0
+        self.uploaded_bytes = 0
+        # 复用已登记 file_id 的文件数
+        self.reused = 0
+        # 已在 vector store 中而跳过的文件数
+        self.skipped = 0
+        self.attached = 0
+        self.batches = 0
+        self.polls = 0
+        self.failures: list[dict[str, str]] = []
+
+    def fail(self, path: str, error: str) -> None:
+        self.failures.append({"path": path, "error": error})
+
+    def to_dict(self) -> dict[str, Any]:
+        elapsed = time.monotonic() - self.started
+        return {
+            "total": self.total,
+            "uploaded": self.uploaded,
+            "reused": self.reused,
+            "skipped": self.skipped,
+            "attached": self.attached,
+            "failed": len(self.failures),
+            "batches": self.batches,
+            "polls": self.polls,
+            "elapsed_seconds": elapsed,
+            "files_per_second": (self.attached + self.skipped) / elapsed if elapsed > 0 else 0.0,
+            "upload_mib_per_second": self.uploaded_bytes / 1024 / 1024 / elapsed if elapsed > 0 else 0.0,
+            "failures": self.failures,
+        }
+
+
+async def wait_batch(
+    client: AsyncOpenAI,
+    vector_store_id: str,
+    batch_id: str,
+    report: IngestReport,
+    initial_delay: float = 0.5,
+    max_delay: float = 10.0,
+) -> Any:
+    """用指数退避轮询 file batch，直到进入终止状态"""
+    delay = initial_delay
+    while True:
+        await asyncio.sleep(delay)
+        report.polls += 1
+        batch = await client.vector_stores.file_batches.retrieve(batch_id, vector_store_id=vector_store_id)
+        if batch.status in BATCH_DONE:
+            return batch
+        delay = min(delay * 2, max_delay)
+
+
+async def ingest_files(
+    client: AsyncOpenAI,
+    registry: FileRegistry,
+    vector_store_id: str,
+    paths: list[str],
+    root: str = ".",
+    attributes: Optional[dict[str, Any]] = None,
+    manifest: Optional[dict[str, dict]] = None,
+    concurrency: int = 8,
+    initial_delay: float = 0.5,
+    max_delay: float = 10.0,
+) -> dict[str, Any]:
+    """
+    批量入库
+
+    Args:
+        client: 异步 OpenAI 客户端
+        registry: 已上传文件的登记
+        vector_store_id: 目标 vector store
+        paths: 要入库的文件
+        root: 计算 source（相对路径）的根目录
+        attributes: 所有文件共用的 attributes
+        manifest: 相对路径 -> 该文件的 attributes
+        concurrency: 同时哈希 / 上传的文件数
+        initial_delay: 首次轮询 batch 前的等待秒数
+        max_delay: 轮询间隔上限（秒）
+
+    Returns:
+        dict: 入库统计（吞吐与失败的文件）
+    """
+    report = IngestReport(len(paths))
+    semaphore = asyncio.Semaphore(concurrency)
+    # sha256 -> (路径, file_id)，同一批中的相同内容只加入一次
+    pending: dict[str, tuple[str, str]] = {}
+
+    async def prepare(path: str) -> None:
+        async with semaphore:
+            try:
+                sha256 = await asyncio.to_thread(hash_file, path)
+                async with registry.lock(sha256):
+                    if registry.is_attached(vector_store_id, sha256) or sha256 in pending:
+                        report.skipped += 1
+                        return
+                    file_id = registry.file_id(sha256)
+                    if file_id is None:
+                        size = os.path.getsize(path)
+                        # 文件在线程中读取
+                        uploaded = await client.files.create(
+                            file=(os.path.basename(path), Path(path)), purpose="assistants"
+                        )
+                        file_id = uploaded.id
+                        await registry.add_file(sha256, file_id, os.path.basename(path), size)
+                        report.uploaded += 1
+                        report.uploaded_bytes += size
+                    else:
+                        report.reused += 1
+                    pending[sha256] = (path, file_id)
+            except Exception as e:
+                report.fail(path, str(e))
+
+    await asyncio.gather(*[prepare(path) for path in paths])
+
+    items = list(pending.items())
+    for start in range(0, len(items), MAX_BATCH_FILES):
+        chunk = items[start:start + MAX_BATCH_FILES]
+        by_file_id = {file_id: (sha256, path) for sha256, (path, file_id) in chunk}
+        try:
+            batch = await client.vector_stores.file_batches.create(
+                vector_store_id,
+                files=[
+                    {"file_id": file_id, "attributes": file_attributes(path, root, attributes or {}, manifest or {})}
+                    for _, (path, file_id) in chunk
+                ],
+            )
+            report.batches += 1
+            if batch.status not in BATCH_DONE:
+                batch = await wait_batch(client, vector_store_id, batch.id, report, initial_delay, max_delay)
+            failed: dict[str, str] = {}
+            if batch.file_counts.failed or batch.file_counts.cancelled or batch.status != "completed":
+                async for item in client.vector_stores.file_batches.list_files(
+                    batch.id, vector_store_id=vector_store_id, limit=100
+                ):
+                    if item.status != "completed":
+                        failed[item.id] = item.last_error.message if item.last_error else item.status
+        except Exception as e:
+            for _, (path, _) in chunk:
+                report.fail(path, str(e))
+            continue
+        for file_id, (sha256, path) in by_file_id.items():
+            if file_id in failed:
+                report.fail(path, failed[file_id])
+            else:
+                await registry.attach(vector_store_id, sha256, file_id)
+                report.attached += 1
+    return report.to_dict()
+
+
+async def run(args: argparse.Namespace) -> None:
+    # 复用服务的配置（上游地址、连接池、登记数据库与默认 vector store）
+    import main as app
+
+    client = app.get_async_client()
+    try:
+        paths = collect_files(args.pattern)
+        manifest = {}
+        if args.manifest:
+            with open(args.manifest, encoding="utf-8") as f:
+                manifest = json.load(f)
+        vector_store_id = await app.resolve_vector_store(client, args.vector_store_id)
+        print(f"入库 {len(paths)} 个文件到 {vector_store_id}")
+        report = await ingest_files(
+            client, app.file_registry, vector_store_id, paths, source_root(args.pattern, paths),
+            json.loads(args.attributes), manifest, args.concurrency or app.Config.INGEST_CONCURRENCY,
+        )
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    finally:
+        await client.close()
+        app.file_registry.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("pattern", help="目录或 glob（支持 **）")
+    parser.add_argument("--vector-store-id", default=None, help="目标 vector store，默认使用 VECTOR_STORE_NAME")
+    parser.add_argument("--attributes", default="{}", help="所有文件共用的 attributes（JSON）")
+    parser.add_argument("--manifest", default=None, help="相对路径 -> attributes 的 JSON 文件")
+    parser.add_argument("--concurrency", type=int, default=0, help="同时上传的文件数，默认 INGEST_CONCURRENCY")
+    asyncio.run(run(parser.parse_args()))
@@ -0,0 +1,211 @@
+"""
+流式文档分块与增量重建索引
+
+文档逐页解析（PDF 用 pypdf 每次只提取一页的文本，文本文件按行读取），
+每页按字符数切分为相邻重叠的分块，解析与切分都是生成器；分块攒够一批写入本地检索库的一个分段。
+一个文件的全部分块必须写入同一个分段，所以内存中最多保留一个文件的全部分块文本
+（约为文件文本的 max_chars / (max_chars - overlap) 倍）加上不足一批的待写入分块，内存占用随最大的单个文件增长。
+
+重新入库时先比较源文件的 SHA-256、分块参数与 attributes（不含取自修改时间的 date），没有变化的文件直接跳过；
+变化的文件替换为新版本，其中内容哈希未变的分块复用原来的向量，只为新的或改动过的分块计算向量，
+修改 FAQ 的一页不会重新计算整个语料的向量。
+
+文本文件没有页，按段落（空行）切成“页”：在内容决定的段落处断开（段落哈希满足条件或达到长度上限），
+插入或删除一段后，后面的页边界很快与旧版本重新对齐，只有附近的分块发生变化。
+"""
+import os
+import time
+import zlib
+from typing import Any, Iterator, NamedTuple, Optional
+
+from bulk_ingest import file_attributes
+from file_registry import hash_file
+from local_search import BUILD_BATCH, LocalVectorStore, chunk_text
+
+# 文本文件每“页”的字符数上限
+PAGE_CHARS = 4000
+# 文本文件的页不小于该字符数
+MIN_PAGE_CHARS = 1000
+# 段落哈希能被该值整除时在此处断页（平均约每 4 段一页）
+PAGE_DIVISOR = 4
+# 每次读取一行的字符数上限（超长的行被分成多次读取）
+LINE_CHARS = 64 * 1024
+# 按 PDF 解析的扩展名
+PDF_SUFFIXES = (".pdf",)
+
+
+class Page(NamedTuple):
+    """一页文本（页码从 1 开始）"""
+    number: int
+    text: str
+
+
+class Chunk(NamedTuple):
+    """一个分块及其所在页"""
+    page: int
+    text: str
+
+
+def iter_pdf_pages(path: str) -> Iterator[Page]:
+    """逐页提取 PDF 文本（页对象按需解析）"""
+    from pypdf import PdfReader
+
+    with open(path, "rb") as f:
+        reader = PdfReader(f)
+        for number, page in enumerate(reader.pages, 1):
+            yield Page(number, page.extract_text() or "")
+
+
+def iter_text_pages(path: str, page_chars: int = PAGE_CHARS) -> Iterator[Page]:
+    """按行读取文本文件，在内容决定的段落边界处切成页"""
+    number = 0
+    page: list[str] = []
+    paragraph: list[str] = []
+    size = 0
+    with open(path, encoding="utf-8", errors="replace") as f:
+        for line in iter(lambda: f.readline(LINE_CHARS), ""):
+            page.append(line)
+            size += len(line)
+            if line.strip():
+                paragraph.append(line)
+                if size < 2 * page_chars:
+                    continue
+            elif not paragraph:
+                continue
+            # 段落结束（或没有空行的超长段落）：只看这一段的内容决定是否断页
+            boundary = zlib.crc32("".join(paragraph).encode("utf-8")) % PAGE_DIVISOR == 0
+            paragraph = []
+            if size >= page_chars or (boundary and size >= MIN_PAGE_CHARS):
+                number += 1
+                yield Page(number, "".join(page))
+                page, size = [], 0
+    if page:
+        yield Page(number + 1, "".join(page))
+
+
+def iter_pages(path: str) -> Iterator[Page]:
+    """按扩展名逐页解析文档（PDF 或 UTF-8 文本）"""
+    if path.lower().endswith(PDF_SUFFIXES):
+        return iter_pdf_pages(path)
+    return iter_text_pages(path)
+
+
+def iter_chunks(pages: Iterator[Page], max_chars: int = 800, overlap: int = 200) -> Iterator[Chunk]:
+    """
+    把页切分为分块
+
+    分块不跨页，某一页的修改只影响该页的分块。
+
+    Args:
+        pages: 逐页的文本
+        max_chars: 每个分块的最大字符数
+        overlap: 同一页相邻分块重叠的字符数
+
+    Returns:
+        Iterator[Chunk]: 分块（所在页与文本）
+    """
+    for page in pages:
+        for text in chunk_text(page.text, max_chars, overlap):
+            yield Chunk(page.number, text)
+
+
+def _same_attributes(old: dict[str, Any], new: dict[str, Any], compare_date: bool) -> bool:
+    """比较 attributes；date 取自修改时间时不参与比较（touch 或重新检出内容未变的文件不会重新写入）"""
+    if compare_date:
+        return old == new
+    return {k: v for k, v in old.items() if k != "date"} == {k: v for k, v in new.items() if k != "date"}
+
+
+def index_files(
+    store: LocalVectorStore,
+    paths: list[str],
+    root: str = ".",
+    attributes: Optional[dict[str, Any]] = None,
+    manifest: Optional[dict[str, dict]] = None,
+    max_chars: int = 800,
+    overlap: int = 200,
+    batch_chunks: int = BUILD_BATCH,
+) -> dict[str, Any]:
+    """
+    增量写入本地检索库（CPU / 磁盘密集，在线程中调用）
+
+    file_id 为相对 root 的路径；源文件内容、分块参数与 attributes 都没有变化的文件跳过
+    （date 没有在 attributes 或 manifest 中指定时取自修改时间，不参与比较）。
+    一个文件的分块全部收集后才能写入（同一文件不能跨分段），峰值内存约为最大单个文件的分块文本
+    加上 batch_chunks 个待写入的分块。
+
+    Args:
+        store: 目标检索库
+        paths: 要写入的文件
+        root: 计算 source（相对路径）的根目录
+        attributes: 所有文件共用的 attributes
+        manifest: 相对路径 -> 该文件的 attributes
+        max_chars: 每个分块的最大字符数
+        overlap: 相邻分块重叠的字符数
+        batch_chunks: 攒够该分块数写入一个分段
+
+    Returns:
+        dict: 文件数（跳过 / 写入 / 失败）、分块数（重新计算向量 / 复用向量）与耗时
+    """
+    started = time.monotonic()
+    embedded, reused = store.embedded_chunks, store.reused_chunks
+    report: dict[str, Any] = {"total": len(paths), "skipped": 0, "indexed": 0, "chunks": 0, "pages": 0}
+    failures: list[dict[str, str]] = []
+    pending: list[dict[str, Any]] = []
+    pending_chunks = 0
+    # 与文件一起保存，分块参数变化时内容未变的文件也要重新切分
+    chunking = {"max_chars": max_chars, "overlap": overlap}
+
+    def flush() -> None:
+        nonlocal pending, pending_chunks
+        if pending:
+            store.add_files(pending)
+            report["indexed"] += len(pending)
+            report["chunks"] += pending_chunks
+            pending, pending_chunks = [], 0
+
+    for path in paths:
+        try:
+            sha256 = hash_file(path)
+            file_attrs = file_attributes(path, root, attributes or {}, manifest or {})
+            file_id = file_attrs["source"]
+            explicit_date = "date" in (attributes or {}) or "date" in (manifest or {}).get(file_id, {})
+            info = store.file_info(file_id)
+            if (
+                info is not None
+                and info.get("sha256") == sha256
+                and info.get("chunking") == chunking
+                and _same_attributes(info["attributes"], file_attrs, explicit_date)
+            ):
+                report["skipped"] += 1
+                continue
+            chunks = []
+            last_page = 0
+            for chunk in iter_chunks(iter_pages(path), max_chars, overlap):
+                chunks.append(chunk.text)
+                last_page = chunk.page
+            report["pages"] += last_page
+            pending.append({
+                "file_id": file_id,
+                "filename": os.path.basename(path),
+                "attributes": file_attrs,
+                "sha256": sha256,
+                "chunking": chunking,
+                "chunks": chunks,
+            })
+            pending_chunks += len(chunks)
+        except Exception as e:
+            failures.append({"path": path, "error": str(e)})
+            continue
+        if pending_chunks >= batch_chunks:
+            flush()
+    flush()
+    elapsed = time.monotonic() - started
+    return {
+        **report,
+        "failed": len(failures),
+        "embedded_chunks": store.embedded_chunks - embedded,
+        "reused_chunks": store.reused_chunks - reused,
+        "elapsed_seconds": elapsed,
+        "failures": failures,
+    }
@@ -0,0 +1,162 @@
+"""
+按内容哈希管理已上传的文件与 vector store
+
+SQLite 中记录 内容 SHA-256 → file_id、vector store 中已有哪些内容、按名称查找 vector store，
+相同的字节不会重复上传（也不会在同一个 vector store 中重复索引），
+上传可以指定已有的 vector store，不再每次新建。
+启动时把映射全部载入内存，热路径上的查找是字典查找；写入在线程池中执行。
+"""
+import asyncio
+import hashlib
+import sqlite3
+import threading
+import time
+import weakref
+from typing import Any, Callable, Optional
+
+# 计算哈希时每次读取的字节数
+HASH_CHUNK_BYTES = 1024 * 1024
+
+
+def hash_file(path: str) -> str:
+    """分块计算文件内容的 SHA-256（在线程中调用）"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(HASH_CHUNK_BYTES):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class FileRegistry:
+    """内容哈希 → file_id → vector store 的本地登记"""
+
+    def __init__(self, path: str = "file_registry.db"):
+        """
+        Args:
+            path: SQLite 数据库文件路径
+        """
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS files ("
+            " sha256 TEXT PRIMARY KEY,"
+            " file_id TEXT NOT NULL,"
+            " filename TEXT NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " created_at REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS vector_stores ("
+            " vector_store_id TEXT PRIMARY KEY,"
+            " name TEXT NOT NULL,"
+            " created_at REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS store_files ("
+            " vector_store_id TEXT NOT NULL,"
+            " sha256 TEXT NOT NULL,"
+            " file_id TEXT NOT NULL,"
+            " attached_at REAL NOT NULL,"
+            " PRIMARY KEY (vector_store_id, sha256))"
+        )
+        self._lock = threading.Lock()
+        # 内存中的映射（与数据库保持一致）
+        self._files: dict[str, str] = dict(self._conn.execute("SELECT sha256, file_id FROM files"))
+        # 同名的 vector store 使用最早创建的一个
+        self._stores_by_name: dict[str, str] = {
+            name: store_id
+            for store_id, name in self._conn.execute(
+                "SELECT vector_store_id, name FROM vector_stores ORDER BY created_at DESC"
+            )
+        }
+        self._attached: set[tuple[str, str]] = set(
+            self._conn.execute("SELECT vector_store_id, sha256 FROM store_files")
+        )
+        # 同一内容的上传串行执行，并发上传相同文件时只上传一次（键为 SHA-256 或 vector store 名称）
+        self._digest_locks: weakref.WeakValueDictionary[str, asyncio.Lock] = weakref.WeakValueDictionary()
+        # 文件加入 vector store 时的回调（参数为 vector_store_id），如使检索缓存失效
+        self._attach_listeners: list[Callable[[str], None]] = []
+        self.file_hits = 0
+        self.store_hits = 0
+
+    def lock(self, key: str) -> asyncio.Lock:
+        """同一内容（或同名 vector store 创建）的锁"""
+        lock = self._digest_locks.get(key)
+        if lock is None:
+            lock = self._digest_locks[key] = asyncio.Lock()
+        return lock
+
+    def file_id(self, sha256: str) -> Optional[str]:
+        """已上传的相同内容的 file_id"""
+        file_id = self._files.get(sha256)
+        if file_id is not None:
+            self.file_hits += 1
+        return file_id
+
+    def is_attached(self, vector_store_id: str, sha256: str) -> bool:
+        """vector store 中是否已有相同内容"""
+        attached = (vector_store_id, sha256) in self._attached
+        if attached:
+            self.store_hits += 1
+        return attached
+
+    def store_id(self, name: str) -> Optional[str]:
+        """按名称查找 vector store"""
+        return self._stores_by_name.get(name)
+
+    def on_attach(self, listener: Callable[[str], None]) -> None:
+        """注册文件加入 vector store 时的回调"""
+        self._attach_listeners.append(listener)
+
+    def _execute(self, sql: str, params: tuple) -> None:
+        with self._lock:
+            self._conn.execute(sql, params)
+
+    async def add_file(self, sha256: str, file_id: str, filename: str, size: int) -> None:
+        """记录已上传的文件"""
+        self._files[sha256] = file_id
+        await asyncio.to_thread(
+            self._execute,
+            "INSERT OR REPLACE INTO files (sha256, file_id, filename, size, created_at) VALUES (?, ?, ?, ?, ?)",
+            (sha256, file_id, filename, size, time.time()),
+        )
+
+    async def forget_file(self, sha256: str) -> None:
+        """远端文件已不存在时删除记录"""
+        self._files.pop(sha256, None)
+        await asyncio.to_thread(self._execute, "DELETE FROM files WHERE sha256 = ?", (sha256,))
+
+    async def add_store(self, vector_store_id: str, name: str) -> None:
+        """记录新建的 vector store"""
+        self._stores_by_name.setdefault(name, vector_store_id)
+        await asyncio.to_thread(
+            self._execute,
+            "INSERT OR IGNORE INTO vector_stores (vector_store_id, name, created_at) VALUES (?, ?, ?)",
+            (vector_store_id, name, time.time()),
+        )
+
+    async def attach(self, vector_store_id: str, sha256: str, file_id: str) -> None:
+        """记录文件已加入 vector store"""
+        self._attached.add((vector_store_id, sha256))
+        for listener in self._attach_listeners:
+            listener(vector_store_id)
+        await asyncio.to_thread(
+            self._execute,
+            "INSERT OR REPLACE INTO store_files (vector_store_id, sha256, file_id, attached_at) VALUES (?, ?, ?, ?)",
+            (vector_store_id, sha256, file_id, time.time()),
+        )
+
+    def stats(self) -> dict[str, Any]:
+        """登记数量与去重命中次数"""
+        return {
+            "files": len(self._files),
+            "vector_stores": len(self._stores_by_name),
+            "attachments": len(self._attached),
+            "file_hits": self.file_hits,
+            "store_hits": self.store_hits,
+        }
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,142 @@
+"""
+对冲请求
+
+上游的首个事件（response.created）迟迟不到时，再发起一个相同的请求，
+使用先收到首个事件的流并关闭另一个，降低首事件延迟的长尾。
+对冲延迟可以固定，也可以取最近首事件延迟的分位数；对冲次数受比例上限约束，
+避免上游整体变慢时请求量翻倍。
+"""
+import asyncio
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Optional
+
+import numpy as np
+
+# 打开一次上游流并读到首个事件：返回 (流, 首个事件)，流需提供 close() 协程
+OpenAttempt = Callable[[], Awaitable[tuple[Any, Any]]]
+
+
+async def _close_attempt(task: asyncio.Task) -> None:
+    # 取消未完成的尝试；已经拿到流的尝试关闭其连接
+    if not task.done():
+        task.cancel()
+        try:
+            await task
+        except BaseException:
+            pass
+        return
+    if not task.cancelled() and task.exception() is None:
+        stream, _ = task.result()
+        await stream.close()
+
+
+class Hedger:
+    """首事件延迟统计与对冲决策"""
+
+    def __init__(
+        self,
+        enabled: bool = False,
+        delay: float = 0.0,
+        percentile: float = 95.0,
+        max_rate: float = 0.05,
+        min_samples: int = 50,
+        window: int = 1000,
+    ):
+        """
+        Args:
+            enabled: 是否对冲（关闭时仍统计首事件延迟）
+            delay: 固定的对冲延迟（秒），0 表示使用最近首事件延迟的 percentile 分位数
+            percentile: 学习对冲延迟时使用的分位数
+            max_rate: 对冲请求数占请求总数的比例上限
+            min_samples: 学习对冲延迟前至少需要的样本数，不足时不对冲
+            window: 保留的最近首事件延迟样本数
+        """
+        self.enabled = enabled
+        self.fixed_delay = delay
+        self.percentile = percentile
+        self.max_rate = max_rate
+        self.min_samples = min_samples
+        self._samples: deque[float] = deque(maxlen=window)
+        # 令牌桶：每个请求增加 max_rate 个令牌，每次对冲消耗 1 个
+        self._tokens = 1.0
+        self.requests = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.budget_exhausted = 0
+
+    def delay(self) -> Optional[float]:
+        """当前的对冲延迟（秒），None 表示不对冲"""
+        if not self.enabled:
+            return None
+        if self.fixed_delay > 0:
+            return self.fixed_delay
+        if len(self._samples) < self.min_samples:
+            return None
+        return float(np.percentile(np.fromiter(self._samples, dtype=np.float64), self.percentile))
+
+    def _take_token(self) -> bool:
+        if self._tokens >= 1.0:
+            self._tokens -= 1.0
+            return True
+        self.budget_exhausted += 1
+        return False
+
+    async def first_event(self, open_attempt: OpenAttempt) -> tuple[Any, Any]:
+        """
+        打开上游流并读到首个事件，必要时对冲
+
+        Args:
+            open_attempt: 发起一次上游请求并读到首个事件
+
+        Returns:
+            tuple[Any, Any]: (胜出的流, 首个事件)
+        """
+        self.requests += 1
+        self._tokens = min(self._tokens + self.max_rate, 10.0)
+        delay = self.delay()
+        attempts = {asyncio.create_task(self._timed(open_attempt)): False}
+        try:
+            done, _ = await asyncio.wait(attempts, timeout=delay)
+            if not done and self._take_token():
+                self.hedged += 1
+                attempts[asyncio.create_task(self._timed(open_attempt))] = True
+            pending = set(attempts)
+            error: Optional[BaseException] = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if attempts[task]:
+                            self.hedge_wins += 1
+                        del attempts[task]
+                        return task.result()
+                    error = error or task.exception()
+            raise error
+        finally:
+            # 关闭落败（或因异常未使用）的尝试
+            for task in attempts:
+                await _close_attempt(task)
+
+    async def _timed(self, open_attempt: OpenAttempt) -> tuple[Any, Any]:
+        started = time.monotonic()
+        result = await open_attempt()
+        self._samples.append(time.monotonic() - started)
+        return result
+
+    def stats(self) -> dict[str, Any]:
+        """首事件延迟分位数与对冲统计"""
+        samples = np.fromiter(self._samples, dtype=np.float64)
+        p50, p99 = np.percentile(samples, [50, 99]) if len(samples) else (0.0, 0.0)
+        return {
+            "enabled": self.enabled,
+            "hedge_delay": self.delay(),
+            "first_event_p50": float(p50),
+            "first_event_p99": float(p99),
+            "samples": len(samples),
+            "requests": self.requests,
+            "hedged": self.hedged,
+            "hedge_rate": self.hedged / self.requests if self.requests else 0.0,
+            "hedge_wins": self.hedge_wins,
+            "budget_exhausted": self.budget_exhausted,
+        }
@@ -0,0 +1,308 @@
+"""
+文件上传与后台入库
+
+multipart 请求体按块流式解析，文件内容分批写入临时文件（内存占用与文件大小无关）并同时计算 SHA-256，
+超过大小上限时立即中止；入库（上传到 vector store 并等待索引完成）交给固定数量的后台 worker，
+接口立即返回任务 ID，客户端轮询任务状态。
+"""
+import asyncio
+import hashlib
+import os
+import tempfile
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, AsyncIterator, Awaitable, Callable, Optional
+
+from python_multipart.exceptions import MultipartParseError
+from python_multipart.multipart import MultipartParser, parse_options_header
+
+
+class UploadRejected(Exception):
+    """上传请求无效"""
+
+    def __init__(self, message: str, status_code: int):
+        super().__init__(message)
+        # 400：请求格式错误；413：文件过大；429：入库队列已满
+        self.status_code = status_code
+
+
+class ReceivedFile:
+    """已写入临时文件的上传文件"""
+
+    def __init__(self, filename: str, path: str, size: int, sha256: Optional[str] = None):
+        self.filename = filename
+        self.path = path
+        self.size = size
+        # 内容的 SHA-256（十六进制）
+        self.sha256 = sha256
+
+
+def _write(out: Any, digest: Any, data: bytes) -> None:
+    # 在线程中写入并更新哈希
+    digest.update(data)
+    out.write(data)
+
+
+async def receive_upload(
+    content_type: str,
+    body: AsyncIterator[bytes],
+    directory: Optional[str] = None,
+    max_bytes: int = 512 * 1024 * 1024,
+    chunk_bytes: int = 1024 * 1024,
+    field: str = "file",
+) -> ReceivedFile:
+    """
+    流式接收 multipart 请求中的一个文件
+
+    Args:
+        content_type: 请求的 Content-Type（需包含 boundary）
+        body: 请求体分块（Request.stream()）
+        directory: 临时文件目录，None 表示系统临时目录
+        max_bytes: 文件大小上限，超出时中止接收
+        chunk_bytes: 累积到该字节数后在线程池中写入一次磁盘
+        field: 文件所在的表单字段名
+
+    Returns:
+        ReceivedFile: 临时文件路径、原始文件名、大小与 SHA-256
+
+    Raises:
+        UploadRejected: 不是 multipart 请求、请求体格式错误、没有文件（400）或文件过大（413）
+    """
+    mime, params = parse_options_header(content_type)
+    boundary = params.get(b"boundary")
+    if mime != b"multipart/form-data" or not boundary:
+        raise UploadRejected("请使用 multipart/form-data 上传文件", 400)
+
+    state: dict[str, Any] = {"headers": {}, "field": b"", "value": b"", "writing": False, "done": False}
+    buffer = bytearray()
+    digest = hashlib.sha256()
+    received: Optional[ReceivedFile] = None
+    out = None
+
+    def on_part_begin() -> None:
+        state["headers"] = {}
+
+    def on_header_field(data: bytes, start: int, end: int) -> None:
+        state["field"] += data[start:end]
+
+    def on_header_value(data: bytes, start: int, end: int) -> None:
+        state["value"] += data[start:end]
+
+    def on_header_end() -> None:
+        state["headers"][state["field"].lower()] = state["value"]
+        state["field"] = state["value"] = b""
+
+    def on_headers_finished() -> None:
+        nonlocal received, out
+        _, disposition = parse_options_header(state["headers"].get(b"content-disposition", b""))
+        filename = disposition.get(b"filename")
+        if state["done"] or disposition.get(b"name") != field.encode() or not filename:
+            return
+        name = os.path.basename(filename.decode("utf-8", "replace")) or "upload"
+        fd, path = tempfile.mkstemp(suffix=os.path.splitext(name)[1], dir=directory)
+        out = os.fdopen(fd, "wb")
+        received = ReceivedFile(name, path, 0)
+        state["writing"] = True
+
+    def on_part_data(data: bytes, start: int, end: int) -> None:
+        if state["writing"]:
+            buffer.extend(data[start:end])
+            received.size += end - start
+
+    def on_part_end() -> None:
+        if state["writing"]:
+            state["writing"] = False
+            state["done"] = True
+
+    parser = MultipartParser(boundary, {
+        "on_part_begin": on_part_begin,
+        "on_header_field": on_header_field,
+        "on_header_value": on_header_value,
+        "on_header_end": on_header_end,
+        "on_headers_finished": on_headers_finished,
+        "on_part_data": on_part_data,
+        "on_part_end": on_part_end,
+    })
+    try:
+        try:
+            async for chunk in body:
+                parser.write(chunk)
+                if received is not None and received.size > max_bytes:
+                    raise UploadRejected(f"文件超过大小上限 {max_bytes} 字节", 413)
+                if len(buffer) >= chunk_bytes:
+                    data = bytes(buffer)
+                    buffer.clear()
+                    await asyncio.to_thread(_write, out, digest, data)
+            parser.finalize()
+        except MultipartParseError as e:
+            raise UploadRejected(f"multipart 请求体格式错误: {e}", 400) from e
+        if received is None or not state["done"]:
+            raise UploadRejected(f"请求中没有 {field} 文件", 400)
+        if buffer:
+            await asyncio.to_thread(_write, out, digest, bytes(buffer))
+        await asyncio.to_thread(out.close)
+        received.sha256 = digest.hexdigest()
+        return received
+    except BaseException:
+        if out is not None:
+            out.close()
+            os.remove(received.path)
+        raise
+
+
+class IngestJob:
+    """一个后台入库任务"""
+
+    def __init__(
+        self,
+        job_id: str,
+        file: Optional[ReceivedFile],
+        options: Optional[dict[str, Any]] = None,
+        handler: Optional[Callable[["IngestJob"], Awaitable[Any]]] = None,
+    ):
+        self.id = job_id
+        # 上传的文件（批量入库服务器上的文件时为 None）
+        self.file = file
+        # 传给入库函数的参数（如目标 vector store）
+        self.options = options or {}
+        # 覆盖队列默认的入库函数
+        self.handler = handler
+        # queued / running / succeeded / failed
+        self.status = "queued"
+        self.result: Any = None
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "filename": self.file.filename if self.file is not None else None,
+            "size": self.file.size if self.file is not None else None,
+            "sha256": self.file.sha256 if self.file is not None else None,
+            "options": self.options,
+            "result": self.result,
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class IngestQueue:
+    """固定数量 worker 的后台入库队列"""
+
+    def __init__(
+        self,
+        handler: Callable[[IngestJob], Awaitable[Any]],
+        workers: int = 4,
+        max_queue: int = 100,
+        max_jobs: int = 1000,
+    ):
+        """
+        Args:
+            handler: 执行入库的协程函数，返回值记录为任务结果；结束后临时文件被删除
+            workers: 同时入库的文件数
+            max_queue: 最多排队的任务数，超出时拒绝新上传（429）
+            max_jobs: 最多保留的任务记录数，超出时淘汰最早结束的任务
+        """
+        self.handler = handler
+        self.workers = workers
+        self.max_jobs = max_jobs
+        self._queue: asyncio.Queue[IngestJob] = asyncio.Queue(max_queue)
+        self._jobs: OrderedDict[str, IngestJob] = OrderedDict()
+        self._tasks: list[asyncio.Task] = []
+        self.succeeded = 0
+        self.failed = 0
+
+    def start(self) -> None:
+        """启动 worker"""
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+
+    async def stop(self) -> None:
+        """停止 worker（进行中的任务被取消，排队中的任务保持 queued）"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def submit(
+        self,
+        file: Optional[ReceivedFile],
+        handler: Optional[Callable[[IngestJob], Awaitable[Any]]] = None,
+        **options: Any,
+    ) -> IngestJob:
+        """
+        提交入库任务
+
+        Args:
+            file: 已接收的文件（没有上传文件的任务为 None）
+            handler: 本任务使用的入库函数，None 表示队列默认的入库函数
+            **options: 传给入库函数的参数
+
+        Returns:
+            IngestJob: 新任务
+
+        Raises:
+            UploadRejected: 队列已满（429），此时临时文件已被删除
+        """
+        job = IngestJob(f"job_{uuid.uuid4().hex}", file, options, handler)
+        try:
+            self._queue.put_nowait(job)
+        except asyncio.QueueFull:
+            if file is not None:
+                os.remove(file.path)
+            raise UploadRejected("入库队列已满，请稍后重试", 429) from None
+        self._jobs[job.id] = job
+        self._evict()
+        return job
+
+    def get(self, job_id: str) -> Optional[IngestJob]:
+        """查找任务"""
+        return self._jobs.get(job_id)
+
+    def _evict(self) -> None:
+        if len(self._jobs) <= self.max_jobs:
+            return
+        for job_id in [j.id for j in self._jobs.values() if j.finished_at is not None]:
+            del self._jobs[job_id]
+            if len(self._jobs) <= self.max_jobs:
+                return
+
+    async def _work(self) -> None:
+        while True:
+            job = await self._queue.get()
+            job.status = "running"
+            job.started_at = time.time()
+            try:
+                job.result = await (job.handler or self.handler)(job)
+                job.status = "succeeded"
+                self.succeeded += 1
+            except Exception as e:
+                job.status = "failed"
+                job.error = str(e)
+                self.failed += 1
+            finally:
+                job.finished_at = time.time()
+                if job.file is not None:
+                    try:
+                        os.remove(job.file.path)
+                    except OSError:
+                        pass
+                self._queue.task_done()
+
+    def stats(self) -> dict[str, Any]:
+        """队列长度与任务统计"""
+        running = sum(1 for job in self._jobs.values() if job.status == "running")
+        return {
+            "workers": self.workers,
+            "queued": self._queue.qsize(),
+            "running": running,
+            "succeeded": self.succeeded,
+            "failed": self.failed,
+            "jobs": len(self._jobs),
+        }
@@ -0,0 +1,1041 @@
+"""
+本地离线检索引擎（vector_stores.search 的本地替代）
+
+网关不支持 /vector_stores（405），file_search 工具无法使用。这里在本地维护分块文本的混合检索索引：
+- BM25：词项哈希（英文 / 数字按词，中日韩文字按相邻二字）的倒排表（CSR），查询只读取查询词的倒排列表
+- 向量：字符 3-gram 与词项的带符号特征哈希向量（离线，无需嵌入模型，按行缩放的 int8 存储），
+  较大的分段用 IVF（球面 k-means 粗聚类）只扫描与查询最近的若干个簇
+- 结果分数为 向量余弦相似度 与 归一化 BM25 分数 的加权和（0~1）
+过滤条件与 vector_stores.search 相同（eq / ne / gt / gte / lt / lte / in / nin，and / or 组合），
+在文件级 attributes 上向量化求值后映射到分块。
+
+每次写入生成一个不可变的分段（目录），数组以 .npy 保存并以内存映射打开；
+删除 / 替换文件只在分段中标记，分段数超过上限时合并为一个分段。
+
+运行方式（在项目根目录）：
+    python -m local_search index "data/**/*.pdf" --attributes '{"category": "finance"}'
+    python -m local_search search "退款需要多久" --filters '{"type": "eq", "key": "category", "value": "finance"}'
+"""
+import argparse
+import hashlib
+import json
+import math
+import os
+import re
+import shutil
+import threading
+from typing import Any, Optional
+
+import numpy as np
+
+from near_duplicate import mix64
+
+_P = np.uint64(0x100000001B3)
+_P_INV = np.uint64(pow(0x100000001B3, -1, 2**64))
+# 区分不同种类词项的盐
+_WORD_SALT = np.uint64(0x9E3779B97F4A7C15)
+_CJK_SALT = np.uint64(0xC2B2AE3D27D4EB4F)
+_BIGRAM_SALT = np.uint64(0x165667B19E3779F9)
+_TRIGRAM_SALT = np.uint64(0x27D4EB2F165667C5)
+
+# 默认向量维度
+DEFAULT_DIM = 256
+# 分块数达到该值的分段建立 IVF，更小的分段直接全部扫描
+IVF_MIN_ROWS = 4096
+# 过滤后剩余的分块不超过该值时直接精确扫描，不走 IVF
+FLAT_SCAN_ROWS = 4096
+# 过滤后 IVF 多探测的簇数上限（相对 nprobe 的倍数）
+MAX_PROBE_FACTOR = 4
+# 每个分段缓存的过滤掩码数
+MASK_CACHE_SIZE = 32
+# 构建索引时每批处理的分块数
+BUILD_BATCH = 8192
+# BM25 参数
+BM25_K1 = 1.2
+BM25_B = 0.75
+# 出现在超过该比例分块中的词项不参与 BM25 召回（仍参与打分）
+MAX_DF_RATIO = 0.25
+# 支持的比较过滤
+COMPARISONS = ("eq", "ne", "gt", "gte", "lt", "lte", "in", "nin")
+_STORE_ID_PATTERN = re.compile(r"^[A-Za-z0-9_.-]+$")
+
+
+def _codes(texts: list[str]) -> tuple[np.ndarray, np.ndarray]:
+    """拼接文本为小写的 Unicode 码位数组（文本之间以 0 分隔），返回码位与每个文本的起始位置"""
+    lowered = [text.lower() for text in texts]
+    codes = np.frombuffer("\0".join(lowered).encode("utf-32-le"), dtype=np.uint32).astype(np.uint64)
+    lengths = np.fromiter((len(text) + 1 for text in lowered), dtype=np.int64, count=len(lowered))
+    starts = np.zeros(len(lowered), dtype=np.int64)
+    np.cumsum(lengths[:-1], out=starts[1:])
+    return codes, starts
+
+
+def _classes(codes: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """字符类别：组成英文词的字符（数字、拉丁字母）与中日韩文字"""
+    word = (
+        ((codes >= 48) & (codes <= 57))
+        | ((codes >= 97) & (codes <= 122))
+        | ((codes >= 0xE0) & (codes <= 0x24F) & (codes != 0xF7))
+    )
+    cjk = (
+        ((codes >= 0x4E00) & (codes <= 0x9FFF))
+        | ((codes >= 0x3400) & (codes <= 0x4DBF))
+        | ((codes >= 0x3040) & (codes <= 0x30FF))
+        | ((codes >= 0xAC00) & (codes <= 0xD7AF))
+    )
+    return word, cjk
+
+
+def _powers(base: np.uint64, count: int) -> np.ndarray:
+    powers = np.full(count, base, dtype=np.uint64)
+    powers[0] = 1
+    return np.cumprod(powers)
+
+
+def term_hashes(codes: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    切分词项并计算 64 位哈希（向量化）
+
+    英文 / 数字连续字符为一个词；中日韩文字取相邻二字，孤立的单字单独成词。
+
+    Args:
+        codes: _codes 输出的码位数组
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: 词项哈希（uint64）与词项在码位数组中的位置
+    """
+    n = len(codes)
+    if n == 0:
+        return np.empty(0, dtype=np.uint64), np.empty(0, dtype=np.int64)
+    word, cjk = _classes(codes)
+
+    # 英文词：多项式哈希 sum(c_i * P^(end-i))，用 P 的逆元前缀和在 O(n) 内算出每个连续片段
+    prev = np.concatenate(([False], word[:-1]))
+    nxt = np.concatenate((word[1:], [False]))
+    starts = np.flatnonzero(word & ~prev)
+    ends = np.flatnonzero(word & ~nxt)
+    prefix = np.zeros(n + 1, dtype=np.uint64)
+    np.cumsum(np.where(word, codes, 0) * _powers(_P_INV, n), out=prefix[1:])
+    words = mix64(((prefix[ends + 1] - prefix[starts]) * _powers(_P, n)[ends]) ^ _WORD_SALT)
+
+    # 中日韩文字：相邻二字；前后都不是中日韩文字的单字
+    pairs = np.flatnonzero(cjk[:-1] & cjk[1:])
+    bigrams = mix64((codes[pairs] * _P + codes[pairs + 1]) ^ _BIGRAM_SALT)
+    prev_cjk = np.concatenate(([False], cjk[:-1]))
+    next_cjk = np.concatenate((cjk[1:], [False]))
+    singles = np.flatnonzero(cjk & ~prev_cjk & ~next_cjk)
+    unigrams = mix64(codes[singles] ^ _CJK_SALT)
+
+    return (
+        np.concatenate((words, bigrams, unigrams)),
+        np.concatenate((starts, pairs, singles)),
+    )
+
+
+def trigram_hashes(codes: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """连续三个文字字符（英文 / 数字 / 中日韩文字）的哈希与位置，用于容忍拼写与词形差异"""
+    if len(codes) < 3:
+        return np.empty(0, dtype=np.uint64), np.empty(0, dtype=np.int64)
+    word, cjk = _classes(codes)
+    content = word | cjk
+    positions = np.flatnonzero(content[:-2] & content[1:-1] & content[2:])
+    hashes = mix64(((codes[positions] * _P + codes[positions + 1]) * _P + codes[positions + 2]) ^ _TRIGRAM_SALT)
+    return hashes, positions
+
+
+def tokenize(texts: list[str]) -> tuple[np.ndarray, np.ndarray]:
+    """
+    批量切分词项
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: 词项哈希与所属文本的下标
+    """
+    codes, starts = _codes(texts)
+    hashes, positions = term_hashes(codes)
+    return hashes, np.searchsorted(starts, positions, side="right") - 1
+
+
+class HashingEmbedder:
+    """带符号特征哈希向量（字符 3-gram 与词项），离线计算、无需模型"""
+
+    def __init__(self, dim: int = DEFAULT_DIM):
+        self.dim = dim
+
+    def embed(self, texts: list[str]) -> np.ndarray:
+        """
+        计算文本向量
+
+        Returns:
+            np.ndarray: (len(texts), dim) 的 float32 单位向量（没有文字的文本为零向量）
+        """
+        codes, starts = _codes(texts)
+        trigrams, trigram_positions = trigram_hashes(codes)
+        terms, term_positions = term_hashes(codes)
+        hashes = np.concatenate((trigrams, terms))
+        rows = np.searchsorted(starts, np.concatenate((trigram_positions, term_positions)), side="right") - 1
+        buckets = (hashes % np.uint64(self.dim)).astype(np.int64)
+        signs = np.where(hashes >> np.uint64(63), -1.0, 1.0)
+        counts = np.bincount(rows * self.dim + buckets, weights=signs, minlength=len(texts) * self.dim)
+        # 开方抑制高频特征
+        vectors = (np.sign(counts) * np.sqrt(np.abs(counts))).reshape(len(texts), self.dim).astype(np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
+
+
+class AttributeColumns:
+    """文件 attributes 按键拆成列，过滤条件向量化求值"""
+
+    def __init__(self, attributes: list[dict[str, Any]]):
+        self.size = len(attributes)
+        self._raw: dict[str, list[Any]] = {}
+        for i, attrs in enumerate(attributes):
+            for key, value in attrs.items():
+                self._raw.setdefault(key, [None] * self.size)[i] = value
+        self._typed: dict[tuple[str, str], np.ndarray] = {}
+
+    def column(self, key: str, kind: str) -> np.ndarray:
+        """
+        某个键指定类型的列
+
+        Args:
+            key: attributes 的键
+            kind: str（object 数组，其他类型为 None）/ number（float64，其他为 nan）/ bool（int8，其他为 -1）
+        """
+        cached = self._typed.get((key, kind))
+        if cached is not None:
+            return cached
+        raw = self._raw.get(key, [None] * self.size)
+        if kind == "str":
+            column = np.array([v if isinstance(v, str) else None for v in raw] or [], dtype=object)
+        elif kind == "number":
+            column = np.array(
+                [float(v) if isinstance(v, (int, float)) and not isinstance(v, bool) else math.nan for v in raw],
+                dtype=np.float64,
+            )
+        else:
+            column = np.array([int(v) if isinstance(v, bool) else -1 for v in raw], dtype=np.int8)
+        self._typed[(key, kind)] = column
+        return column
+
+
+def _value_kind(value: Any) -> str:
+    if isinstance(value, bool):
+        return "bool"
+    if isinstance(value, (int, float)):
+        return "number"
+    if isinstance(value, str):
+        return "str"
+    raise ValueError(f"过滤值只能是字符串、数字或布尔: {value!r}")
+
+
+def _equals(columns: AttributeColumns, key: str, value: Any) -> tuple[np.ndarray, np.ndarray]:
+    """返回 (相等, 存在同类型的值)"""
+    kind = _value_kind(value)
+    column = columns.column(key, kind)
+    if kind == "str":
+        # object 数组逐元素比较，不能写成 is not None
+        present = column != None  # noqa: E711
+        return present & (column == value), present
+    if kind == "number":
+        return column == value, ~np.isnan(column)
+    return column == int(value), column >= 0
+
+
+def filter_mask(filters: dict[str, Any], columns: AttributeColumns) -> np.ndarray:
+    """
+    计算满足过滤条件的文件
+
+    缺少该键（或值类型不同）的文件不满足任何比较（包括 ne / nin）。
+
+    Args:
+        filters: vector_stores.search 格式的过滤条件
+        columns: 文件 attributes 列
+
+    Returns:
+        np.ndarray: 每个文件是否满足（bool）
+
+    Raises:
+        ValueError: 过滤条件格式错误
+    """
+    if not isinstance(filters, dict):
+        raise ValueError(f"过滤条件必须是对象: {filters!r}")
+    kind = filters.get("type")
+    if kind in ("and", "or"):
+        parts = [filter_mask(f, columns) for f in filters.get("filters", [])]
+        if not parts:
+            return np.ones(columns.size, dtype=bool)
+        return np.logical_and.reduce(parts) if kind == "and" else np.logical_or.reduce(parts)
+    if kind not in COMPARISONS:
+        raise ValueError(f"不支持的过滤类型: {kind}")
+    key, value = filters.get("key"), filters.get("value")
+    if not isinstance(key, str):
+        raise ValueError(f"过滤条件缺少 key: {filters!r}")
+    if kind in ("in", "nin"):
+        if not isinstance(value, list) or not value:
+            raise ValueError(f"{kind} 的 value 必须是非空数组")
+        matched = np.zeros(columns.size, dtype=bool)
+        present = np.zeros(columns.size, dtype=bool)
+        for item in value:
+            equal, has = _equals(columns, key, item)
+            matched |= equal
+            present |= has
+        return matched if kind == "in" else present & ~matched
+    if kind in ("eq", "ne"):
+        equal, present = _equals(columns, key, value)
+        return equal if kind == "eq" else present & ~equal
+    if _value_kind(value) != "number":
+        raise ValueError(f"{kind} 只能比较数字: {value!r}")
+    column = columns.column(key, "number")
+    with np.errstate(invalid="ignore"):
+        if kind == "gt":
+            return column > value
+        if kind == "gte":
+            return column >= value
+        if kind == "lt":
+            return column < value
+        return column <= value
+
+
+def validate_filters(filters: Optional[dict[str, Any]]) -> None:
+    """检查过滤条件格式（不合法时抛出 ValueError）"""
+    if filters is not None:
+        filter_mask(filters, AttributeColumns([]))
+
+
+def _load(path: str) -> np.ndarray:
+    try:
+        # 转为普通 ndarray 视图（仍然映射文件），避免 np.memmap 每次切片的额外开销
+        return np.asarray(np.load(path, mmap_mode="r"))
+    except ValueError:
+        # 空数组无法内存映射
+        return np.load(path)
+
+
+def _save(directory: str, name: str, array: np.ndarray) -> None:
+    np.save(os.path.join(directory, f"{name}.npy"), array)
+
+
+def _write_json(path: str, data: Any) -> None:
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp, path)
+
+
+def quantize(vectors: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """float32 向量按行缩放为 int8，返回 (int8 向量, 每行的缩放系数)"""
+    scales = np.abs(vectors).max(axis=1) / 127 if len(vectors) else np.empty(0, dtype=np.float32)
+    scales[scales == 0] = 1.0
+    return np.round(vectors / scales[:, None]).astype(np.int8), scales.astype(np.float32)
+
+
+def kmeans(
+    vectors: np.ndarray,
+    scales: np.ndarray,
+    lists: int,
+    iterations: int = 8,
+    sample: int = 64,
+    seed: int = 7,
+) -> np.ndarray:
+    """
+    球面 k-means（余弦相似度）
+
+    Args:
+        vectors: (n, dim) int8 向量
+        scales: 每行的缩放系数
+        lists: 簇数
+        iterations: 迭代次数
+        sample: 每个簇使用的训练样本数
+        seed: 随机种子
+
+    Returns:
+        np.ndarray: (lists, dim) 的 float32 簇中心
+    """
+    rng = np.random.default_rng(seed)
+    n = len(vectors)
+    rows = np.sort(rng.choice(n, size=min(n, lists * sample), replace=False))
+    train = vectors[rows].astype(np.float32) * scales[rows, None]
+    centroids = train[rng.choice(len(train), size=lists, replace=False)].copy()
+    for _ in range(iterations):
+        assign = np.argmax(train @ centroids.T, axis=1)
+        counts = np.bincount(assign, minlength=lists)
+        order = np.argsort(assign, kind="stable")
+        offsets = np.concatenate(([0], np.cumsum(counts)[:-1]))
+        nonempty = counts > 0
+        # 空簇保留原中心
+        sums = np.add.reduceat(train[order], offsets[nonempty], axis=0)
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        centroids[nonempty] = sums / norms
+    return centroids
+
+
+def _assign(vectors: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    # 每行的缩放系数不影响 argmax
+    assign = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), BUILD_BATCH):
+        block = vectors[start:start + BUILD_BATCH].astype(np.float32)
+        assign[start:start + BUILD_BATCH] = np.argmax(block @ centroids.T, axis=1)
+    return assign
+
+
+def chunk_digest(text: str) -> bytes:
+    """分块内容的哈希（判断重新入库时分块是否变化）"""
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+
+
+def build_segment(
+    path: str,
+    documents: list[dict[str, Any]],
+    embedder: HashingEmbedder,
+    vectors: Optional[tuple[np.ndarray, np.ndarray]] = None,
+) -> None:
+    """
+    构建一个分段目录
+
+    分块按 IVF 簇排序存放，每个簇的向量在文件中连续，探测一个簇只读取一段连续区域。
+
+    Args:
+        path: 分段目录（不能已存在）
+        documents: 文件列表，每项包含 file_id、filename、attributes、chunks（分块文本），
+            可选 sha256（源文件内容哈希）与 chunking（切分分块的参数）
+        embedder: 计算分块向量
+        vectors: 已量化的分块向量与缩放系数（合并分段、替换文件时复用），None 表示用 embedder 计算
+    """
+    texts = [chunk for doc in documents for chunk in doc["chunks"]]
+    n = len(texts)
+    chunk_doc = np.repeat(
+        np.arange(len(documents), dtype=np.int32), [len(doc["chunks"]) for doc in documents]
+    )
+    if vectors is None:
+        vectors = np.empty((n, embedder.dim), dtype=np.int8)
+        scales = np.empty(n, dtype=np.float32)
+        for start in range(0, n, BUILD_BATCH):
+            vectors[start:start + BUILD_BATCH], scales[start:start + BUILD_BATCH] = quantize(
+                embedder.embed(texts[start:start + BUILD_BATCH])
+            )
+    else:
+        vectors, scales = vectors
+
+    lists = int(math.sqrt(n)) if n >= IVF_MIN_ROWS else 0
+    if lists:
+        centroids = kmeans(vectors, scales, lists)
+        assign = _assign(vectors, centroids)
+        order = np.argsort(assign, kind="stable")
+        list_offsets = np.searchsorted(assign[order], np.arange(lists + 1)).astype(np.int64)
+    else:
+        centroids = np.empty((0, embedder.dim), dtype=np.float32)
+        order = np.arange(n)
+        list_offsets = np.array([0, n], dtype=np.int64)
+    texts = [texts[i] for i in order]
+    chunk_doc = chunk_doc[order]
+    vectors = np.ascontiguousarray(vectors[order])
+    scales = scales[order]
+
+    # 倒排表：按 (词项, 分块) 排序后去重计数
+    term_parts, row_parts = [], []
+    for start in range(0, n, BUILD_BATCH):
+        hashes, rows = tokenize(texts[start:start + BUILD_BATCH])
+        term_parts.append(hashes)
+        row_parts.append((rows + start).astype(np.int32))
+    terms = np.concatenate(term_parts) if term_parts else np.empty(0, dtype=np.uint64)
+    rows = np.concatenate(row_parts) if row_parts else np.empty(0, dtype=np.int32)
+    lengths = np.bincount(rows, minlength=n).astype(np.uint32)
+    order = np.lexsort((rows, terms))
+    terms, rows = terms[order], rows[order]
+    first = np.ones(len(terms), dtype=bool)
+    first[1:] = (terms[1:] != terms[:-1]) | (rows[1:] != rows[:-1])
+    pair_starts = np.flatnonzero(first)
+    tfs = np.minimum(np.diff(np.append(pair_starts, len(terms))), 65535).astype(np.uint16)
+    terms, postings = terms[pair_starts], rows[pair_starts]
+    term_first = np.ones(len(terms), dtype=bool)
+    term_first[1:] = terms[1:] != terms[:-1]
+    term_starts = np.flatnonzero(term_first)
+
+    encoded = [text.encode("utf-8") for text in texts]
+    text_offsets = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum([len(b) for b in encoded], out=text_offsets[1:])
+
+    tmp = f"{path}.tmp"
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    _save(tmp, "chunk_doc", chunk_doc)
+    _save(tmp, "text_offsets", text_offsets)
+    _save(tmp, "texts", np.frombuffer(b"".join(encoded), dtype=np.uint8))
+    _save(tmp, "lengths", lengths)
+    _save(tmp, "vectors", vectors)
+    _save(tmp, "scales", scales)
+    _save(tmp, "terms", terms[term_starts])
+    _save(tmp, "term_offsets", np.append(term_starts, len(terms)).astype(np.int64))
+    _save(tmp, "postings", postings)
+    _save(tmp, "tfs", tfs)
+    _save(tmp, "centroids", centroids)
+    _save(tmp, "list_offsets", list_offsets)
+    _save(tmp, "deleted", np.zeros(len(documents), dtype=bool))
+    docs = [
+        {
+            "file_id": doc["file_id"],
+            "filename": doc["filename"],
+            "attributes": doc.get("attributes") or {},
+            "sha256": doc.get("sha256"),
+            "chunking": doc.get("chunking"),
+        }
+        for doc in documents
+    ]
+    _write_json(os.path.join(tmp, "docs.json"), docs)
+    os.replace(tmp, path)
+
+
+class Segment:
+    """一个不可变的索引分段（只有删除标记会更新）"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.name = os.path.basename(path)
+
+        def load(name: str) -> np.ndarray:
+            return _load(os.path.join(path, f"{name}.npy"))
+
+        self.chunk_doc = load("chunk_doc")
+        self.text_offsets = load("text_offsets")
+        self.texts = load("texts")
+        self.lengths = load("lengths")
+        self.vectors = load("vectors")
+        self.scales = load("scales")
+        self.terms = load("terms")
+        self.term_offsets = load("term_offsets")
+        self.postings = load("postings")
+        self.tfs = load("tfs")
+        self.centroids = np.asarray(load("centroids"), dtype=np.float32)
+        self.list_offsets = np.asarray(load("list_offsets"))
+        self.deleted = np.load(os.path.join(path, "deleted.npy"))
+        with open(os.path.join(path, "docs.json"), encoding="utf-8") as f:
+            self.docs: list[dict[str, Any]] = json.load(f)
+        self.columns = AttributeColumns([doc["attributes"] for doc in self.docs])
+        self.size = len(self.chunk_doc)
+        self.total_length = int(np.sum(self.lengths, dtype=np.int64))
+        # 过滤条件（JSON）-> 分块掩码
+        self._masks: dict[str, np.ndarray] = {}
+
+    def text(self, row: int) -> str:
+        return bytes(self.texts[self.text_offsets[row]:self.text_offsets[row + 1]]).decode("utf-8")
+
+    def doc_rows(self, doc: int) -> np.ndarray:
+        """文件的全部分块行号"""
+        return np.flatnonzero(self.chunk_doc == doc)
+
+    def mark_deleted(self, doc: int) -> None:
+        """标记文件已删除（写时复制，进行中的查询不受影响）"""
+        deleted = self.deleted.copy()
+        deleted[doc] = True
+        tmp = os.path.join(self.path, "deleted.tmp.npy")
+        np.save(tmp, deleted)
+        os.replace(tmp, os.path.join(self.path, "deleted.npy"))
+        self.deleted = deleted
+        self._masks = {}
+
+    def chunk_mask(self, filters: Optional[dict[str, Any]]) -> Optional[np.ndarray]:
+        """满足过滤条件且未删除的分块，None 表示全部分块（按过滤条件缓存）"""
+        if filters is None and not self.deleted.any():
+            return None
+        key = json.dumps(filters, sort_keys=True)
+        mask = self._masks.get(key)
+        if mask is None:
+            docs = ~self.deleted
+            if filters is not None:
+                docs &= filter_mask(filters, self.columns)
+            mask = docs[self.chunk_doc]
+            if len(self._masks) >= MASK_CACHE_SIZE:
+                self._masks = {}
+            self._masks[key] = mask
+        return mask
+
+    def lookup(self, query_terms: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """查询词在本分段倒排表中的 [start, end)（不存在的词为空区间）"""
+        index = np.searchsorted(self.terms, query_terms)
+        found = index < len(self.terms)
+        found[found] = self.terms[index[found]] == query_terms[found]
+        starts = np.where(found, self.term_offsets[np.minimum(index, len(self.terms))], 0)
+        ends = np.where(found, self.term_offsets[np.minimum(index + 1, len(self.terms))], 0)
+        return starts, ends
+
+
+class _QueryStats:
+    """一次查询的全局 BM25 统计（跨所有分段）"""
+
+    def __init__(self, segments: list[Segment], query_terms: np.ndarray):
+        self.ranges = [segment.lookup(query_terms) for segment in segments]
+        total = sum(segment.size for segment in segments)
+        df = sum((ends - starts for starts, ends in self.ranges), np.zeros(len(query_terms), dtype=np.int64))
+        self.avgdl = sum(segment.total_length for segment in segments) / max(total, 1)
+        self.idf = np.log1p((total - df + 0.5) / (df + 0.5))
+        # 召回只使用不太常见的词；全是常见词时全部使用
+        self.recall = (df > 0) & (df <= MAX_DF_RATIO * total)
+        if not self.recall.any():
+            self.recall = df > 0
+
+    def weight(self, term: int, tf: np.ndarray, lengths: np.ndarray) -> np.ndarray:
+        norm = BM25_K1 * (1 - BM25_B + BM25_B * lengths / self.avgdl)
+        return self.idf[term] * tf * (BM25_K1 + 1) / (tf + norm)
+
+
+class LocalVectorStore:
+    """一个本地检索库：分段列表 + 文件到分段的映射"""
+
+    def __init__(
+        self,
+        path: str,
+        dim: int = DEFAULT_DIM,
+        max_segments: int = 16,
+        nprobe: int = 8,
+        vector_weight: float = 0.5,
+    ):
+        """
+        Args:
+            path: 检索库目录
+            dim: 新建检索库的向量维度（已有的检索库使用建库时的维度）
+            max_segments: 分段数超过该值时合并
+            nprobe: 每个 IVF 分段扫描的簇数
+            vector_weight: 向量相似度在综合分数中的权重（其余为 BM25）
+        """
+        self.path = path
+        self.max_segments = max_segments
+        self.nprobe = nprobe
+        self.vector_weight = vector_weight
+        os.makedirs(path, exist_ok=True)
+        self._manifest_path = os.path.join(path, "manifest.json")
+        if os.path.exists(self._manifest_path):
+            with open(self._manifest_path, encoding="utf-8") as f:
+                self._manifest = json.load(f)
+        else:
+            self._manifest = {"dim": dim, "next_segment": 0, "segments": []}
+        self.embedder = HashingEmbedder(self._manifest["dim"])
+        self._lock = threading.Lock()
+        self._segments = [Segment(os.path.join(path, name)) for name in self._manifest["segments"]]
+        # file_id -> (分段, 文件在分段中的下标)；同一文件出现在多个分段时以最新的为准
+        self._files: dict[str, tuple[Segment, int]] = {}
+        for segment in self._segments:
+            for doc, info in enumerate(segment.docs):
+                if segment.deleted[doc]:
+                    continue
+                old = self._files.get(info["file_id"])
+                if old is not None:
+                    old[0].mark_deleted(old[1])
+                self._files[info["file_id"]] = (segment, doc)
+        self.searches = 0
+        # 写入时新计算向量的分块数与复用旧向量（内容未变）的分块数
+        self.embedded_chunks = 0
+        self.reused_chunks = 0
+
+    def _write_manifest(self) -> None:
+        self._manifest["segments"] = [segment.name for segment in self._segments]
+        _write_json(self._manifest_path, self._manifest)
+
+    def _new_segment_path(self) -> str:
+        name = f"seg_{self._manifest['next_segment']:06d}"
+        self._manifest["next_segment"] += 1
+        return os.path.join(self.path, name)
+
+    def file_info(self, file_id: str) -> Optional[dict[str, Any]]:
+        """已写入文件的 file_id、filename、attributes、sha256（源文件内容哈希）与 chunking（分块参数），不存在时为 None"""
+        found = self._files.get(file_id)
+        return found[0].docs[found[1]] if found is not None else None
+
+    def _embed_chunks(self, documents: list[dict[str, Any]]) -> tuple[np.ndarray, np.ndarray]:
+        # 被替换文件中内容未变的分块直接复用已量化的向量，只为新的或变化的分块计算向量
+        reuse: dict[bytes, tuple[Segment, int]] = {}
+        for doc in documents:
+            found = self._files.get(doc["file_id"])
+            if found is not None:
+                segment, index = found
+                for row in segment.doc_rows(index):
+                    reuse[chunk_digest(segment.text(row))] = (segment, int(row))
+        texts = [chunk for doc in documents for chunk in doc["chunks"]]
+        vectors = np.empty((len(texts), self.embedder.dim), dtype=np.int8)
+        scales = np.empty(len(texts), dtype=np.float32)
+        missing = []
+        for i, text in enumerate(texts):
+            found = reuse.get(chunk_digest(text)) if reuse else None
+            if found is None:
+                missing.append(i)
+            else:
+                vectors[i] = found[0].vectors[found[1]]
+                scales[i] = found[0].scales[found[1]]
+        for start in range(0, len(missing), BUILD_BATCH):
+            rows = missing[start:start + BUILD_BATCH]
+            vectors[rows], scales[rows] = quantize(self.embedder.embed([texts[i] for i in rows]))
+        self.embedded_chunks += len(missing)
+        self.reused_chunks += len(texts) - len(missing)
+        return vectors, scales
+
+    def add_files(self, documents: list[dict[str, Any]]) -> int:
+        """
+        写入文件（已有相同 file_id 的文件被替换，内容未变的分块复用原来的向量）
+
+        Args:
+            documents: 每项包含 file_id、filename、attributes、chunks（分块文本列表），
+                可选 sha256（源文件内容哈希）与 chunking（分块参数）
+
+        Returns:
+            int: 写入的分块数
+        """
+        with self._lock:
+            indexed = [doc for doc in documents if doc["chunks"]]
+            segment = None
+            if indexed:
+                path = self._new_segment_path()
+                build_segment(path, indexed, self.embedder, self._embed_chunks(indexed))
+                segment = Segment(path)
+                self._segments = [*self._segments, segment]
+                self._write_manifest()
+            for doc in documents:
+                self._delete_locked(doc["file_id"])
+            if segment is not None:
+                for i, info in enumerate(segment.docs):
+                    self._files[info["file_id"]] = (segment, i)
+                if len(self._segments) > self.max_segments:
+                    self._compact_locked()
+            return sum(len(doc["chunks"]) for doc in indexed)
+
+    def delete_file(self, file_id: str) -> bool:
+        """删除文件，返回文件是否存在"""
+        with self._lock:
+            return self._delete_locked(file_id)
+
+    def _delete_locked(self, file_id: str) -> bool:
+        found = self._files.pop(file_id, None)
+        if found is None:
+            return False
+        found[0].mark_deleted(found[1])
+        return True
+
+    def compact(self) -> None:
+        """合并所有分段，丢弃已删除的文件"""
+        with self._lock:
+            self._compact_locked()
+
+    def _compact_locked(self) -> None:
+        old = self._segments
+        documents, vectors, scales = [], [], []
+        for segment in old:
+            alive = ~segment.deleted
+            if not alive.any():
+                continue
+            rows = np.flatnonzero(alive[segment.chunk_doc])
+            rows = rows[np.argsort(segment.chunk_doc[rows], kind="stable")]
+            chunks: dict[int, list[str]] = {}
+            for row in rows:
+                chunks.setdefault(int(segment.chunk_doc[row]), []).append(segment.text(row))
+            for doc, texts in chunks.items():
+                documents.append({**segment.docs[doc], "chunks": texts})
+            vectors.append(np.asarray(segment.vectors[rows]))
+            scales.append(np.asarray(segment.scales[rows]))
+        segments = []
+        if documents:
+            path = self._new_segment_path()
+            build_segment(path, documents, self.embedder, (np.concatenate(vectors), np.concatenate(scales)))
+            segments.append(Segment(path))
+        self._segments = segments
+        self._write_manifest()
+        self._files = {info["file_id"]: (segment, i) for segment in segments for i, info in enumerate(segment.docs)}
+        for segment in old:
+            shutil.rmtree(segment.path, ignore_errors=True)
+
+    def search(
+        self,
+        query: str,
+        filters: Optional[dict[str, Any]] = None,
+        max_num_results: int = 10,
+        score_threshold: float = 0.0,
+    ) -> list[dict[str, Any]]:
+        """
+        混合检索（CPU 密集，在线程中调用）
+
+        Args:
+            query: 查询文本
+            filters: vector_stores.search 格式的过滤条件
+            max_num_results: 最多返回的分块数
+            score_threshold: 最低综合分数
+
+        Returns:
+            list[dict]: 与 vector_stores.search 结果相同的字段（file_id、filename、score、attributes、content）
+
+        Raises:
+            ValueError: 过滤条件格式错误
+        """
+        validate_filters(filters)
+        self.searches += 1
+        segments = self._segments
+        if not segments or max_num_results <= 0:
+            return []
+        query_terms = np.unique(tokenize([query])[0])
+        stats = _QueryStats(segments, query_terms)
+        query_vector = self.embedder.embed([query])[0]
+        candidates = max(max_num_results * 4, 20)
+
+        found = []
+        for segment, (starts, ends) in zip(segments, stats.ranges):
+            mask = segment.chunk_mask(filters)
+            if mask is not None and not mask.any():
+                continue
+            rows = np.union1d(
+                self._bm25_top(segment, stats, starts, ends, mask, candidates),
+                self._vector_top(segment, query_vector, mask, candidates),
+            ).astype(np.int64)
+            if len(rows) == 0:
+                continue
+            similarity = (segment.vectors[rows].astype(np.float32) @ query_vector) * segment.scales[rows]
+            bm25 = self._bm25_exact(segment, stats, starts, ends, rows)
+            found.append((segment, rows, similarity, bm25))
+        if not found:
+            return []
+
+        owners = [(segment, row) for segment, rows, _, _ in found for row in rows]
+        similarity = np.concatenate([item[2] for item in found])
+        bm25 = np.concatenate([item[3] for item in found])
+        top_bm25 = bm25.max()
+        scores = self.vector_weight * np.clip(similarity, 0.0, 1.0)
+        if top_bm25 > 0:
+            scores += (1 - self.vector_weight) * bm25 / top_bm25
+        best = np.argsort(-scores, kind="stable")[:max_num_results]
+        results = []
+        for i in best:
+            if scores[i] < score_threshold or scores[i] <= 0:
+                break
+            segment, row = owners[i]
+            doc = segment.docs[segment.chunk_doc[row]]
+            results.append({
+                "file_id": doc["file_id"],
+                "filename": doc["filename"],
+                "score": float(scores[i]),
+                "attributes": doc["attributes"],
+                "content": [{"type": "text", "text": segment.text(row)}],
+            })
+        return results
+
+    def _bm25_top(
+        self,
+        segment: Segment,
+        stats: _QueryStats,
+        starts: np.ndarray,
+        ends: np.ndarray,
+        mask: Optional[np.ndarray],
+        count: int,
+    ) -> np.ndarray:
+        """读取查询词的倒排列表累加 BM25，返回分数最高的分块"""
+        rows, weights = [], []
+        for term in np.flatnonzero(stats.recall & (ends > starts)):
+            postings = np.asarray(segment.postings[starts[term]:ends[term]])
+            tfs = segment.tfs[starts[term]:ends[term]].astype(np.float32)
+            rows.append(postings)
+            weights.append(stats.weight(term, tfs, segment.lengths[postings]))
+        if not rows:
+            return np.empty(0, dtype=np.int64)
+        rows = np.concatenate(rows)
+        if len(rows) * 8 >= segment.size:
+            # 倒排列表较长时按分块号直接累加，省去排序
+            scores = np.bincount(rows, weights=np.concatenate(weights), minlength=segment.size)
+            unique = np.flatnonzero(scores)
+            scores = scores[unique]
+        else:
+            unique, inverse = np.unique(rows, return_inverse=True)
+            scores = np.bincount(inverse, weights=np.concatenate(weights))
+        if mask is not None:
+            keep = mask[unique]
+            unique, scores = unique[keep], scores[keep]
+        if len(unique) > count:
+            keep = np.argpartition(-scores, count)[:count]
+            unique = unique[keep]
+        return unique
+
+    def _bm25_exact(
+        self,
+        segment: Segment,
+        stats: _QueryStats,
+        starts: np.ndarray,
+        ends: np.ndarray,
+        rows: np.ndarray,
+    ) -> np.ndarray:
+        """候选分块的 BM25 分数（倒排列表按分块有序，二分查找词频）"""
+        scores = np.zeros(len(rows), dtype=np.float64)
+        lengths = segment.lengths[rows]
+        for term in np.flatnonzero(ends > starts):
+            postings = segment.postings[starts[term]:ends[term]]
+            index = np.searchsorted(postings, rows)
+            hit = index < len(postings)
+            hit[hit] = postings[index[hit]] == rows[hit]
+            if hit.any():
+                tfs = segment.tfs[starts[term] + index[hit]].astype(np.float32)
+                scores[hit] += stats.weight(term, tfs, lengths[hit])
+        return scores
+
+    def _vector_top(
+        self,
+        segment: Segment,
+        query_vector: np.ndarray,
+        mask: Optional[np.ndarray],
+        count: int,
+    ) -> np.ndarray:
+        """
+        向量相似度最高的分块
+
+        IVF 只扫描最近的 nprobe 个簇；有过滤时按剩余比例多探测一些簇（最多 MAX_PROBE_FACTOR 倍），
+        过滤后分块很少时直接精确扫描。
+        """
+        alive = segment.size if mask is None else int(np.count_nonzero(mask))
+        if len(segment.centroids) and alive > FLAT_SCAN_ROWS:
+            factor = min(MAX_PROBE_FACTOR, math.ceil(segment.size / alive))
+            nprobe = min(self.nprobe * factor, len(segment.centroids))
+            probes = np.argpartition(-(segment.centroids @ query_vector), nprobe - 1)[:nprobe]
+            ranges = [slice(segment.list_offsets[c], segment.list_offsets[c + 1]) for c in np.sort(probes)]
+            if mask is None:
+                rows = np.concatenate([np.arange(r.start, r.stop) for r in ranges])
+                vectors = np.concatenate([segment.vectors[r] for r in ranges])
+                scales = np.concatenate([segment.scales[r] for r in ranges])
+            else:
+                # 簇内只取满足过滤条件的行，后续只对它们计算相似度
+                rows = np.concatenate([np.flatnonzero(mask[r]) + r.start for r in ranges])
+                vectors = np.concatenate([segment.vectors[r][mask[r]] for r in ranges])
+                scales = segment.scales[rows]
+        elif mask is None:
+            rows = np.arange(segment.size)
+            vectors, scales = segment.vectors, segment.scales
+        else:
+            rows = np.flatnonzero(mask)
+            vectors, scales = segment.vectors[rows], segment.scales[rows]
+        scores = (vectors.astype(np.float32) @ query_vector) * scales
+        if len(rows) > count:
+            rows = rows[np.argpartition(-scores, count)[:count]]
+        return rows
+
+    def stats(self) -> dict[str, Any]:
+        """分段、文件与分块数"""
+        segments = self._segments
+        return {
+            "segments": len(segments),
+            "files": len(self._files),
+            "chunks": sum(segment.size for segment in segments),
+            "dim": self.embedder.dim,
+            "searches": self.searches,
+            "embedded_chunks": self.embedded_chunks,
+            "reused_chunks": self.reused_chunks,
+        }
+
+
+class StoreNotFoundError(LookupError):
+    """检索库不存在"""
+
+
+class LocalSearchEngine:
+    """按 vector_store_id 管理本地检索库（每个检索库一个子目录）"""
+
+    def __init__(self, root: str, **options: Any):
+        """
+        Args:
+            root: 存放检索库的目录
+            **options: 传给 LocalVectorStore 的参数
+        """
+        self.root = root
+        self.options = options
+        self._stores: dict[str, LocalVectorStore] = {}
+        self._lock = threading.Lock()
+
+    def store(self, vector_store_id: str, create: bool = True) -> LocalVectorStore:
+        """
+        打开检索库
+
+        Args:
+            vector_store_id: 检索库 ID（子目录名）
+            create: 不存在时是否创建；检索时为 False，任意 ID 不会在磁盘上创建目录
+
+        Raises:
+            ValueError: vector_store_id 含有不允许的字符
+            StoreNotFoundError: create 为 False 且检索库不存在
+        """
+        if not _STORE_ID_PATTERN.match(vector_store_id) or vector_store_id in (".", ".."):
+            raise ValueError(f"无效的 vector_store_id: {vector_store_id}")
+        with self._lock:
+            store = self._stores.get(vector_store_id)
+            if store is None:
+                path = os.path.join(self.root, vector_store_id)
+                if not create and not os.path.isdir(path):
+                    raise StoreNotFoundError(f"检索库 {vector_store_id} 不存在")
+                store = self._stores[vector_store_id] = LocalVectorStore(path, **self.options)
+            return store
+
+    def search(
+        self,
+        vector_store_id: str,
+        query: str,
+        filters: Optional[dict[str, Any]] = None,
+        max_num_results: int = 10,
+        score_threshold: float = 0.0,
+    ) -> list[dict[str, Any]]:
+        """
+        在已有的检索库中检索（打开检索库与检索都在调用线程中执行），参数与返回值见 LocalVectorStore.search
+
+        Raises:
+            StoreNotFoundError: 检索库不存在
+        """
+        return self.store(vector_store_id, create=False).search(query, filters, max_num_results, score_threshold)
+
+    def stats(self) -> dict[str, Any]:
+        """已打开的检索库统计"""
+        return {store_id: store.stats() for store_id, store in self._stores.items()}
+
+
+def chunk_text(text: str, max_chars: int = 800, overlap: int = 200) -> list[str]:
+    """按字符数切分文本（相邻分块重叠 overlap 个字符），尽量在换行或句末处断开"""
+    chunks = []
+    start = 0
+    while start < len(text):
+        end = min(start + max_chars, len(text))
+        if end < len(text):
+            cut = max(text.rfind("\n", start + overlap + 1, end), text.rfind("。", start + overlap + 1, end))
+            if cut > start:
+                end = cut + 1
+        chunk = text[start:end].strip()
+        if chunk:
+            chunks.append(chunk)
+        if end >= len(text):
+            break
+        start = max(end - overlap, start + 1)
+    return chunks
+
+
+def main(args: argparse.Namespace) -> None:
+    from bulk_ingest import collect_files, source_root
+    from doc_pipeline import index_files
+
+    store = LocalVectorStore(os.path.join(args.dir, args.store))
+    if args.command == "index":
+        paths = collect_files(args.pattern)
+        report = index_files(
+            store, paths, source_root(args.pattern, paths), json.loads(args.attributes), None,
+            args.chunk_chars, args.overlap,
+        )
+        print(json.dumps({**report, "store": store.stats()}, ensure_ascii=False, indent=2))
+    else:
+        filters = json.loads(args.filters) if args.filters else None
+        for result in store.search(args.query, filters, args.max_num_results):
+            text = result["content"][0]["text"]
+            print(f"{result['score']:.3f}  {result['filename']}  {json.dumps(result['attributes'], ensure_ascii=False)}")
+            print(f"    {text[:120]}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dir", default=os.getenv("LOCAL_SEARCH_DIR", "local_index"), help="检索库根目录")
+    parser.add_argument("--store", default=os.getenv("LOCAL_SEARCH_STORE", "default"), help="检索库 ID")
+    commands = parser.add_subparsers(dest="command", required=True)
+    index = commands.add_parser("index", help="增量写入 PDF / 文本文件（内容未变的文件跳过，未变的分块复用向量）")
+    index.add_argument("pattern", help="目录或 glob（支持 **）")
+    index.add_argument("--attributes", default="{}", help="所有文件共用的 attributes（JSON）")
+    index.add_argument("--chunk-chars", type=int, default=800, help="每个分块的最大字符数")
+    index.add_argument("--overlap", type=int, default=200, help="相邻分块重叠的字符数")
+    search = commands.add_parser("search", help="检索")
+    search.add_argument("query")
+    search.add_argument("--filters", default=None, help="过滤条件（JSON，与 vector_stores.search 相同）")
+    search.add_argument("--max-num-results", type=int, default=5)
+    main(parser.parse_args())
@@ -1,15 +1,44 @@
-from openai import OpenAI
-from fastapi import FastAPI, APIRouter, Depends, Query
-from fastapi.responses import StreamingResponse
+from openai import OpenAI, AsyncOpenAI, APIStatusError, AsyncStream, NotFoundError
+from fastapi import FastAPI, APIRouter, Depends, Query, Header, HTTPException
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from starlette.background import BackgroundTask
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
 from starlette.requests import Request
-from typing import Optional, AsyncGenerator
+from typing import Any, Optional, AsyncGenerator, Awaitable, Callable, Literal, NamedTuple, Union
+import asyncio
+import json
+import time
+import httpx
 import uvicorn
 import os
+from pathlib import Path
 from contextlib import asynccontextmanager
 from dotenv import load_dotenv
 
+from admission import AdmissionController, AdmissionPermit, AdmissionRejected, parse_model_limits
+from bulk_ingest import collect_files, ingest_files, resolve_pattern, source_root
+from doc_pipeline import index_files
+from file_registry import FileRegistry, hash_file
+from hedging import Hedger
+from ingest import IngestJob, IngestQueue, UploadRejected, receive_upload
+from local_search import LocalSearchEngine, StoreNotFoundError, validate_filters
+from metrics import ChatMetrics
+from near_duplicate import NearDuplicateIndex, context_id
+from response_cache import CachedResponse, ResponseCache, ResponseRecorder, make_cache_key
+from search_cache import SearchCache, make_search_key
+from routing import Endpoint, EndpointRouter, RoutedStream
+from session_store import (
+    SessionBusyError, SessionLease, SessionLocks, SessionStore, create_session_store,
+)
+from sse import (
+    CANCELLED_FRAME, DELTA_TYPES, DONE_FRAME, EVENT_NAMES, FUNCTION_CALL_EVENTS, LIFECYCLE_NAMES,
+    FrameCoalescer, encode_error, encode_event, encode_frame, resolve_subscription,
+)
+from stream_hub import SLOW_CONSUMER_POLICIES, Broadcast, BroadcastRegistry, StreamEvent, Subscription
+from timeline import TraceStore
+from upstream import create_async_http_client, create_sync_http_client, warm_up
+
 # 加载环境变量
 load_dotenv()
 
@@ -17,64 +46,351 @@ load_dotenv()
 # 配置管理
 class Config:
     OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL", "https://llm.traderwtf.ai")
+    # 多个上游地址（逗号分隔），为空时只使用 OPENAI_BASE_URL
+    OPENAI_BASE_URLS = [
+        url.strip() for url in os.getenv("OPENAI_BASE_URLS", "").split(",") if url.strip()
+    ] or [OPENAI_BASE_URL]
     OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "")
     HOST = os.getenv("HOST", "127.0.0.1")
     PORT = int(os.getenv("PORT", "8000"))
+    # 上游连接池：最大连接数、保持的空闲连接数与空闲保持秒数
+    UPSTREAM_MAX_CONNECTIONS = int(os.getenv("UPSTREAM_MAX_CONNECTIONS", "100"))
+    UPSTREAM_MAX_KEEPALIVE = int(os.getenv("UPSTREAM_MAX_KEEPALIVE", "20"))
+    UPSTREAM_KEEPALIVE_EXPIRY = float(os.getenv("UPSTREAM_KEEPALIVE_EXPIRY", "60"))
+    # 是否启用 HTTP/2（需要安装 h2）
+    UPSTREAM_HTTP2 = os.getenv("UPSTREAM_HTTP2", "false").lower() == "true"
+    # 上游超时（秒）：建立连接 / 两次读取之间 / 发送请求 / 等待连接池
+    UPSTREAM_CONNECT_TIMEOUT = float(os.getenv("UPSTREAM_CONNECT_TIMEOUT", "5"))
+    UPSTREAM_READ_TIMEOUT = float(os.getenv("UPSTREAM_READ_TIMEOUT", "300"))
+    UPSTREAM_WRITE_TIMEOUT = float(os.getenv("UPSTREAM_WRITE_TIMEOUT", "30"))
+    UPSTREAM_POOL_TIMEOUT = float(os.getenv("UPSTREAM_POOL_TIMEOUT", "10"))
+    # 启动时预先建立的上游连接数（0 表示不预热）
+    UPSTREAM_WARMUP_CONNECTIONS = int(os.getenv("UPSTREAM_WARMUP_CONNECTIONS", "4"))
+    # 多上游路由：EWMA 平滑系数，连续失败次数 / 错误率达到阈值时摘除节点的秒数
+    ROUTING_EWMA_ALPHA = float(os.getenv("ROUTING_EWMA_ALPHA", "0.2"))
+    ROUTING_EJECT_FAILURES = int(os.getenv("ROUTING_EJECT_FAILURES", "5"))
+    ROUTING_EJECT_ERROR_RATE = float(os.getenv("ROUTING_EJECT_ERROR_RATE", "0.5"))
+    ROUTING_EJECT_SECONDS = float(os.getenv("ROUTING_EJECT_SECONDS", "30"))
+    # 文本增量合并窗口（毫秒），0 表示每个 delta 立即发送
+    STREAM_COALESCE_MS = int(os.getenv("STREAM_COALESCE_MS", "30"))
+    # 合并缓冲区达到该字节数时立即发送
+    STREAM_COALESCE_BYTES = int(os.getenv("STREAM_COALESCE_BYTES", "1024"))
+    # 慢消费者策略：coalesce（合并积压的增量）/ drop（另外丢弃中间生命周期帧）/ disconnect（持续落后时断开）
+    STREAM_SLOW_CONSUMER_POLICY = os.getenv("STREAM_SLOW_CONSUMER_POLICY", "coalesce")
+    # 发送队列深度超过该事件数时视为慢消费者
+    STREAM_SLOW_CONSUMER_LAG = int(os.getenv("STREAM_SLOW_CONSUMER_LAG", "256"))
+    # disconnect 策略下持续落后超过该秒数时断开
+    STREAM_SLOW_CONSUMER_DEADLINE = float(os.getenv("STREAM_SLOW_CONSUMER_DEADLINE", "30"))
+    # 会话存储：memory / sqlite / redis
+    SESSION_BACKEND = os.getenv("SESSION_BACKEND", "memory")
+    SESSION_MAX_ENTRIES = int(os.getenv("SESSION_MAX_ENTRIES", "100000"))
+    SESSION_TTL_SECONDS = float(os.getenv("SESSION_TTL_SECONDS", "86400"))
+    SESSION_SQLITE_PATH = os.getenv("SESSION_SQLITE_PATH", "sessions.db")
+    SESSION_REDIS_URL = os.getenv("SESSION_REDIS_URL", "redis://127.0.0.1:6379/0")
+    # 同一会话并发请求的处理策略：queue（排队）/ reject（拒绝）/ cancel（取消进行中的请求）
+    SESSION_CONCURRENCY_POLICY = os.getenv("SESSION_CONCURRENCY_POLICY", "queue")
+    SESSION_QUEUE_TIMEOUT = float(os.getenv("SESSION_QUEUE_TIMEOUT", "60"))
+    # 准入控制：全局并发上游请求数（0 表示不限制）与每个模型的上限（如 "g5.2=16,g4o=32"）
+    ADMISSION_MAX_CONCURRENCY = int(os.getenv("ADMISSION_MAX_CONCURRENCY", "64"))
+    ADMISSION_MODEL_LIMITS = os.getenv("ADMISSION_MODEL_LIMITS", "")
+    # 超出上限时最多排队的请求数（超出返回 429）与最长排队秒数（超时返回 503）
+    ADMISSION_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", "256"))
+    ADMISSION_QUEUE_TIMEOUT = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "10"))
+    # 对冲请求：首个事件超过 HEDGE_DELAY_MS 毫秒未到达时再发起一次相同的请求
+    # （HEDGE_DELAY_MS=0 表示使用最近首事件延迟的 HEDGE_PERCENTILE 分位数），对冲比例不超过 HEDGE_MAX_RATE
+    HEDGE_ENABLED = os.getenv("HEDGE_ENABLED", "false").lower() == "true"
+    HEDGE_DELAY_MS = int(os.getenv("HEDGE_DELAY_MS", "0"))
+    HEDGE_PERCENTILE = float(os.getenv("HEDGE_PERCENTILE", "95"))
+    HEDGE_MAX_RATE = float(os.getenv("HEDGE_MAX_RATE", "0.05"))
+    HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", "50"))
+    # 断线续传：每个流保留的最近事件数、结束后保留的秒数与数量、客户端断开后等待重连的秒数
+    RESUME_BUFFER_EVENTS = int(os.getenv("RESUME_BUFFER_EVENTS", "8192"))
+    RESUME_RETENTION_SECONDS = float(os.getenv("RESUME_RETENTION_SECONDS", "120"))
+    RESUME_MAX_RESPONSES = int(os.getenv("RESUME_MAX_RESPONSES", "1000"))
+    RESUME_GRACE_SECONDS = float(os.getenv("RESUME_GRACE_SECONDS", "5"))
+    # 等待上游事件期间检查客户端是否断开的间隔（秒）
+    DISCONNECT_CHECK_SECONDS = float(os.getenv("DISCONNECT_CHECK_SECONDS", "1"))
+    # 请求事件时间线：保留的响应数、每个响应最多记录的事件数、上游结束时追加导出的 JSONL 文件（为空表示不导出）
+    TRACE_ENABLED = os.getenv("TRACE_ENABLED", "true").lower() == "true"
+    TRACE_MAX_RESPONSES = int(os.getenv("TRACE_MAX_RESPONSES", "1000"))
+    TRACE_MAX_EVENTS = int(os.getenv("TRACE_MAX_EVENTS", "4096"))
+    TRACE_EXPORT_PATH = os.getenv("TRACE_EXPORT_PATH", "")
+    # 文件上传：临时文件目录（为空表示系统临时目录）、大小上限、每次写盘的字节数
+    UPLOAD_DIR = os.getenv("UPLOAD_DIR", "")
+    UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", str(512 * 1024 * 1024)))
+    UPLOAD_CHUNK_BYTES = int(os.getenv("UPLOAD_CHUNK_BYTES", str(1024 * 1024)))
+    # 已上传文件的本地登记（内容哈希 -> file_id -> vector store）与默认的 vector store 名称
+    FILE_REGISTRY_PATH = os.getenv("FILE_REGISTRY_PATH", "file_registry.db")
+    VECTOR_STORE_NAME = os.getenv("VECTOR_STORE_NAME", "Support QA")
+    # 后台入库：worker 数、最多排队的任务数、最多保留的任务记录数
+    INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "4"))
+    INGEST_MAX_QUEUE = int(os.getenv("INGEST_MAX_QUEUE", "100"))
+    INGEST_MAX_JOBS = int(os.getenv("INGEST_MAX_JOBS", "1000"))
+    # 批量入库时同时哈希 / 上传的文件数
+    INGEST_CONCURRENCY = int(os.getenv("INGEST_CONCURRENCY", "8"))
+    # POST /api/upload/bulk 只能读取该目录下的文件，为空时关闭该接口
+    INGEST_SOURCE_DIR = os.getenv("INGEST_SOURCE_DIR", "")
+    # 本地检索：是否作为 search_documents 函数工具提供给对话、索引目录、对话检索的库、返回条数与固定的过滤条件（JSON）
+    LOCAL_SEARCH_ENABLED = os.getenv("LOCAL_SEARCH_ENABLED", "false").lower() == "true"
+    LOCAL_SEARCH_DIR = os.getenv("LOCAL_SEARCH_DIR", "local_index")
+    LOCAL_SEARCH_STORE = os.getenv("LOCAL_SEARCH_STORE", "default")
+    LOCAL_SEARCH_MAX_RESULTS = int(os.getenv("LOCAL_SEARCH_MAX_RESULTS", "5"))
+    LOCAL_SEARCH_FILTERS = os.getenv("LOCAL_SEARCH_FILTERS", "")
+    # POST /api/search/index 只能读取该目录下的文件，为空时关闭该接口
+    LOCAL_SEARCH_SOURCE_DIR = os.getenv("LOCAL_SEARCH_SOURCE_DIR", "")
+    # 检索结果缓存（本地检索库与远端 vector store），vector store 加入新文件时失效
+    SEARCH_CACHE_ENABLED = os.getenv("SEARCH_CACHE_ENABLED", "true").lower() == "true"
+    SEARCH_CACHE_MAX_ENTRIES = int(os.getenv("SEARCH_CACHE_MAX_ENTRIES", "10000"))
+    SEARCH_CACHE_TTL_SECONDS = float(os.getenv("SEARCH_CACHE_TTL_SECONDS", "300"))
+    # 首轮提问的回答缓存
+    RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "true").lower() == "true"
+    RESPONSE_CACHE_MAX_BYTES = int(os.getenv("RESPONSE_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+    RESPONSE_CACHE_TTL_SECONDS = float(os.getenv("RESPONSE_CACHE_TTL_SECONDS", "300"))
+    # 内存预算不足时溢出到磁盘的目录，为空表示不溢出
+    RESPONSE_CACHE_SPILL_DIR = os.getenv("RESPONSE_CACHE_SPILL_DIR", "")
+    RESPONSE_CACHE_SPILL_MAX_BYTES = int(os.getenv("RESPONSE_CACHE_SPILL_MAX_BYTES", str(1024 * 1024 * 1024)))
+    # 近似重复问题匹配（复用回答缓存，需要开启 RESPONSE_CACHE_ENABLED）
+    NEAR_DUP_ENABLED = os.getenv("NEAR_DUP_ENABLED", "false").lower() == "true"
+    NEAR_DUP_THRESHOLD = float(os.getenv("NEAR_DUP_THRESHOLD", "0.8"))
+    NEAR_DUP_MAX_ENTRIES = int(os.getenv("NEAR_DUP_MAX_ENTRIES", "1000000"))
 
 
 # 全局 OpenAI 客户端（单例模式）
 _client: Optional[OpenAI] = None
 
 
+def upstream_pool_options() -> dict:
+    """上游连接池配置"""
+    return {
+        "max_connections": Config.UPSTREAM_MAX_CONNECTIONS,
+        "max_keepalive": Config.UPSTREAM_MAX_KEEPALIVE,
+        "keepalive_expiry": Config.UPSTREAM_KEEPALIVE_EXPIRY,
+        "http2": Config.UPSTREAM_HTTP2,
+        "connect_timeout": Config.UPSTREAM_CONNECT_TIMEOUT,
+        "read_timeout": Config.UPSTREAM_READ_TIMEOUT,
+        "write_timeout": Config.UPSTREAM_WRITE_TIMEOUT,
+        "pool_timeout": Config.UPSTREAM_POOL_TIMEOUT,
+    }
+
+
 def get_client() -> OpenAI:
     """获取 OpenAI 客户端实例（依赖注入）"""
     global _client
     if _client is None:
         _client = OpenAI(
-            base_url=Config.OPENAI_BASE_URL,
+            base_url=Config.OPENAI_BASE_URLS[0],
             api_key=Config.OPENAI_API_KEY,
+            http_client=create_sync_http_client(**upstream_pool_options()),
         )
     return _client
 
 
-def file_upload(client: OpenAI, file_path: str) -> str:
+# 全局异步 OpenAI 客户端（流式对话使用，避免阻塞事件循环）及其连接池
+_async_client: Optional[AsyncOpenAI] = None
+_async_http_client: Optional[httpx.AsyncClient] = None
+
+
+def get_async_client() -> AsyncOpenAI:
+    """获取异步 OpenAI 客户端实例（依赖注入，通常已在启动时创建并预热）"""
+    global _async_client, _async_http_client
+    if _async_client is None:
+        _async_http_client = create_async_http_client(**upstream_pool_options())
+        _async_client = AsyncOpenAI(
+            base_url=Config.OPENAI_BASE_URLS[0],
+            api_key=Config.OPENAI_API_KEY,
+            http_client=_async_http_client,
+        )
+    return _async_client
+
+
+# 配置了多个上游地址时的路由（启动时创建，单个地址时为 None）
+upstream_router: Optional[EndpointRouter] = None
+
+
+def create_router(http_clients: dict[str, httpx.AsyncClient]) -> EndpointRouter:
+    """
+    创建多上游路由
+    
+    Args:
+        http_clients: 上游地址 -> 该地址独立的连接池
+    """
+    endpoints = [
+        Endpoint(url, AsyncOpenAI(base_url=url, api_key=Config.OPENAI_API_KEY, http_client=http_client))
+        for url, http_client in http_clients.items()
+    ]
+    return EndpointRouter(
+        endpoints,
+        alpha=Config.ROUTING_EWMA_ALPHA,
+        eject_failures=Config.ROUTING_EJECT_FAILURES,
+        eject_error_rate=Config.ROUTING_EJECT_ERROR_RATE,
+        eject_seconds=Config.ROUTING_EJECT_SECONDS,
+    )
+
+
+async def resolve_vector_store(client: AsyncOpenAI, vector_store_id: Optional[str] = None) -> str:
+    """
+    确定上传的目标 vector store
+    
+    Args:
+        client: 异步 OpenAI 客户端
+        vector_store_id: 指定的 vector store，None 表示使用 VECTOR_STORE_NAME（首次使用时创建并登记）
+        
+    Returns:
+        str: vector store ID
+    """
+    if vector_store_id is not None:
+        return vector_store_id
+    async with file_registry.lock(f"store:{Config.VECTOR_STORE_NAME}"):
+        vector_store_id = file_registry.store_id(Config.VECTOR_STORE_NAME)
+        if vector_store_id is None:
+            vector_store = await client.vector_stores.create(name=Config.VECTOR_STORE_NAME)
+            vector_store_id = vector_store.id
+            await file_registry.add_store(vector_store_id, Config.VECTOR_STORE_NAME)
+    return vector_store_id
+
+
+async def file_upload(
+    client: AsyncOpenAI,
+    file_path: str,
+    filename: Optional[str] = None,
+    vector_store_id: Optional[str] = None,
+    sha256: Optional[str] = None,
+) -> dict:
     """
     上传文件到 vector store
     
+    按内容哈希去重：相同的字节只上传一次，已在目标 vector store 中的内容不再重复索引。
+    
     Args:
-        client: OpenAI 客户端
+        client: 异步 OpenAI 客户端
         file_path: 要上传的文件路径
+        filename: 上传时使用的文件名（决定文件类型），默认取 file_path 的文件名
+        vector_store_id: 目标 vector store，None 表示使用 VECTOR_STORE_NAME（首次使用时创建）
+        sha256: 已知的内容哈希，None 时读取文件计算
         
     Returns:
-        vector_store_id: 创建的 vector store ID
+        dict: vector_store_id、file_id、sha256，以及是否新上传了文件（uploaded）、是否新加入了 vector store（attached）
+        
+    Raises:
+        RuntimeError: vector store 处理文件失败或被取消（不登记为已加入）
     """
-    # 创建 vector store
-    vector_store = client.vector_stores.create(
-        name="Support QA",
-    )
-    
-    # 上传文档
-    with open(file_path, "rb") as f:
-        client.vector_stores.files.upload_and_poll(
-            vector_store_id=vector_store.id,
-            file=f
-        )
+    filename = filename or os.path.basename(file_path)
+    if sha256 is None:
+        sha256 = await asyncio.to_thread(hash_file, file_path)
+    vector_store_id = await resolve_vector_store(client, vector_store_id)
     
-    # TODO: 保存映射关系到本地进行管理
-    return vector_store.id
+    result = {"vector_store_id": vector_store_id, "file_id": None, "sha256": sha256, "uploaded": False, "attached": False}
+    async with file_registry.lock(sha256):
+        file_id = file_registry.file_id(sha256)
+        if file_registry.is_attached(vector_store_id, sha256):
+            result["file_id"] = file_id
+            return result
+        for _ in range(2):
+            if file_id is None:
+                # 文件在线程中读取
+                uploaded = await client.files.create(file=(filename, Path(file_path)), purpose="assistants")
+                file_id = uploaded.id
+                result["uploaded"] = True
+                await file_registry.add_file(sha256, file_id, filename, os.path.getsize(file_path))
+            try:
+                # 等待索引完成（轮询使用 asyncio.sleep，不阻塞事件循环）
+                vs_file = await client.vector_stores.files.create_and_poll(vector_store_id=vector_store_id, file_id=file_id)
+                break
+            except NotFoundError:
+                if result["uploaded"]:
+                    raise
+                # 登记的文件已在远端被删除，重新上传
+                await file_registry.forget_file(sha256)
+                file_id = None
+        # 索引失败或被取消时 create_and_poll 同样正常返回，不能登记为已加入（否则相同内容以后都被跳过）
+        if vs_file.status != "completed":
+            reason = vs_file.last_error.message if vs_file.last_error else vs_file.status
+            raise RuntimeError(f"文件 {filename} 索引失败: {reason}")
+        await file_registry.attach(vector_store_id, sha256, file_id)
+    result["file_id"] = file_id
+    result["attached"] = True
+    return result
+
+
+# 会话状态管理（session_id -> 上一次 response_id）
+session_store: SessionStore = create_session_store(
+    Config.SESSION_BACKEND,
+    max_entries=Config.SESSION_MAX_ENTRIES,
+    ttl=Config.SESSION_TTL_SECONDS,
+    sqlite_path=Config.SESSION_SQLITE_PATH,
+    redis_url=Config.SESSION_REDIS_URL,
+)
+
+# 已上传文件的本地登记
+file_registry = FileRegistry(Config.FILE_REGISTRY_PATH)
+
+# 同一会话的请求串行执行
+session_locks = SessionLocks(Config.SESSION_CONCURRENCY_POLICY, Config.SESSION_QUEUE_TIMEOUT)
 
+# 首轮提问的回答缓存
+response_cache: Optional[ResponseCache] = ResponseCache(
+    max_bytes=Config.RESPONSE_CACHE_MAX_BYTES,
+    ttl=Config.RESPONSE_CACHE_TTL_SECONDS,
+    spill_dir=Config.RESPONSE_CACHE_SPILL_DIR or None,
+    spill_max_bytes=Config.RESPONSE_CACHE_SPILL_MAX_BYTES,
+) if Config.RESPONSE_CACHE_ENABLED else None
 
-# 会话状态管理（简单实现，生产环境建议使用 Redis 等）
-session_store: dict[str, str] = {}
+# 检索结果缓存：远端 vector store 登记新文件时失效，本地检索库在写入后失效
+search_cache: Optional[SearchCache] = SearchCache(
+    max_entries=Config.SEARCH_CACHE_MAX_ENTRIES,
+    ttl=Config.SEARCH_CACHE_TTL_SECONDS,
+) if Config.SEARCH_CACHE_ENABLED else None
+if search_cache is not None:
+    file_registry.on_attach(search_cache.invalidate)
+
+# 近似重复问题索引（问题 -> 回答缓存键）
+near_duplicate_index: Optional[NearDuplicateIndex] = NearDuplicateIndex(
+    threshold=Config.NEAR_DUP_THRESHOLD,
+    max_entries=Config.NEAR_DUP_MAX_ENTRIES,
+) if Config.NEAR_DUP_ENABLED and response_cache is not None else None
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """应用生命周期管理"""
+    global _client, _async_client, _async_http_client, upstream_router
     # 启动时初始化
     print(f"应用启动 - 监听 http://{Config.HOST}:{Config.PORT}")
+    # 创建上游客户端并预先建立连接
+    if not Config.OPENAI_API_KEY:
+        print("未配置 OPENAI_API_KEY，跳过上游连接预热")
+    else:
+        get_async_client()
+        get_client()
+        http_clients = {Config.OPENAI_BASE_URLS[0]: _async_http_client}
+        if len(Config.OPENAI_BASE_URLS) > 1:
+            http_clients = {
+                url: create_async_http_client(**upstream_pool_options()) for url in Config.OPENAI_BASE_URLS
+            }
+            upstream_router = create_router(http_clients)
+        if Config.UPSTREAM_WARMUP_CONNECTIONS > 0:
+            for url, http_client in http_clients.items():
+                opened = await warm_up(
+                    http_client, url, Config.UPSTREAM_WARMUP_CONNECTIONS, Config.UPSTREAM_CONNECT_TIMEOUT
+                )
+                print(f"已预热上游连接 {url}: {opened}/{Config.UPSTREAM_WARMUP_CONNECTIONS}")
+    ingest_queue.start()
     yield
     # 关闭时清理
+    await ingest_queue.stop()
+    if _async_client is not None:
+        await _async_client.close()
+        _async_client = None
+        _async_http_client = None
+    if _client is not None:
+        _client.close()
+        _client = None
+    if upstream_router is not None:
+        for endpoint in upstream_router.endpoints:
+            await endpoint.client.close()
+        upstream_router = None
+    await session_store.close()
+    file_registry.close()
     print("应用关闭")
 
 
@@ -96,166 +412,1189 @@ app.add_middleware(
 router = APIRouter(prefix="/api")
 
 
+# 本地检索库（网关不支持 /vector_stores 时代替 file_search）
+local_search = LocalSearchEngine(Config.LOCAL_SEARCH_DIR)
+LOCAL_SEARCH_FILTERS: Optional[dict] = json.loads(Config.LOCAL_SEARCH_FILTERS) if Config.LOCAL_SEARCH_FILTERS else None
+validate_filters(LOCAL_SEARCH_FILTERS)
+
+# 本地检索的函数工具，模型调用时由服务端执行检索并把结果交回模型
+SEARCH_DOCUMENTS_TOOL = {
+    "type": "function",
+    "name": "search_documents",
+    "description": "在本地知识库（已上传的文档）中检索与问题相关的段落",
+    "parameters": {
+        "type": "object",
+        "properties": {
+            "query": {"type": "string", "description": "检索用的关键词或问题"},
+        },
+        "required": ["query"],
+        "additionalProperties": False,
+    },
+    "strict": True,
+}
+# 一次回答中最多执行的工具调用轮数
+MAX_TOOL_ROUNDS = 3
+
+# 对话使用的工具和推理配置（同时参与回答缓存的键）
+CHAT_TOOLS = [{"type": "web_search_preview"}]
+if Config.LOCAL_SEARCH_ENABLED:
+    CHAT_TOOLS.append(SEARCH_DOCUMENTS_TOOL)
+CHAT_REASONING = {
+    "effort": "medium",
+    "summary": "auto",
+}
+
+if Config.STREAM_SLOW_CONSUMER_POLICY not in SLOW_CONSUMER_POLICIES:
+    raise ValueError(f"不支持的慢消费者策略: {Config.STREAM_SLOW_CONSUMER_POLICY}")
+
+# 上游请求准入控制
+admission = AdmissionController(
+    max_concurrency=Config.ADMISSION_MAX_CONCURRENCY,
+    model_limits=parse_model_limits(Config.ADMISSION_MODEL_LIMITS),
+    max_queue=Config.ADMISSION_MAX_QUEUE,
+    queue_timeout=Config.ADMISSION_QUEUE_TIMEOUT,
+)
+
+# Prometheus 指标
+chat_metrics = ChatMetrics()
+
+# 请求事件时间线
+traces: Optional[TraceStore] = (
+    TraceStore(Config.TRACE_MAX_RESPONSES, Config.TRACE_MAX_EVENTS, Config.TRACE_EXPORT_PATH)
+    if Config.TRACE_ENABLED else None
+)
+
+
+async def ingest_upload(job: IngestJob) -> dict:
+    """后台入库：上传到 vector store，返回任务结果"""
+    started = time.monotonic()
+    try:
+        return await file_upload(
+            get_async_client(), job.file.path, job.file.filename, job.options.get("vector_store_id"), job.file.sha256
+        )
+    except Exception:
+        chat_metrics.upload_errors.inc()
+        raise
+    finally:
+        chat_metrics.upload_duration.observe(time.monotonic() - started)
+
+
+async def ingest_bulk(job: IngestJob) -> dict:
+    """后台批量入库：并发上传文件，按 file batch 加入 vector store，返回吞吐与失败统计"""
+    started = time.monotonic()
+    client = get_async_client()
+    try:
+        pattern = job.options["pattern"]
+        paths = await asyncio.to_thread(collect_files, pattern, job.options.get("root"))
+        if not paths:
+            raise ValueError(f"{pattern} 没有匹配的文件")
+        vector_store_id = await resolve_vector_store(client, job.options.get("vector_store_id"))
+        result = await ingest_files(
+            client, file_registry, vector_store_id, paths, source_root(pattern, paths),
+            job.options.get("attributes"), job.options.get("manifest"),
+            job.options.get("concurrency") or Config.INGEST_CONCURRENCY,
+        )
+        if result["failed"]:
+            chat_metrics.upload_errors.inc(amount=result["failed"])
+        return {"vector_store_id": vector_store_id, **result}
+    except Exception:
+        chat_metrics.upload_errors.inc()
+        raise
+    finally:
+        chat_metrics.upload_duration.observe(time.monotonic() - started)
+
+
+async def index_local(job: IngestJob) -> dict:
+    """后台增量写入本地检索库：未变的文件跳过，变化文件中未变的分块复用向量"""
+    pattern = job.options["pattern"]
+    paths = await asyncio.to_thread(collect_files, pattern, job.options.get("root"))
+    if not paths:
+        raise ValueError(f"{pattern} 没有匹配的文件")
+    vector_store_id = job.options["vector_store_id"]
+    # file_id 相对固定的 LOCAL_SEARCH_SOURCE_DIR，不随 pattern 变化（不同 pattern 匹配到的同一个文件是同一个 file_id）
+    root = job.options.get("root") or source_root(pattern, paths)
+    try:
+        result = await asyncio.to_thread(
+            index_files, local_search.store(vector_store_id), paths, root,
+            job.options.get("attributes"), job.options.get("manifest"),
+            job.options["chunk_chars"], job.options["overlap"],
+        )
+    finally:
+        # 写入了部分文件后失败时缓存同样过期
+        if search_cache is not None:
+            search_cache.invalidate(local_scope(vector_store_id))
+    return {"vector_store_id": vector_store_id, **result}
+
+
+# 上传文件的后台入库队列
+ingest_queue = IngestQueue(
+    ingest_upload,
+    workers=Config.INGEST_WORKERS,
+    max_queue=Config.INGEST_MAX_QUEUE,
+    max_jobs=Config.INGEST_MAX_JOBS,
+)
+
+# 首事件延迟统计与对冲请求
+hedger = Hedger(
+    enabled=Config.HEDGE_ENABLED,
+    delay=Config.HEDGE_DELAY_MS / 1000,
+    percentile=Config.HEDGE_PERCENTILE,
+    max_rate=Config.HEDGE_MAX_RATE,
+    min_samples=Config.HEDGE_MIN_SAMPLES,
+)
+
+# 进行中和最近结束的上游流；相同的首轮提问共享同一个广播，断线后可按 response_id 续传
+broadcasts = BroadcastRegistry(
+    max_events=Config.RESUME_BUFFER_EVENTS,
+    retention=Config.RESUME_RETENTION_SECONDS,
+    max_responses=Config.RESUME_MAX_RESPONSES,
+    grace=Config.RESUME_GRACE_SECONDS,
+)
+
+
+def local_scope(vector_store_id: str) -> str:
+    """本地检索库在检索结果缓存中的 ID（与远端 vector store 区分）"""
+    return f"local:{vector_store_id}"
+
+
+async def cached_search(
+    scope: str,
+    query: str,
+    filters: Optional[dict[str, Any]],
+    max_num_results: int,
+    search: Callable[[], Awaitable[list[dict[str, Any]]]],
+) -> list[dict[str, Any]]:
+    """
+    经过检索结果缓存执行检索
+
+    Args:
+        scope: 缓存中的 vector store ID（失效的单位）
+        query: 查询文本
+        filters: 过滤条件
+        max_num_results: 最多返回的结果数
+        search: 未命中时执行的检索
+
+    Returns:
+        list[dict]: 检索结果（命中时为缓存的结果，调用方不能修改）
+    """
+    if search_cache is None:
+        return await search()
+    key = make_search_key(scope, query, filters, max_num_results)
+    results = search_cache.get(key)
+    chat_metrics.search_cache_requests.inc("hit" if results is not None else "miss")
+    if results is None:
+        generation = search_cache.generation(scope)
+        results = await search()
+        search_cache.put(key, results, generation)
+    return results
+
+
+async def search_local(
+    vector_store_id: str,
+    query: str,
+    filters: Optional[dict[str, Any]] = None,
+    max_num_results: int = 10,
+) -> list[dict[str, Any]]:
+    """
+    在本地检索库中检索（在线程中执行，不阻塞事件循环；相同的检索命中检索结果缓存）
+
+    Raises:
+        ValueError: vector_store_id 或过滤条件无效
+        StoreNotFoundError: 检索库不存在
+    """
+    validate_filters(filters)
+
+    async def search() -> list[dict[str, Any]]:
+        started = time.monotonic()
+        try:
+            return await asyncio.to_thread(local_search.search, vector_store_id, query, filters, max_num_results)
+        finally:
+            chat_metrics.local_search_duration.observe(time.monotonic() - started)
+
+    return await cached_search(local_scope(vector_store_id), query, filters, max_num_results, search)
+
+
+async def search_remote(
+    vector_store_id: str,
+    query: str,
+    filters: Optional[dict[str, Any]] = None,
+    max_num_results: int = 10,
+) -> list[dict[str, Any]]:
+    """
+    在远端 vector store 中检索（vector_stores.search；相同的检索命中检索结果缓存）
+
+    Raises:
+        APIStatusError: 上游返回错误
+    """
+    async def search() -> list[dict[str, Any]]:
+        options = {"filters": filters} if filters is not None else {}
+        page = await get_async_client().vector_stores.search(
+            vector_store_id, query=query, max_num_results=max_num_results, **options
+        )
+        return [item.model_dump() for item in page.data]
+
+    return await cached_search(vector_store_id, query, filters, max_num_results, search)
+
+
+async def run_search_tool(call: Any, broadcast: Broadcast) -> dict[str, Any]:
+    """
+    执行模型请求的 search_documents 调用
+
+    检索进度以 file_search_searching / file_search_completed 帧通知前端。
+
+    Args:
+        call: 模型输出的 function_call（name, arguments, call_id）
+        broadcast: 目标广播
+
+    Returns:
+        dict: 交回模型的 function_call_output
+    """
+    try:
+        if call.name != SEARCH_DOCUMENTS_TOOL["name"]:
+            raise ValueError(f"未知的工具: {call.name}")
+        query = json.loads(call.arguments)["query"]
+        broadcast.publish(StreamEvent("file_search_searching", frame=encode_frame(
+            {"type": "file_search_searching", "query": query}
+        )))
+        results = await search_local(
+            Config.LOCAL_SEARCH_STORE, query, LOCAL_SEARCH_FILTERS, Config.LOCAL_SEARCH_MAX_RESULTS
+        )
+        broadcast.publish(StreamEvent("file_search_completed", frame=encode_frame(
+            {"type": "file_search_completed", "query": query, "results": len(results)}
+        )))
+        output: Any = [
+            {"filename": r["filename"], "score": r["score"], "text": r["content"][0]["text"]} for r in results
+        ]
+    except Exception as e:
+        output = {"error": str(e)}
+    return {"type": "function_call_output", "call_id": call.call_id, "output": json.dumps(output, ensure_ascii=False)}
+
+
+async def pump_upstream(
+    broadcast: Broadcast,
+    client: AsyncOpenAI,
+    question: str,
+    model: str,
+    previous_response_id: Optional[str],
+    permit: Optional[AdmissionPermit] = None,
+) -> None:
+    """
+    读取上游流并发布到广播
+    
+    作为独立任务运行，不受单个客户端连接影响；所有订阅者离开时被取消。
+    首个事件超过对冲延迟仍未到达时，由 hedger 发起相同的请求并使用先到的一个。
+    配置了多个上游地址时，由 upstream_router 选择节点（多轮对话固定发往上一轮所在的节点）。
+    模型调用 search_documents 时在本地检索库中检索，把结果交回模型接着上一个 response 续写（最多 MAX_TOOL_ROUNDS 轮）。
+    首轮提问完成后写入回答缓存。开启追踪时在 broadcast.timeline 中记录每个上游事件的到达时间。
+    
+    Args:
+        broadcast: 目标广播
+        client: 异步 OpenAI 客户端
+        question: 用户问题
+        model: 使用的模型
+        previous_response_id: 上一次的 response_id
+        permit: 准入名额，上游结束时释放
+    """
+    response = None
+    recorder = ResponseRecorder() if broadcast.key is not None and response_cache is not None else None
+    completed = False
+    # 本次请求已使用的上游节点（对冲请求尽量发往其他节点）
+    used: set[Endpoint] = set()
+    timeline = broadcast.timeline
+    started = time.monotonic()
+    last_delta: Optional[float] = None
+
+    # 本轮请求的输入；模型调用 search_documents 后改为工具结果，接着上一个 response 续写
+    turn_input: list[dict[str, Any]] = [{"role": "user", "content": question}]
+    turn_previous = previous_response_id
+    turn_tool_choice = "auto"
+    # 本轮模型请求的函数调用
+    tool_calls: list[Any] = []
+
+    async def create(upstream: AsyncOpenAI) -> tuple[AsyncStream, Any]:
+        # 发起一次上游请求并读到首个事件
+        stream = await upstream.responses.create(
+            model=model,
+            tool_choice=turn_tool_choice,
+            tools=CHAT_TOOLS,
+            input=turn_input,
+            previous_response_id=turn_previous,
+            stream=True,
+            reasoning=CHAT_REASONING,
+        )
+        try:
+            return stream, await stream.__anext__()
+        except StopAsyncIteration:
+            await stream.close()
+            raise RuntimeError("上游流没有返回任何事件") from None
+        except BaseException:
+            await stream.close()
+            raise
+
+    async def open_attempt() -> tuple[Any, Any]:
+        # 对冲时可能同时进行两次；配置了多个上游地址时由 upstream_router 选择节点
+        if upstream_router is None:
+            return await create(client)
+        return await upstream_router.open(create, turn_previous, used)
+
+    def handle(event: Any) -> None:
+        nonlocal completed, last_delta
+        chat_metrics.upstream_events.inc(event.type)
+        if timeline is not None:
+            timeline.upstream(event.type)
+        kind = DELTA_TYPES.get(event.type)
+        if kind is not None:
+            now = time.monotonic()
+            if last_delta is None:
+                chat_metrics.first_text.observe(now - started)
+            else:
+                chat_metrics.delta_gap.observe(now - last_delta)
+            last_delta = now
+            broadcast.publish(StreamEvent(kind, text=event.delta))
+            if recorder is not None:
+                recorder.record_delta(kind, event.delta)
+            return
+        if event.type in FUNCTION_CALL_EVENTS:
+            # 函数参数由服务端执行，不转发给前端
+            return
+        if event.type == "response.output_item.done" and event.item.type == "function_call":
+            tool_calls.append(event.item)
+        if event.type == "response.completed" and tool_calls:
+            # 还要执行工具并续写，回答没有结束
+            return
+        if event.type == "response.created":
+            broadcast.set_response_id(event.response.id)
+            if timeline is not None:
+                traces.register(event.response.id, timeline)
+            if isinstance(response, RoutedStream):
+                # 后续轮次的 previous_response_id 只存在于这个节点
+                upstream_router.bind(event.response.id, response.endpoint)
+        elif event.type == "response.completed":
+            completed = True
+        name = EVENT_NAMES.get(event.type, "unknown")
+        frame = encode_event(event)
+        broadcast.publish(StreamEvent(name, frame=frame))
+        if recorder is not None:
+            recorder.record(name, frame)
+
+    chat_metrics.active_upstreams.inc()
+    try:
+        response, first = await hedger.first_event(open_attempt)
+        chat_metrics.first_event.observe(time.monotonic() - started)
+        handle(first)
+        async for event in response:
+            handle(event)
+
+        rounds = 0
+        while tool_calls:
+            # 执行模型请求的本地检索，把结果交回模型续写（带工具结果的回答不写入缓存）
+            rounds += 1
+            await response.close()
+            response = None
+            recorder = None
+            turn_input = [await run_search_tool(call, broadcast) for call in tool_calls]
+            turn_previous = broadcast.response_id
+            tool_calls.clear()
+            if rounds >= MAX_TOOL_ROUNDS:
+                turn_tool_choice = "none"
+            response, first = await open_attempt()
+            handle(first)
+            async for event in response:
+                handle(event)
+
+        if recorder is not None and completed and broadcast.response_id is not None:
+            await response_cache.put(broadcast.key, recorder.finish(broadcast.response_id, response_cache.ttl))
+            if near_duplicate_index is not None:
+                near_duplicate_index.add(question, context_id(model, CHAT_TOOLS, CHAT_REASONING), broadcast.key)
+                
+    except asyncio.CancelledError:
+        chat_metrics.upstream_errors.inc("cancelled")
+        broadcast.publish(StreamEvent("error", frame=encode_error("上游请求已取消")))
+        raise
+    except Exception as e:
+        chat_metrics.upstream_errors.inc(type(e).__name__)
+        if isinstance(response, RoutedStream):
+            upstream_router.record_failure(response.endpoint)
+        broadcast.publish(StreamEvent("error", frame=encode_error(str(e))))
+    finally:
+        if response is not None:
+            await response.close()
+        if permit is not None:
+            permit.release()
+        chat_metrics.active_upstreams.dec()
+        chat_metrics.upstream_duration.observe(time.monotonic() - started)
+        if timeline is not None:
+            traces.finish(timeline)
+        broadcast.finish()
+
+
+async def relay_subscription(
+    subscription: Subscription,
+    coalescer: FrameCoalescer,
+    subscribed: Optional[frozenset[str]],
+    session_id: Optional[str] = None,
+    lease: Optional[SessionLease] = None,
+    is_disconnected: Optional[Callable[[], Awaitable[bool]]] = None
+) -> AsyncGenerator[bytes, None]:
+    """
+    将订阅到的事件编码后转发给客户端
+    
+    读取上游由 pump_upstream 独立完成，这里只按客户端的速度消费广播；
+    发送队列深度超过 STREAM_SLOW_CONSUMER_LAG 时按 STREAM_SLOW_CONSUMER_POLICY 处理：
+    - coalesce: 积压的同类增量合并为一帧发送
+    - drop: 在合并的基础上丢弃中间生命周期帧
+    - disconnect: 持续落后超过 STREAM_SLOW_CONSUMER_DEADLINE 秒时发送错误并结束
+    落后超过广播缓冲区导致事件丢失时，无论哪种策略都发送错误并结束。
+    
+    上游长时间没有事件（推理、联网搜索）时不会写出，无法从写失败发现断开，
+    因此每隔 DISCONNECT_CHECK_SECONDS 主动检查一次客户端连接。
+    
+    Args:
+        subscription: 广播订阅
+        coalescer: 帧合并器
+        subscribed: 客户端订阅的前端帧类型，None 表示全部发送
+        session_id: 收到 created 事件时要更新的会话 ID
+        lease: 会话锁，被同一会话的新请求取消时提前结束
+        is_disconnected: 检查客户端是否已断开（Request.is_disconnected）
+        
+    Yields:
+        bytes: 一个或多个打包在一起的 SSE 帧（id 为事件序号）
+    """
+    broadcast = subscription.broadcast
+    policy = Config.STREAM_SLOW_CONSUMER_POLICY
+    lagging_since: Optional[float] = None
+    next_check = time.monotonic() + Config.DISCONNECT_CHECK_SECONDS
+    while True:
+        slow = subscription.lag > Config.STREAM_SLOW_CONSUMER_LAG
+        seq, events = subscription.take()
+        if subscription.lost:
+            chat_metrics.stream_errors.inc()
+            coalescer.append(encode_error("客户端读取过慢，部分事件已被丢弃"))
+            return
+        if not slow:
+            lagging_since = None
+        elif policy == "disconnect":
+            now = time.monotonic()
+            if lagging_since is None:
+                lagging_since = now
+            elif now - lagging_since > Config.STREAM_SLOW_CONSUMER_DEADLINE:
+                subscription.too_slow = True
+                chat_metrics.stream_errors.inc()
+                coalescer.append(encode_error("客户端读取过慢，连接已断开"))
+                return
+        # 积压的事件处理完后一次写出，连续的同类增量合并为一帧
+        coalescer.holding = slow
+        for event_id, event in enumerate(events, seq):
+            if event.name == "created" and session_id is not None:
+                # 保存新的 response_id
+                await session_store.set(session_id, broadcast.response_id)
+            # 未订阅的事件不发送（error 总是发送）
+            if subscribed is not None and event.name not in subscribed and event.name != "error":
+                continue
+            if slow and policy == "drop" and event.name in LIFECYCLE_NAMES:
+                subscription.dropped += 1
+                continue
+            if event.text is not None:
+                data = coalescer.add_delta(event.name, event.text, event_id)
+            else:
+                data = coalescer.add_frame(event.frame, event.name == "created", event_id)
+            if data:
+                # yield 返回前客户端连接一直在写出（或等待发送缓冲区腾出空间）
+                started = time.monotonic()
+                yield data
+                subscription.blocked += time.monotonic() - started
+        if slow:
+            coalescer.holding = False
+            data = coalescer.flush()
+            if data:
+                started = time.monotonic()
+                yield data
+                subscription.blocked += time.monotonic() - started
+        if lease is not None and lease.cancelled.is_set():
+            coalescer.append(CANCELLED_FRAME)
+            return
+        if subscription.finished:
+            return
+        # 缓冲区有内容时，等待新事件不超过合并窗口的剩余时间
+        timeout = coalescer.timeout()
+        if is_disconnected is not None:
+            until_check = max(0.0, next_check - time.monotonic())
+            timeout = until_check if timeout is None else min(timeout, until_check)
+        woke = await subscription.wait(timeout)
+        if is_disconnected is not None and time.monotonic() >= next_check:
+            if await is_disconnected():
+                subscription.disconnected = True
+                return
+            next_check = time.monotonic() + Config.DISCONNECT_CHECK_SECONDS
+        if not woke:
+            data = coalescer.flush()
+            if data:
+                started = time.monotonic()
+                yield data
+                subscription.blocked += time.monotonic() - started
+
+
+class ChatPlan(NamedTuple):
+    """发起上游请求之前确定的回答来源"""
+    previous_response_id: Optional[str]
+    # 回答缓存键，None 表示多轮对话（不缓存、不共享）
+    cache_key: Optional[str]
+    # 命中的缓存回答
+    cached: Optional[CachedResponse]
+    # 已加入的、相同问题正在进行的广播的订阅（加入时立即订阅，避免广播在开始读取前因没有订阅者被取消）
+    subscription: Optional[Subscription]
+
+
+async def plan_chat(question: str, session_id: str, model: str = "g4o") -> ChatPlan:
+    """
+    查找不需要新上游请求的回答：回答缓存（精确匹配与近似重复）以及相同问题正在进行的流
+
+    Args:
+        question: 用户问题
+        session_id: 会话 ID
+        model: 使用的模型
+
+    Returns:
+        ChatPlan: cached 与 subscription 都为 None 时需要发起上游请求；subscription 由调用方关闭
+    """
+    # 获取上一次的 response_id
+    previous_response_id = await session_store.get(session_id)
+    cache_key = None
+    cached = None
+    subscription = None
+    # 首轮提问先查回答缓存，命中时直接回放
+    if previous_response_id is None:
+        cache_key = make_cache_key(model, question, CHAT_TOOLS, CHAT_REASONING)
+        if response_cache is not None:
+            cached = await response_cache.get(cache_key)
+            if cached is None and near_duplicate_index is not None:
+                # 精确匹配未命中时，查找改写过的相同问题
+                match = near_duplicate_index.lookup(question, context_id(model, CHAT_TOOLS, CHAT_REASONING))
+                if match is not None:
+                    cached = await response_cache.get(match[0])
+        if cached is None:
+            # 相同问题正在进行时直接加入，不再发起新的上游请求
+            broadcast = broadcasts.join(cache_key)
+            if broadcast is not None:
+                subscription = broadcast.subscribe()
+    return ChatPlan(previous_response_id, cache_key, cached, subscription)
+
+
 async def generate_chat_stream(
-    client: OpenAI,
+    client: AsyncOpenAI,
     question: str,
     session_id: str,
-    model: str = "g4o"
-) -> AsyncGenerator[str, None]:
+    model: str = "g4o",
+    subscribed: Optional[frozenset[str]] = None,
+    lease: Optional[SessionLease] = None,
+    is_disconnected: Optional[Callable[[], Awaitable[bool]]] = None,
+    permit: Optional[AdmissionPermit] = None,
+    plan: Optional[ChatPlan] = None
+) -> AsyncGenerator[bytes, None]:
     """
     生成聊天流式响应
     
     Args:
-        client: OpenAI 客户端
+        client: 异步 OpenAI 客户端
         question: 用户问题
         session_id: 会话 ID
         model: 使用的模型
+        subscribed: 客户端订阅的前端帧类型，None 表示全部发送
+        lease: 会话锁，流结束时释放；被同一会话的新请求取消时提前结束
+        is_disconnected: 检查客户端是否已断开，断开后停止转发（没有其他订阅者时取消上游请求）
+        permit: 准入名额，发起上游请求时交给读取任务，命中缓存或加入已有的流时立即释放
+        plan: plan_chat 的结果，None 时在这里查找
         
     Yields:
-        str: 流式响应的文本片段
+        bytes: 一个或多个打包在一起的 SSE 帧
     """
-    # 获取上一次的 response_id
-    previous_response_id = session_store.get(session_id)
+    coalescer = FrameCoalescer(Config.STREAM_COALESCE_MS, Config.STREAM_COALESCE_BYTES)
+    subscription: Optional[Subscription] = None
+    timeline = None
+    client_id = 0
+    started = time.monotonic()
+    chat_metrics.active_streams.inc()
     
     try:
-        response = client.responses.create(
-            model=model,
-            tool_choice="auto",
-            tools=[{"type": "web_search_preview"}],
-            input=[
-                {"role": "user", "content": question}
-            ],
-            previous_response_id=previous_response_id,
-            stream=True,
-            reasoning={
-                "effort": "medium",
-                "summary": "auto",
-            },
-        )
-        
-        for event in response:
-            if event.type == "response.created":
-                # 保存新的 response_id
-                session_store[session_id] = event.response.id
-                yield f'data: {{"type": "created", "id": "{event.response.id}"}}\n\n'  
-            elif event.type == "response.in_progress":
-                yield f'data: {{"type": "in_progress"}}\n\n'     
-            elif event.type == "response.output_item.added":
-                yield f'data: {{"type": "output_item_added"}}\n\n'
-            elif event.type == "response.content_part.added":
-                yield f'data: {{"type": "content_part_added"}}\n\n'  
-            elif event.type == "response.output_text.delta":
-                # 发送文本增量，需要转义特殊字符
-                # import json
-                # text = json.dumps(event.delta)  # event.delta 是文本字符串
-                # yield f'data: {{"type": "delta", "text": {text}}}\n\n'
-                pass     
-            elif event.type == "response.output_text.done":
-                import json
-                text = json.dumps(event.text)  # event.text 是文本字符串
-                print(f"完成输出文本: {text}")
-                yield f'data: {{"type": "delta", "text": {text}}}\n\n' 
-                pass
-                # yield f'data: {{"type": "text_done"}}\n\n'   
-            elif event.type == "response.content_part.done":
-                yield f'data: {{"type": "content_part_done"}}\n\n'
-            elif event.type == "response.output_item.done":
-                yield f'data: {{"type": "output_item_done"}}\n\n'
-            elif event.type == "response.completed":
-                yield f'data: {{"type": "completed"}}\n\n'
-            elif event.type == "response.web_search_call.in_progress":
-                yield f'data: {{"type": "web_search_in_progress"}}\n\n'
-            elif event.type == "response.web_search_call.searching":
-                yield f'data: {{"type": "web_search_searching"}}\n\n'
-            elif event.type == "response.web_search_call.completed":
-                yield f'data: {{"type": "web_search_completed"}}\n\n'
-            elif event.type == "response.output_text.annotation.added":
-                yield f'data: {{"type": "annotation_added"}}\n\n'
-            elif event.type == "response.reasoning_summary_part.added":
-                yield f'data: {{"type": "reasoning_summary_part_added"}}\n\n'
-            elif event.type == "response.reasoning_summary_text.delta":
-                # import json
-                # text = json.dumps(event.delta)  # event.delta 是文本字符串
-                # yield f'data: {{"type": "delta", "text": {text}}}\n\n' 
-                pass
-            elif event.type == "response.reasoning_summary_text.done":
-                yield f'data: {{"type": "reasoning_summary_text_done"}}\n\n'
-            elif event.type == "response.reasoning_summary_part.done":
-                yield f'data: {{"type": "reasoning_summary_part_done"}}\n\n'
-                print(f"完成推理总结部分: {event}")
-            elif event.type == "response.incomplete":
-                yield f'data: {{"type": "incomplete"}}\n\n'
+        if plan is None:
+            plan = await plan_chat(question, session_id, model)
+        subscription = plan.subscription
+        cached = plan.cached
+        if cached is not None:
+            chat_metrics.requests.inc("cache")
+            if permit is not None:
+                permit.release()
+            await session_store.set(session_id, cached.response_id)
+            coalescer.append(cached.replay(subscribed))
+        else:
+            if subscription is None and plan.cache_key is not None:
+                # 等待准入期间相同问题可能已经开始
+                broadcast = broadcasts.join(plan.cache_key)
+                if broadcast is not None:
+                    subscription = broadcast.subscribe()
+            if subscription is None:
+                chat_metrics.requests.inc("upstream")
+                broadcast = broadcasts.start(plan.cache_key)
+                if traces is not None:
+                    broadcast.timeline = traces.start()
+                if permit is not None:
+                    permit.handed_off = True
+                broadcast.task = asyncio.create_task(
+                    pump_upstream(broadcast, client, question, model, plan.previous_response_id, permit)
+                )
+                subscription = broadcast.subscribe()
             else:
-                yield f'data: {{"type": "unknown", "event": "{str(event)}"}}\n\n'
-                print(f"未知事件类型: {event.type}")
-                print(event)
+                chat_metrics.requests.inc("joined")
+                if permit is not None:
+                    permit.release()
+                broadcast = subscription.broadcast
+            if lease is not None:
+                lease.on_cancel(subscription.wakeup.set)
+            timeline = broadcast.timeline
+            if timeline is not None:
+                client_id = timeline.new_client()
+            async for data in relay_subscription(
+                subscription, coalescer, subscribed, session_id, lease, is_disconnected
+            ):
+                if timeline is not None:
+                    timeline.frame(client_id, len(data))
+                yield data
                 
     except Exception as e:
-        import json
-        error_msg = json.dumps(str(e))
-        yield f'data: {{"type": "error", "message": {error_msg}}}\n\n'
+        chat_metrics.stream_errors.inc()
+        coalescer.append(encode_error(str(e)))
     finally:
-        yield "data: [DONE]\n\n"
+        if subscription is not None:
+            subscription.close()
+        if lease is not None:
+            lease.release()
+        if permit is not None and not permit.handed_off:
+            permit.release()
+        chat_metrics.active_streams.dec()
+        chat_metrics.stream_duration.observe(time.monotonic() - started)
+    if subscription is not None and subscription.disconnected:
+        return
+    data = (coalescer.flush() or b"") + DONE_FRAME
+    if timeline is not None:
+        timeline.frame(client_id, len(data))
+    yield data
 
 
-from pydantic import BaseModel
+async def resume_chat_stream(
+    broadcast: Broadcast,
+    last_event_id: int,
+    subscribed: Optional[frozenset[str]] = None,
+    is_disconnected: Optional[Callable[[], Awaitable[bool]]] = None
+) -> AsyncGenerator[bytes, None]:
+    """
+    从断点继续发送流式响应（不产生新的上游请求）
+    
+    Args:
+        broadcast: 要续传的广播
+        last_event_id: 客户端收到的最后一个事件序号
+        subscribed: 客户端订阅的前端帧类型，None 表示全部发送
+        is_disconnected: 检查客户端是否已断开
+        
+    Yields:
+        bytes: 一个或多个打包在一起的 SSE 帧
+    """
+    coalescer = FrameCoalescer(Config.STREAM_COALESCE_MS, Config.STREAM_COALESCE_BYTES)
+    subscription = broadcast.subscribe(last_event_id + 1)
+    timeline = broadcast.timeline
+    client_id = timeline.new_client() if timeline is not None else 0
+    started = time.monotonic()
+    chat_metrics.requests.inc("resume")
+    chat_metrics.active_streams.inc()
+    try:
+        async for data in relay_subscription(
+            subscription, coalescer, subscribed, is_disconnected=is_disconnected
+        ):
+            if timeline is not None:
+                timeline.frame(client_id, len(data))
+            yield data
+    except Exception as e:
+        chat_metrics.stream_errors.inc()
+        coalescer.append(encode_error(str(e)))
+    finally:
+        subscription.close()
+        chat_metrics.active_streams.dec()
+        chat_metrics.stream_duration.observe(time.monotonic() - started)
+    if subscription.disconnected:
+        return
+    data = (coalescer.flush() or b"") + DONE_FRAME
+    if timeline is not None:
+        timeline.frame(client_id, len(data))
+    yield data
+
+
+from pydantic import BaseModel, Field, model_validator
 
 class ChatRequest(BaseModel):
     question: str
     session_id: str = "default"
     model: str = "g4o"
+    # 事件详细程度：minimal 只发送回答相关事件，standard 增加推理和搜索进度，full 发送全部事件
+    verbosity: Literal["minimal", "standard", "full"] = "full"
+    # 显式订阅的事件类型（如 ["created", "delta", "completed"]），优先于 verbosity
+    events: Optional[list[str]] = None
+
+
+class BulkIngestRequest(BaseModel):
+    # INGEST_SOURCE_DIR 下的目录（递归包含其中所有文件）或 glob（支持 **），相对该目录
+    pattern: str
+    vector_store_id: Optional[str] = None
+    # 所有文件共用的 attributes（值为字符串、数字或布尔），如 {"category": "finance"}
+    attributes: dict[str, Union[str, float, bool]] = {}
+    # 相对路径 -> 该文件的 attributes，优先于公共 attributes
+    manifest: dict[str, dict[str, Union[str, float, bool]]] = {}
+    # 同时上传的文件数，默认 INGEST_CONCURRENCY
+    concurrency: Optional[int] = None
+
+
+class SearchRequest(BaseModel):
+    query: str
+    # local：本地检索库；remote：上游的 vector_stores.search
+    backend: Literal["local", "remote"] = "local"
+    vector_store_id: str = Config.LOCAL_SEARCH_STORE
+    # vector_stores.search 格式的过滤条件，如 {"type": "eq", "key": "category", "value": "finance"}
+    filters: Optional[dict[str, Any]] = None
+    max_num_results: int = Field(10, ge=1, le=50)
+
+
+class LocalIndexRequest(BaseModel):
+    # LOCAL_SEARCH_SOURCE_DIR 下的目录（递归包含其中所有文件）或 glob（支持 **），相对该目录；
+    # PDF 逐页解析，其余按 UTF-8 文本读取
+    pattern: str
+    vector_store_id: str = Config.LOCAL_SEARCH_STORE
+    attributes: dict[str, Union[str, float, bool]] = {}
+    manifest: dict[str, dict[str, Union[str, float, bool]]] = {}
+    # 每个分块的最大字符数与相邻分块重叠的字符数（overlap 必须小于 chunk_chars）
+    chunk_chars: int = Field(800, gt=0)
+    overlap: int = Field(200, ge=0)
+
+    @model_validator(mode="after")
+    def check_overlap(self) -> "LocalIndexRequest":
+        if self.overlap >= self.chunk_chars:
+            raise ValueError("overlap 必须小于 chunk_chars")
+        return self
+
+
+def release_request(
+    lease: SessionLease, permit: Optional[AdmissionPermit], subscription: Optional[Subscription] = None
+) -> None:
+    """请求结束时释放会话锁、没有交给上游读取任务的准入名额，以及加入已有广播时的订阅"""
+    lease.release()
+    if permit is not None and not permit.handed_off:
+        permit.release()
+    if subscription is not None:
+        subscription.close()
+
 
 @router.post("/chat")
 async def handle_chat_stream(
     request: ChatRequest,
-    client: OpenAI = Depends(get_client)
+    http_request: Request,
+    client: AsyncOpenAI = Depends(get_async_client)
 ) -> StreamingResponse:
     """
     处理聊天流式请求
     
     Args:
-        request: 聊天请求（包含 question, session_id, model）
-        client: OpenAI 客户端（依赖注入）
+        request: 聊天请求（包含 question, session_id, model, verbosity, events）
+        http_request: HTTP 请求，用于检测客户端断开
+        client: 异步 OpenAI 客户端（依赖注入）
         
     Returns:
         StreamingResponse: Server-Sent Events (SSE) 格式的流式响应
     """
+    try:
+        lease = await session_locks.acquire(request.session_id)
+    except SessionBusyError as e:
+        chat_metrics.rejected.inc("409")
+        raise HTTPException(status_code=409, detail=str(e))
+    try:
+        # 命中缓存或加入已有的流不占用准入名额，只有需要发起上游请求时才排队
+        plan = await plan_chat(request.question, request.session_id, request.model)
+        permit = None
+        if plan.cached is None and plan.subscription is None:
+            permit = await admission.acquire(request.model)
+    except AdmissionRejected as e:
+        chat_metrics.rejected.inc(str(e.status_code))
+        lease.release()
+        raise HTTPException(
+            status_code=e.status_code,
+            detail=str(e),
+            headers={"Retry-After": str(e.retry_after)},
+        )
+    except BaseException:
+        lease.release()
+        raise
     return StreamingResponse(
-        generate_chat_stream(client, request.question, request.session_id, request.model),
+        generate_chat_stream(
+            client,
+            request.question,
+            request.session_id,
+            request.model,
+            resolve_subscription(request.verbosity, request.events),
+            lease,
+            http_request.is_disconnected,
+            permit,
+            plan,
+        ),
         media_type="text/event-stream",
         headers={
             "Cache-Control": "no-cache",
             "Connection": "keep-alive",
-        }
+        },
+        # 生成器未被迭代时（客户端提前断开）也要释放会话锁、准入名额和订阅
+        background=BackgroundTask(release_request, lease, permit, plan.subscription),
+    )
+
+
+@router.get("/chat/{response_id}/resume")
+async def handle_chat_resume(
+    response_id: str,
+    http_request: Request,
+    last_event_id: Optional[int] = Header(None, alias="Last-Event-ID"),
+    last_event_id_query: Optional[int] = Query(None, alias="last_event_id", description="Last-Event-ID 的查询参数形式"),
+    verbosity: Literal["minimal", "standard", "full"] = Query("full"),
+    events: Optional[list[str]] = Query(None)
+) -> StreamingResponse:
+    """
+    断线续传
+    
+    Args:
+        response_id: created 事件中的响应 ID
+        http_request: HTTP 请求，用于检测客户端断开
+        last_event_id: 客户端收到的最后一个事件 id（Last-Event-ID 请求头）
+        last_event_id_query: 同 last_event_id，用于无法设置请求头的客户端
+        verbosity: 事件详细程度
+        events: 显式订阅的事件类型
+        
+    Returns:
+        StreamingResponse: 从断点之后继续的 SSE 流
+    """
+    broadcast = broadcasts.find_response(response_id)
+    if broadcast is None:
+        raise HTTPException(status_code=404, detail=f"响应 {response_id} 不存在或已过期")
+    if last_event_id is None:
+        last_event_id = last_event_id_query if last_event_id_query is not None else -1
+    if last_event_id + 1 < broadcast.base:
+        raise HTTPException(status_code=410, detail=f"事件 {last_event_id} 之后的内容已不在缓冲区中")
+    return StreamingResponse(
+        resume_chat_stream(
+            broadcast, last_event_id, resolve_subscription(verbosity, events), http_request.is_disconnected
+        ),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "Connection": "keep-alive",
+        },
     )
 
 
 @router.post("/upload")
 async def handle_file_upload(
     file_path: str = Query(..., description="要上传的文件路径"),
-    client: OpenAI = Depends(get_client)
+    vector_store_id: Optional[str] = Query(None, description="目标 vector store，默认使用 VECTOR_STORE_NAME"),
+    client: AsyncOpenAI = Depends(get_async_client)
 ) -> dict:
     """
-    上传文件到 vector store
+    上传服务器上的文件到 vector store（等待索引完成后返回）
     
     Args:
         file_path: 要上传的文件路径
-        client: OpenAI 客户端（依赖注入）
+        vector_store_id: 目标 vector store
+        client: 异步 OpenAI 客户端（依赖注入）
         
     Returns:
-        dict: 包含 vector_store_id 的响应
+        dict: 包含 vector_store_id、file_id 与去重结果的响应
     """
+    started = time.monotonic()
     try:
-        vector_store_id = file_upload(client, file_path)
+        result = await file_upload(client, file_path, vector_store_id=vector_store_id)
         return {
             "success": True,
-            "vector_store_id": vector_store_id
+            **result
         }
     except Exception as e:
+        chat_metrics.upload_errors.inc()
         return {
             "success": False,
             "error": str(e)
         }
+    finally:
+        chat_metrics.upload_duration.observe(time.monotonic() - started)
+
+
+@router.post("/upload/jobs", status_code=202)
+async def handle_upload_job(
+    http_request: Request,
+    vector_store_id: Optional[str] = Query(None, description="目标 vector store，默认使用 VECTOR_STORE_NAME")
+) -> dict:
+    """
+    上传文件（multipart/form-data，字段名 file），后台入库
+    
+    请求体按块写入临时文件，接收完成后立即返回任务 ID，
+    通过 GET /api/upload/jobs/{job_id} 查询入库进度。
+    
+    Args:
+        http_request: HTTP 请求（流式读取请求体）
+        vector_store_id: 目标 vector store
+        
+    Returns:
+        dict: 任务 ID 与状态
+    """
+    length = http_request.headers.get("content-length")
+    if length is not None and length.isdigit() and int(length) > Config.UPLOAD_MAX_BYTES + 64 * 1024:
+        raise HTTPException(status_code=413, detail=f"文件超过大小上限 {Config.UPLOAD_MAX_BYTES} 字节")
+    try:
+        received = await receive_upload(
+            http_request.headers.get("content-type", ""),
+            http_request.stream(),
+            directory=Config.UPLOAD_DIR or None,
+            max_bytes=Config.UPLOAD_MAX_BYTES,
+            chunk_bytes=Config.UPLOAD_CHUNK_BYTES,
+        )
+        job = ingest_queue.submit(received, vector_store_id=vector_store_id)
+    except UploadRejected as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    return job.to_dict()
+
+
+@router.post("/upload/bulk", status_code=202)
+async def handle_bulk_ingest(request: BulkIngestRequest) -> dict:
+    """
+    批量入库服务器上的目录或 glob 匹配的文件（后台执行）
+    
+    pattern 相对 INGEST_SOURCE_DIR，绝对路径、.. 以及经符号链接离开该目录的路径返回 400，未配置该目录时返回 403。
+    文件并发上传（已登记的内容不重复上传），按 file batch 加入 vector store，
+    通过 GET /api/upload/jobs/{job_id} 查询进度，完成后 result 中包含吞吐与失败的文件。
+    
+    Args:
+        request: 批量入库请求（包含 pattern, vector_store_id, attributes, manifest, concurrency）
+        
+    Returns:
+        dict: 任务 ID 与状态
+    """
+    if not Config.INGEST_SOURCE_DIR:
+        raise HTTPException(status_code=403, detail="未配置 INGEST_SOURCE_DIR，不能批量入库服务器上的文件")
+    try:
+        pattern = resolve_pattern(Config.INGEST_SOURCE_DIR, request.pattern)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    try:
+        job = ingest_queue.submit(
+            None, handler=ingest_bulk,
+            **{**request.model_dump(), "pattern": pattern, "root": Config.INGEST_SOURCE_DIR},
+        )
+    except UploadRejected as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    return job.to_dict()
+
+
+@router.get("/upload/stats")
+async def upload_stats() -> dict:
+    """
+    后台入库统计
+    
+    Returns:
+        dict: worker 数、排队 / 进行中的任务数、成功 / 失败次数与去重登记统计
+    """
+    return {**ingest_queue.stats(), "registry": file_registry.stats()}
+
+
+@router.get("/upload/jobs/{job_id}")
+async def get_upload_job(job_id: str) -> dict:
+    """
+    查询入库任务
+    
+    Args:
+        job_id: 上传时返回的任务 ID
+        
+    Returns:
+        dict: 任务状态（queued / running / succeeded / failed），成功时 result 包含 vector_store_id
+    """
+    job = ingest_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"任务 {job_id} 不存在或已过期")
+    return job.to_dict()
+
+
+@router.post("/search")
+async def handle_search(request: SearchRequest) -> dict:
+    """
+    检索本地检索库（BM25 + 向量混合检索，支持 attributes 过滤）或远端 vector store
+    
+    相同的检索（规范化后的查询、等价的过滤条件）在 SEARCH_CACHE_TTL_SECONDS 内命中检索结果缓存。
+    
+    Args:
+        request: 检索请求（包含 query, backend, vector_store_id, filters, max_num_results）
+        
+    Returns:
+        dict: 与 vector_stores.search 相同格式的结果页
+    """
+    search = search_local if request.backend == "local" else search_remote
+    try:
+        results = await search(request.vector_store_id, request.query, request.filters, request.max_num_results)
+    except StoreNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except APIStatusError as e:
+        raise HTTPException(status_code=502, detail=f"vector store 检索失败: {e}")
+    return {
+        "object": "vector_store.search_results.page",
+        "search_query": request.query,
+        "data": results,
+        "has_more": False,
+        "next_page": None,
+    }
+
+
+@router.post("/search/index", status_code=202)
+async def handle_local_index(request: LocalIndexRequest) -> dict:
+    """
+    增量写入本地检索库（后台执行）
+    
+    pattern 相对 LOCAL_SEARCH_SOURCE_DIR，绝对路径、.. 以及经符号链接离开该目录的路径返回 400，未配置该目录时返回 403。
+    文档逐页解析并切分为重叠的分块；源文件内容与 attributes 都没变的文件跳过，
+    变化的文件中内容未变的分块复用原来的向量。通过 GET /api/upload/jobs/{job_id} 查询进度。
+    
+    Args:
+        request: 写入请求（包含 pattern, vector_store_id, attributes, manifest, chunk_chars, overlap）
+        
+    Returns:
+        dict: 任务 ID 与状态
+    """
+    if not Config.LOCAL_SEARCH_SOURCE_DIR:
+        raise HTTPException(status_code=403, detail="未配置 LOCAL_SEARCH_SOURCE_DIR，不能写入服务器上的文件")
+    try:
+        pattern = resolve_pattern(Config.LOCAL_SEARCH_SOURCE_DIR, request.pattern)
+        local_search.store(request.vector_store_id)
+        job = ingest_queue.submit(
+            None, handler=index_local,
+            **{**request.model_dump(), "pattern": pattern, "root": Config.LOCAL_SEARCH_SOURCE_DIR},
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except UploadRejected as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    return job.to_dict()
+
+
+@router.get("/search/stats")
+async def search_stats() -> dict:
+    """
+    本地检索库统计
+    
+    Returns:
+        dict: 已打开的检索库 -> 分段数、分块数、文件数与检索次数
+    """
+    return local_search.stats()
+
+
+@router.get("/search/cache/stats")
+async def search_cache_stats() -> dict:
+    """
+    检索结果缓存统计
+    
+    Returns:
+        dict: 条目数、命中率、过期 / 淘汰 / 失效次数
+    """
+    if search_cache is None:
+        return {"enabled": False}
+    return {"enabled": True, **search_cache.stats()}
+
+
+@router.get("/session/stats")
+async def session_stats() -> dict:
+    """
+    会话存储统计
+    
+    Returns:
+        dict: 会话数量、命中、淘汰与过期统计
+    """
+    return await session_store.stats()
+
+
+@router.get("/cache/stats")
+async def cache_stats() -> dict:
+    """
+    回答缓存统计
+    
+    Returns:
+        dict: 条目数、内存 / 磁盘占用、命中率与淘汰统计
+    """
+    if response_cache is None:
+        return {"enabled": False}
+    stats = {"enabled": True, **response_cache.stats(), "single_flight": broadcasts.stats()}
+    if near_duplicate_index is not None:
+        stats["near_duplicate"] = near_duplicate_index.stats()
+    return stats
+
+
+@router.get("/admission/stats")
+async def admission_stats() -> dict:
+    """
+    准入控制统计
+    
+    Returns:
+        dict: 当前并发、排队长度、排队等待时间与拒绝次数
+    """
+    return admission.stats()
+
+
+@router.get("/upstream/stats")
+async def upstream_stats() -> dict:
+    """
+    上游节点统计
+    
+    Returns:
+        dict: 每个上游地址的首事件延迟 / 错误率 EWMA、进行中请求数与摘除状态
+    """
+    if upstream_router is None:
+        return {"routing": False, "endpoints": [{"base_url": Config.OPENAI_BASE_URLS[0]}]}
+    return {"routing": True, **upstream_router.stats()}
+
+
+@router.get("/hedge/stats")
+async def hedge_stats() -> dict:
+    """
+    首事件延迟与对冲请求统计
+    
+    Returns:
+        dict: 首事件延迟分位数、当前对冲延迟、对冲次数与对冲胜出次数
+    """
+    return hedger.stats()
+
+
+@router.get("/stream/stats")
+async def stream_stats() -> dict:
+    """
+    流式发送统计
+    
+    Returns:
+        dict: 当前发送队列深度、写出阻塞时间与慢消费者处理统计
+    """
+    return {"slow_consumer_policy": Config.STREAM_SLOW_CONSUMER_POLICY, **broadcasts.consumer_stats()}
+
+
+@router.get("/trace/{response_id}")
+async def get_trace(response_id: str) -> dict:
+    """
+    请求事件时间线
+    
+    Args:
+        response_id: created 事件中的响应 ID
+        
+    Returns:
+        dict: 每个上游事件到达与每次写出的时间（相对发起上游请求的毫秒数）及各阶段起止时间
+    """
+    timeline = traces.get(response_id) if traces is not None else None
+    if timeline is None:
+        raise HTTPException(status_code=404, detail=f"响应 {response_id} 的时间线不存在或已淘汰")
+    return timeline.to_dict()
 
 
 @router.delete("/session/{session_id}")
@@ -269,8 +1608,7 @@ async def clear_session(session_id: str) -> dict:
     Returns:
         dict: 操作结果
     """
-    if session_id in session_store:
-        del session_store[session_id]
+    if await session_store.delete(session_id):
         return {"success": True, "message": f"会话 {session_id} 已清除"}
     return {"success": False, "message": f"会话 {session_id} 不存在"}
 
@@ -286,6 +1624,12 @@ async def root():
     return RedirectResponse(url="/static/index.html")
 
 
+@app.get("/metrics")
+async def prometheus_metrics() -> PlainTextResponse:
+    """Prometheus 指标（text format 0.0.4）"""
+    return PlainTextResponse(chat_metrics.registry.render(), media_type="text/plain; version=0.0.4")
+
+
 # 挂载静态文件目录（必须在所有路由之后）
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
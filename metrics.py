@@ -0,0 +1,179 @@
+"""
+Prometheus 指标
+
+计数器、仪表和直方图都只在事件循环线程中更新，不加锁；
+直方图按固定桶边界用 bisect 定位，每次观测是 O(log 桶数) 的几次整数加法，
+对流式吞吐的影响可以忽略。
+"""
+from bisect import bisect_left
+from typing import Iterable, Optional
+
+# 延迟类直方图的默认桶边界（秒）
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+# 增量间隔直方图的桶边界（秒）
+GAP_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format(value: float) -> str:
+    if value == int(value):
+        return str(int(value))
+    return repr(value)
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, label: Optional[str] = None):
+        self.name = name
+        self.help = help
+        self.label = label
+
+    def _labels(self, value: Optional[str], extra: str = "") -> str:
+        parts = []
+        if self.label is not None:
+            parts.append(f'{self.label}="{_escape(value)}"')
+        if extra:
+            parts.append(extra)
+        return "{" + ",".join(parts) + "}" if parts else ""
+
+    def samples(self) -> Iterable[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    """单调递增的计数器，可以带一个标签"""
+
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, label: Optional[str] = None):
+        super().__init__(name, help, label)
+        self._values: dict[Optional[str], float] = {} if label is not None else {None: 0.0}
+
+    def inc(self, label_value: Optional[str] = None, amount: float = 1.0) -> None:
+        """增加计数"""
+        values = self._values
+        values[label_value] = values.get(label_value, 0.0) + amount
+
+    def samples(self) -> Iterable[str]:
+        for value, count in list(self._values.items()):
+            yield f"{self.name}{self._labels(value)} {_format(count)}"
+
+
+class Gauge(_Metric):
+    """可增可减的仪表"""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str):
+        super().__init__(name, help)
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.value += amount
+
+    def dec(self, amount: float = 1.0) -> None:
+        self.value -= amount
+
+    def samples(self) -> Iterable[str]:
+        yield f"{self.name} {_format(self.value)}"
+
+
+class Histogram(_Metric):
+    """固定桶边界的直方图"""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, buckets: tuple[float, ...] = LATENCY_BUCKETS):
+        super().__init__(name, help)
+        self.buckets = buckets
+        # 每个桶（含 +Inf）的非累计计数，渲染时再累加
+        self._counts = [0] * (len(buckets) + 1)
+        self._sum = 0.0
+
+    def observe(self, value: float) -> None:
+        """记录一个观测值"""
+        self._counts[bisect_left(self.buckets, value)] += 1
+        self._sum += value
+
+    def samples(self) -> Iterable[str]:
+        counts = list(self._counts)
+        total = 0
+        for bound, count in zip(self.buckets, counts):
+            total += count
+            yield f'{self.name}_bucket{{le="{_format(bound)}"}} {total}'
+        total += counts[-1]
+        yield f'{self.name}_bucket{{le="+Inf"}} {total}'
+        yield f"{self.name}_sum {_format(self._sum)}"
+        yield f"{self.name}_count {total}"
+
+
+class MetricsRegistry:
+    """指标登记与 Prometheus 文本格式输出"""
+
+    def __init__(self):
+        self._metrics: list[_Metric] = []
+
+    def counter(self, name: str, help: str, label: Optional[str] = None) -> Counter:
+        return self._register(Counter(name, help, label))
+
+    def gauge(self, name: str, help: str) -> Gauge:
+        return self._register(Gauge(name, help))
+
+    def histogram(self, name: str, help: str, buckets: tuple[float, ...] = LATENCY_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, help, buckets))
+
+    def _register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        """输出全部指标（Prometheus text format 0.0.4）"""
+        return "\n".join(metric.render() for metric in self._metrics) + "\n"
+
+
+class ChatMetrics:
+    """对话服务的全部指标"""
+
+    def __init__(self):
+        registry = self.registry = MetricsRegistry()
+        self.first_event = registry.histogram(
+            "chat_upstream_first_event_seconds", "发起上游请求到收到首个事件的时间")
+        self.first_text = registry.histogram(
+            "chat_upstream_first_text_seconds", "发起上游请求到收到首个文本增量的时间")
+        self.delta_gap = registry.histogram(
+            "chat_upstream_delta_gap_seconds", "相邻两个上游增量事件的间隔", GAP_BUCKETS)
+        self.upstream_duration = registry.histogram(
+            "chat_upstream_duration_seconds", "上游流的总时长")
+        self.upstream_events = registry.counter(
+            "chat_upstream_events_total", "按类型统计的上游事件数", "type")
+        self.upstream_errors = registry.counter(
+            "chat_upstream_errors_total", "上游流出错或被取消的次数", "reason")
+        self.active_upstreams = registry.gauge(
+            "chat_active_upstreams", "进行中的上游流")
+        self.stream_duration = registry.histogram(
+            "chat_stream_duration_seconds", "客户端 SSE 流的总时长")
+        self.active_streams = registry.gauge(
+            "chat_active_streams", "进行中的客户端 SSE 流")
+        self.requests = registry.counter(
+            "chat_requests_total", "按回答来源统计的对话请求数（cache / joined / upstream / resume）", "source")
+        self.rejected = registry.counter(
+            "chat_rejected_total", "按状态码统计的被拒绝请求数", "status")
+        self.stream_errors = registry.counter(
+            "chat_stream_errors_total", "客户端流因异常或读取过慢而出错的次数")
+        self.upload_duration = registry.histogram(
+            "upload_duration_seconds", "文件上传到 vector store 的耗时")
+        self.upload_errors = registry.counter(
+            "upload_errors_total", "文件上传失败次数")
+        self.local_search_duration = registry.histogram(
+            "local_search_duration_seconds", "本地检索的耗时", GAP_BUCKETS)
+        self.search_cache_requests = registry.counter(
+            "search_cache_requests_total", "按结果统计的检索结果缓存查询次数（hit / miss）", "result")
@@ -0,0 +1,317 @@
+"""
+近似重复问题检测
+
+对问题做字符 n-gram 切片，计算 MinHash 签名，并用 LSH 分桶索引，
+在本地（无网络调用）找到与新问题 Jaccard 相似度超过阈值的已缓存问题。
+
+所有数据保存在 NumPy 数组中：
+- 已合并的条目按每个 band 的桶键排序，查询用 searchsorted，O(bands * log N)
+- 新写入的条目先进入缓冲区线性扫描，缓冲区满后批量归并进排序索引（在线程中计算，不阻塞事件循环）
+
+归一化只合并空白、大小写和末尾的标点，数字与运算符保留；
+数字、运算符与否定词必须完全一致（“3+2”与“3-2”、加上“不”的问题不会命中对方的回答）。
+"""
+import asyncio
+import hashlib
+import re
+import unicodedata
+from typing import Any, Callable, Optional
+
+import numpy as np
+import orjson
+
+# 问题末尾去掉的标点与空白（句中的标点、运算符和数字保留）
+_TRAILING_PUNCTUATION = re.compile(r"[\s.,;:!?…~。，；：！？、～]+$")
+# 必须完全一致才能复用回答的词：数字、运算符与否定词（“3+2”与“3-2”、加上“不”的问题不是同一个问题）
+_GUARD_PATTERN = re.compile(
+    r"\d+(?:\.\d+)?|[+\-*/×÷=<>%^]|n't\b|\b(?:not|no|never|none|nothing|neither|nor|without|cannot)\b|[不没无非未别勿否]"
+)
+_PRIME = np.uint64(0x100000001B3)
+
+
+def mix64(x: np.ndarray) -> np.ndarray:
+    """splitmix64 终结函数（向量化，uint64 溢出回绕），把哈希值打散为均匀分布的 64 位整数"""
+    x = x ^ (x >> np.uint64(30))
+    x = x * np.uint64(0xBF58476D1CE4E5B9)
+    x = x ^ (x >> np.uint64(27))
+    x = x * np.uint64(0x94D049BB133111EB)
+    return x ^ (x >> np.uint64(31))
+
+
+def normalize_question(text: str) -> str:
+    """问题归一化：NFKC（全角转半角）、忽略大小写、合并空白、去掉末尾的标点"""
+    text = " ".join(unicodedata.normalize("NFKC", text).casefold().split())
+    return _TRAILING_PUNCTUATION.sub("", text)
+
+
+def guard_id(text: str) -> int:
+    """问题中数字、运算符与否定词（按出现顺序）的 64 位哈希，只有该值相同的问题才会匹配"""
+    tokens = _GUARD_PATTERN.findall(normalize_question(text))
+    digest = hashlib.blake2b("\x00".join(tokens).encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "little")
+
+
+def shingle_hashes(text: str, size: int = 3) -> np.ndarray:
+    """
+    计算问题的字符 n-gram 哈希集合
+
+    Args:
+        text: 问题文本
+        size: n-gram 长度，问题短于该长度时整体作为一个切片
+
+    Returns:
+        np.ndarray: 去重后的 uint64 哈希
+    """
+    normalized = normalize_question(text)
+    codes = np.frombuffer(normalized.encode("utf-32-le"), dtype=np.uint32).astype(np.uint64)
+    if len(codes) == 0:
+        return np.zeros(1, dtype=np.uint64)
+    size = min(size, len(codes))
+    count = len(codes) - size + 1
+    hashes = np.zeros(count, dtype=np.uint64)
+    for i in range(size):
+        hashes = hashes * _PRIME + codes[i:i + count]
+    return np.unique(mix64(hashes))
+
+
+def context_id(*parts: Any) -> int:
+    """将 model / tools / reasoning 等参数压缩为一个 64 位上下文 ID，只有上下文相同的问题才会匹配"""
+    digest = hashlib.blake2b(orjson.dumps(parts, option=orjson.OPT_SORT_KEYS), digest_size=8).digest()
+    return int.from_bytes(digest, "little")
+
+
+class NearDuplicateIndex:
+    """
+    MinHash + LSH 近似重复索引
+
+    每个条目保存 MinHash 签名、上下文 ID（并入了数字、运算符与否定词）和对应的回答缓存键；
+    达到 max_entries 时丢弃最早的 1/4 条目并重建索引。
+    """
+
+    def __init__(
+        self,
+        threshold: float = 0.8,
+        num_perm: int = 32,
+        bands: int = 8,
+        shingle_size: int = 3,
+        max_entries: int = 1_000_000,
+        buffer_size: int = 4096,
+        seed: int = 7,
+    ):
+        """
+        Args:
+            threshold: 判定为近似重复的最低 Jaccard 相似度估计值
+            num_perm: MinHash 签名长度
+            bands: LSH band 数量，num_perm 必须能被整除
+            shingle_size: 字符 n-gram 长度
+            max_entries: 最多保存的条目数
+            buffer_size: 未排序缓冲区大小，满后归并进排序索引
+            seed: 哈希函数的随机种子
+        """
+        if num_perm % bands:
+            raise ValueError("num_perm 必须能被 bands 整除")
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.shingle_size = shingle_size
+        self.max_entries = max_entries
+        self.buffer_size = buffer_size
+
+        rng = np.random.default_rng(seed)
+        # 乘法-移位哈希族：h(x) = (a * x + b) >> 32，a 为奇数
+        self._a = rng.integers(1, 2**63, num_perm, dtype=np.uint64) | np.uint64(1)
+        self._b = rng.integers(0, 2**63, num_perm, dtype=np.uint64)
+        self._row_mult = rng.integers(1, 2**63, self.rows, dtype=np.uint64) | np.uint64(1)
+
+        self._count = 0
+        self._indexed = 0
+        self._allocate(min(1024, max_entries))
+        self._sorted_keys = [np.empty(0, dtype=np.uint64) for _ in range(bands)]
+        self._sorted_ids = [np.empty(0, dtype=np.int32) for _ in range(bands)]
+
+        self.lookups = 0
+        self.hits = 0
+        # 条目数已达上限、淘汰尚未完成时没有写入的问题数
+        self.skipped = 0
+        self._rebuild_task: Optional[asyncio.Task] = None
+
+    def _allocate(self, capacity: int) -> None:
+        def grow(old: Optional[np.ndarray], shape: tuple, dtype: Any) -> np.ndarray:
+            new = np.zeros((capacity, *shape), dtype=dtype)
+            if old is not None:
+                new[:self._count] = old[:self._count]
+            return new
+
+        self._capacity = capacity
+        self._signatures = grow(getattr(self, "_signatures", None), (self.num_perm,), np.uint32)
+        self._band_keys = grow(getattr(self, "_band_keys", None), (self.bands,), np.uint64)
+        self._contexts = grow(getattr(self, "_contexts", None), (), np.uint64)
+        self._cache_keys = grow(getattr(self, "_cache_keys", None), (32,), np.uint8)
+
+    def signature(self, text: str) -> np.ndarray:
+        """计算问题的 MinHash 签名"""
+        hashes = shingle_hashes(text, self.shingle_size)
+        return ((hashes[:, None] * self._a + self._b) >> np.uint64(32)).min(axis=0).astype(np.uint32)
+
+    def _guarded_context(self, question: str, context: int) -> int:
+        # 数字、运算符与否定词并入上下文：不一致的问题既不在同一个桶中，也不会通过上下文检查
+        return context ^ guard_id(question)
+
+    def _band_keys_of(self, signature: np.ndarray, context: int) -> np.ndarray:
+        rows = signature.reshape(self.bands, self.rows).astype(np.uint64)
+        return mix64((rows * self._row_mult).sum(axis=1) ^ np.uint64(context))
+
+    def add(self, question: str, context: int, cache_key: str) -> None:
+        """
+        写入一个已缓存的问题
+
+        缓冲区满后的归并与达到上限后的淘汰：在事件循环中调用时放到线程中计算，完成后再替换索引
+        （期间的查询使用旧索引与缓冲区，不阻塞其他流）；没有运行中的事件循环时直接执行。
+        条目数已达上限、淘汰尚未完成时，新问题不写入。
+
+        Args:
+            question: 问题文本
+            context: context_id 生成的上下文 ID
+            cache_key: 回答缓存键（sha256 十六进制）
+        """
+        if self._count >= self.max_entries:
+            self._start_rebuild(lambda: self._prepare_drop(self.max_entries // 4))
+        if self._count >= self._capacity and self._capacity < self.max_entries:
+            self._allocate(min(self._capacity * 2, self.max_entries))
+        if self._count >= self._capacity:
+            self.skipped += 1
+            return
+        signature = self.signature(question)
+        context = self._guarded_context(question, context)
+        i = self._count
+        self._signatures[i] = signature
+        self._band_keys[i] = self._band_keys_of(signature, context)
+        self._contexts[i] = context
+        self._cache_keys[i] = np.frombuffer(bytes.fromhex(cache_key), dtype=np.uint8)
+        self._count += 1
+        if self._count - self._indexed >= self.buffer_size:
+            self._start_rebuild(self._prepare_merge)
+
+    def lookup(self, question: str, context: int) -> Optional[tuple[str, float]]:
+        """
+        查找近似重复的问题
+
+        Args:
+            question: 问题文本
+            context: context_id 生成的上下文 ID
+
+        Returns:
+            Optional[tuple[str, float]]: (回答缓存键, 估计相似度)，没有超过阈值的条目时返回 None
+        """
+        self.lookups += 1
+        signature = self.signature(question)
+        context = self._guarded_context(question, context)
+        band_keys = self._band_keys_of(signature, context)
+
+        candidates = []
+        for band in range(self.bands):
+            keys = self._sorted_keys[band]
+            lo = np.searchsorted(keys, band_keys[band], side="left")
+            hi = np.searchsorted(keys, band_keys[band], side="right")
+            if hi > lo:
+                candidates.append(self._sorted_ids[band][lo:hi])
+        if self._count > self._indexed:
+            buffered = self._band_keys[self._indexed:self._count]
+            matched = np.nonzero((buffered == band_keys).any(axis=1))[0]
+            if len(matched):
+                candidates.append((matched + self._indexed).astype(np.int32))
+        if not candidates:
+            return None
+
+        ids = np.unique(np.concatenate(candidates))
+        ids = ids[self._contexts[ids] == np.uint64(context)]
+        if len(ids) == 0:
+            return None
+        similarities = (self._signatures[ids] == signature).mean(axis=1)
+        best = int(np.argmax(similarities))
+        if similarities[best] < self.threshold:
+            return None
+        self.hits += 1
+        return self._cache_keys[ids[best]].tobytes().hex(), float(similarities[best])
+
+    def _start_rebuild(self, prepare: Callable[[], tuple[Callable[[], Any], Callable[[Any], None]]]) -> None:
+        """
+        执行归并或淘汰：prepare 返回 (只读取快照、可以在线程中执行的计算, 替换索引的函数)
+
+        在事件循环中调用时计算放到线程中，完成后在事件循环中替换；同一时间只进行一个。
+        计算期间新写入的条目追加在快照之后（淘汰只在写满时进行，期间不会写入新条目）。
+        """
+        if self._rebuild_task is not None and not self._rebuild_task.done():
+            return
+        compute, apply = prepare()
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            apply(compute())
+            return
+
+        async def rebuild() -> None:
+            apply(await asyncio.to_thread(compute))
+
+        self._rebuild_task = asyncio.create_task(rebuild())
+
+    def _sorted_bands(self, band_keys: np.ndarray, ids: np.ndarray) -> tuple[list[np.ndarray], list[np.ndarray]]:
+        keys_out, ids_out = [], []
+        for band in range(self.bands):
+            order = np.argsort(band_keys[:, band], kind="stable")
+            keys_out.append(band_keys[order, band])
+            ids_out.append(ids[order])
+        return keys_out, ids_out
+
+    def _prepare_merge(self) -> tuple[Callable[[], Any], Callable[[Any], None]]:
+        end = self._count
+        new_keys, new_ids = self._sorted_bands(
+            self._band_keys[self._indexed:end].copy(), np.arange(self._indexed, end, dtype=np.int32)
+        )
+        sorted_keys, sorted_ids = self._sorted_keys, self._sorted_ids
+
+        def compute() -> tuple[list[np.ndarray], list[np.ndarray]]:
+            keys_out, ids_out = [], []
+            for band in range(self.bands):
+                positions = np.searchsorted(sorted_keys[band], new_keys[band])
+                keys_out.append(np.insert(sorted_keys[band], positions, new_keys[band]))
+                ids_out.append(np.insert(sorted_ids[band], positions, new_ids[band]))
+            return keys_out, ids_out
+
+        def apply(result: tuple[list[np.ndarray], list[np.ndarray]]) -> None:
+            self._sorted_keys, self._sorted_ids = result
+            self._indexed = end
+
+        return compute, apply
+
+    def _prepare_drop(self, count: int) -> tuple[Callable[[], Any], Callable[[Any], None]]:
+        keep = self._count - count
+        arrays = (self._signatures, self._band_keys, self._contexts, self._cache_keys)
+
+        def compute() -> tuple[list[np.ndarray], list[np.ndarray], list[np.ndarray]]:
+            kept = []
+            for array in arrays:
+                new = np.zeros_like(array)
+                new[:keep] = array[count:count + keep]
+                kept.append(new)
+            # 条目编号整体前移，重建排序索引
+            return (kept, *self._sorted_bands(kept[1][:keep], np.arange(keep, dtype=np.int32)))
+
+        def apply(result: tuple[list[np.ndarray], list[np.ndarray], list[np.ndarray]]) -> None:
+            kept, self._sorted_keys, self._sorted_ids = result
+            self._signatures, self._band_keys, self._contexts, self._cache_keys = kept
+            self._count = self._indexed = keep
+
+        return compute, apply
+
+    def stats(self) -> dict[str, Any]:
+        """条目数与命中统计"""
+        return {
+            "entries": self._count,
+            "max_entries": self.max_entries,
+            "threshold": self.threshold,
+            "lookups": self.lookups,
+            "hits": self.hits,
+            "skipped": self.skipped,
+        }
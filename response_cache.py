@@ -0,0 +1,249 @@
+"""
+回答缓存
+
+对没有 previous_response_id 的首轮提问，按 (model, question, tools, reasoning)
+精确匹配缓存 generate_chat_stream 发出的 SSE 帧序列，命中时直接回放。
+内存按 LRU 淘汰，超出内存预算的条目可以溢出到磁盘目录。
+"""
+import asyncio
+import hashlib
+import os
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Optional
+
+import orjson
+
+from sse import encode_frame
+
+
+@dataclass
+class CachedResponse:
+    """一次完整回答的帧序列"""
+
+    response_id: str
+    # (前端帧类型, 帧)，同类 delta 已合并为一帧
+    frames: list[tuple[str, bytes]]
+    expires_at: float
+    # 估算的内存占用（字节）
+    size: int = field(init=False)
+
+    def __post_init__(self):
+        self.size = sum(len(frame) + len(name) for name, frame in self.frames) + 64
+
+    def replay(self, subscribed: Optional[frozenset[str]] = None) -> bytes:
+        """
+        按订阅过滤后打包为一次写出
+
+        Args:
+            subscribed: 客户端订阅的前端帧类型，None 表示全部发送
+        """
+        if subscribed is None:
+            return b"".join(frame for _, frame in self.frames)
+        return b"".join(frame for name, frame in self.frames if name in subscribed)
+
+    def dumps(self) -> bytes:
+        return orjson.dumps({
+            "response_id": self.response_id,
+            "expires_at": self.expires_at,
+            "frames": [[name, frame.decode()] for name, frame in self.frames],
+        })
+
+    @classmethod
+    def loads(cls, data: bytes) -> "CachedResponse":
+        obj = orjson.loads(data)
+        return cls(
+            response_id=obj["response_id"],
+            frames=[(name, frame.encode()) for name, frame in obj["frames"]],
+            expires_at=obj["expires_at"],
+        )
+
+
+class ResponseRecorder:
+    """记录一次回答发出的全部帧（不受客户端订阅影响）"""
+
+    def __init__(self):
+        self._frames: list[tuple[str, Any]] = []
+
+    def record(self, name: str, frame: bytes) -> None:
+        """记录一个已编码的帧"""
+        self._frames.append((name, frame))
+
+    def record_delta(self, name: str, text: str) -> None:
+        """记录一个增量，连续的同类增量合并"""
+        if self._frames and self._frames[-1][0] == name and isinstance(self._frames[-1][1], list):
+            self._frames[-1][1].append(text)
+        else:
+            self._frames.append((name, [text]))
+
+    def finish(self, response_id: str, ttl: float) -> CachedResponse:
+        """生成可缓存的回答"""
+        frames = [
+            (name, encode_frame({"type": name, "text": "".join(value)}) if isinstance(value, list) else value)
+            for name, value in self._frames
+        ]
+        return CachedResponse(response_id=response_id, frames=frames, expires_at=time.time() + ttl)
+
+
+def make_cache_key(model: str, question: str, tools: Any, reasoning: Any) -> str:
+    """根据请求参数生成缓存键"""
+    payload = orjson.dumps(
+        {"model": model, "question": question.strip(), "tools": tools, "reasoning": reasoning},
+        option=orjson.OPT_SORT_KEYS,
+    )
+    return hashlib.sha256(payload).hexdigest()
+
+
+class ResponseCache:
+    """
+    带 TTL 和内存预算的 LRU 回答缓存
+
+    spill_dir 非空时，因内存预算被淘汰的条目写入磁盘，
+    磁盘占用同样按 LRU 控制在 spill_max_bytes 以内。
+    """
+
+    def __init__(
+        self,
+        max_bytes: int,
+        ttl: float,
+        spill_dir: Optional[str] = None,
+        spill_max_bytes: int = 0,
+    ):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.spill_dir = spill_dir
+        self.spill_max_bytes = spill_max_bytes
+        self._memory: OrderedDict[str, CachedResponse] = OrderedDict()
+        self._memory_bytes = 0
+        # 缓存键 -> 磁盘文件大小
+        self._spilled: OrderedDict[str, int] = OrderedDict()
+        self._spilled_bytes = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        if spill_dir:
+            os.makedirs(spill_dir, exist_ok=True)
+
+    async def get(self, key: str) -> Optional[CachedResponse]:
+        """
+        查询缓存
+
+        Args:
+            key: make_cache_key 生成的缓存键
+
+        Returns:
+            Optional[CachedResponse]: 命中且未过期的回答
+        """
+        entry = self._memory.get(key)
+        if entry is None and key in self._spilled:
+            self._spilled_bytes -= self._spilled.pop(key)
+            entry = await asyncio.to_thread(self._read_file, key)
+            if entry is not None:
+                self.disk_hits += 1
+                evicted = self._store(key, entry)
+                if evicted:
+                    await self._spill(evicted)
+        if entry is None:
+            self.misses += 1
+            return None
+        if entry.expires_at <= time.time():
+            self._discard(key)
+            self.expirations += 1
+            self.misses += 1
+            return None
+        self._memory.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    async def put(self, key: str, entry: CachedResponse) -> None:
+        """写入缓存，超出内存预算时淘汰最久未使用的条目"""
+        if entry.size > self.max_bytes:
+            return
+        self._discard(key)
+        evicted = self._store(key, entry)
+        if evicted and self.spill_dir:
+            await self._spill(evicted)
+
+    def _store(self, key: str, entry: CachedResponse) -> list[tuple[str, CachedResponse]]:
+        self._memory[key] = entry
+        self._memory_bytes += entry.size
+        evicted = []
+        while self._memory_bytes > self.max_bytes:
+            old_key, old = self._memory.popitem(last=False)
+            self._memory_bytes -= old.size
+            self.evictions += 1
+            if old.expires_at > time.time():
+                evicted.append((old_key, old))
+        return evicted
+
+    def _discard(self, key: str) -> None:
+        entry = self._memory.pop(key, None)
+        if entry is not None:
+            self._memory_bytes -= entry.size
+        size = self._spilled.pop(key, None)
+        if size is not None:
+            self._spilled_bytes -= size
+            self._remove_file(key)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.spill_dir, f"{key}.json")
+
+    def _remove_file(self, key: str) -> None:
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    async def _spill(self, entries: list[tuple[str, CachedResponse]]) -> None:
+        # 文件读写在线程池中执行，索引只在事件循环中修改
+        files = [(key, entry.dumps()) for key, entry in entries]
+        await asyncio.to_thread(self._write_files, files)
+        for key, data in files:
+            self._spilled[key] = len(data)
+            self._spilled_bytes += len(data)
+        removed = []
+        while self._spilled_bytes > self.spill_max_bytes and self._spilled:
+            old_key, size = self._spilled.popitem(last=False)
+            self._spilled_bytes -= size
+            removed.append(old_key)
+        if removed:
+            await asyncio.to_thread(self._remove_files, removed)
+
+    def _write_files(self, files: list[tuple[str, bytes]]) -> None:
+        for key, data in files:
+            with open(self._path(key), "wb") as f:
+                f.write(data)
+
+    def _remove_files(self, keys: list[str]) -> None:
+        for key in keys:
+            self._remove_file(key)
+
+    def _read_file(self, key: str) -> Optional[CachedResponse]:
+        try:
+            with open(self._path(key), "rb") as f:
+                entry = CachedResponse.loads(f.read())
+        except (OSError, orjson.JSONDecodeError):
+            return None
+        self._remove_file(key)
+        return entry
+
+    def stats(self) -> dict[str, Any]:
+        """命中率与容量统计"""
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._memory),
+            "memory_bytes": self._memory_bytes,
+            "max_bytes": self.max_bytes,
+            "spilled_entries": len(self._spilled),
+            "spilled_bytes": self._spilled_bytes,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
@@ -0,0 +1,210 @@
+"""
+多个上游地址之间的延迟感知路由
+
+按真实 /api/chat 流量统计每个上游地址的首事件延迟与错误率（EWMA），
+新请求用 power-of-two-choices 在健康节点中选择负载较低的一个；
+连续失败或错误率过高的节点暂时摘除，到期后重新参与路由。
+previous_response_id 只存在于创建它的节点上，多轮对话固定发往该节点。
+"""
+import random
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Iterable, Optional
+
+from openai import AsyncOpenAI
+
+
+class Endpoint:
+    """一个上游地址及其统计"""
+
+    def __init__(self, base_url: str, client: AsyncOpenAI):
+        self.base_url = base_url
+        self.client = client
+        # 首事件延迟与错误率的 EWMA（没有样本时延迟为 None）
+        self.latency: Optional[float] = None
+        self.error_rate = 0.0
+        self.inflight = 0
+        # 连续失败次数
+        self.failures = 0
+        self.ejected_until = 0.0
+        self.requests = 0
+        self.errors = 0
+        self.ejections = 0
+
+    def healthy(self, now: float) -> bool:
+        """是否参与路由"""
+        return now >= self.ejected_until
+
+    def score(self) -> float:
+        """负载分数，越小越优先（没有延迟样本的节点优先被尝试）"""
+        latency = self.latency or 0.0
+        return latency * (1.0 + 4.0 * self.error_rate) * (self.inflight + 1)
+
+
+class RoutedStream:
+    """绑定了上游节点的流，关闭时结束该节点的进行中计数"""
+
+    def __init__(self, router: "EndpointRouter", endpoint: Endpoint, stream: Any):
+        self.endpoint = endpoint
+        self.stream = stream
+        self._router = router
+        self._closed = False
+
+    def __aiter__(self):
+        return self.stream.__aiter__()
+
+    async def close(self) -> None:
+        if not self._closed:
+            self._closed = True
+            self._router._end(self.endpoint)
+            await self.stream.close()
+
+
+class EndpointRouter:
+    """上游地址的选择、统计与摘除"""
+
+    def __init__(
+        self,
+        endpoints: list[Endpoint],
+        alpha: float = 0.2,
+        eject_failures: int = 5,
+        eject_error_rate: float = 0.5,
+        eject_seconds: float = 30.0,
+        max_affinity: int = 100_000,
+    ):
+        """
+        Args:
+            endpoints: 上游节点
+            alpha: EWMA 平滑系数
+            eject_failures: 连续失败多少次后摘除
+            eject_error_rate: 错误率 EWMA 超过该值时摘除
+            eject_seconds: 摘除时长（秒）
+            max_affinity: 最多记录的 response_id -> 节点映射数
+        """
+        if not endpoints:
+            raise ValueError("至少需要一个上游地址")
+        self.endpoints = endpoints
+        self.alpha = alpha
+        self.eject_failures = eject_failures
+        self.eject_error_rate = eject_error_rate
+        self.eject_seconds = eject_seconds
+        self.max_affinity = max_affinity
+        self._affinity: OrderedDict[str, Endpoint] = OrderedDict()
+        self.sticky = 0
+
+    def choose(self, previous_response_id: Optional[str] = None, exclude: Iterable[Endpoint] = ()) -> Endpoint:
+        """
+        选择上游节点
+
+        Args:
+            previous_response_id: 上一次的 response_id，已知其所在节点时固定发往该节点
+            exclude: 尽量避开的节点（如对冲请求避开首个请求所在的节点）
+
+        Returns:
+            Endpoint: 选中的节点
+        """
+        if previous_response_id is not None:
+            endpoint = self._affinity.get(previous_response_id)
+            if endpoint is not None:
+                self._affinity.move_to_end(previous_response_id)
+                self.sticky += 1
+                return endpoint
+        now = time.monotonic()
+        excluded = set(exclude)
+        candidates = [e for e in self.endpoints if e.healthy(now) and e not in excluded]
+        if not candidates:
+            candidates = [e for e in self.endpoints if e.healthy(now)]
+        if not candidates:
+            # 全部被摘除时选最早恢复的节点
+            return min(self.endpoints, key=lambda e: e.ejected_until)
+        if len(candidates) == 1:
+            return candidates[0]
+        a, b = random.sample(candidates, 2)
+        return a if a.score() <= b.score() else b
+
+    def bind(self, response_id: str, endpoint: Endpoint) -> None:
+        """记录 response_id 所在的节点，后续轮次固定发往该节点"""
+        self._affinity[response_id] = endpoint
+        self._affinity.move_to_end(response_id)
+        while len(self._affinity) > self.max_affinity:
+            self._affinity.popitem(last=False)
+
+    async def open(
+        self,
+        create: Callable[[AsyncOpenAI], Awaitable[tuple[Any, Any]]],
+        previous_response_id: Optional[str] = None,
+        exclude: Optional[set[Endpoint]] = None,
+    ) -> tuple[RoutedStream, Any]:
+        """
+        选择节点并打开上游流，记录首事件延迟或失败
+
+        Args:
+            create: 用给定客户端发起请求并读到首个事件，返回 (流, 首个事件)
+            previous_response_id: 上一次的 response_id
+            exclude: 本次请求已使用的节点，选中的节点会加入其中
+
+        Returns:
+            tuple[RoutedStream, Any]: (绑定节点的流, 首个事件)
+        """
+        endpoint = self.choose(previous_response_id, exclude or ())
+        if exclude is not None:
+            exclude.add(endpoint)
+        endpoint.inflight += 1
+        endpoint.requests += 1
+        started = time.monotonic()
+        try:
+            stream, first = await create(endpoint.client)
+        except Exception:
+            self._end(endpoint)
+            self.record_failure(endpoint)
+            raise
+        except BaseException:
+            self._end(endpoint)
+            raise
+        self._record_latency(endpoint, time.monotonic() - started)
+        return RoutedStream(self, endpoint, stream), first
+
+    def _end(self, endpoint: Endpoint) -> None:
+        endpoint.inflight -= 1
+
+    def _record_latency(self, endpoint: Endpoint, latency: float) -> None:
+        if endpoint.latency is None:
+            endpoint.latency = latency
+        else:
+            endpoint.latency += self.alpha * (latency - endpoint.latency)
+        endpoint.error_rate *= 1 - self.alpha
+        endpoint.failures = 0
+
+    def record_failure(self, endpoint: Endpoint) -> None:
+        """记录一次失败（请求出错或流中途出错），达到阈值时摘除节点"""
+        endpoint.errors += 1
+        endpoint.failures += 1
+        endpoint.error_rate += self.alpha * (1 - endpoint.error_rate)
+        if endpoint.failures >= self.eject_failures or endpoint.error_rate >= self.eject_error_rate:
+            endpoint.ejected_until = time.monotonic() + self.eject_seconds
+            endpoint.ejections += 1
+            # 恢复后重新开始计数，错误率减半以免一次失败就再次摘除
+            endpoint.failures = 0
+            endpoint.error_rate /= 2
+            print(f"上游节点 {endpoint.base_url} 已暂时摘除 {self.eject_seconds:.0f} 秒")
+
+    def stats(self) -> dict[str, Any]:
+        """每个节点的延迟、错误率与摘除状态"""
+        now = time.monotonic()
+        return {
+            "sticky": self.sticky,
+            "affinity_entries": len(self._affinity),
+            "endpoints": [
+                {
+                    "base_url": e.base_url,
+                    "healthy": e.healthy(now),
+                    "latency": e.latency,
+                    "error_rate": e.error_rate,
+                    "inflight": e.inflight,
+                    "requests": e.requests,
+                    "errors": e.errors,
+                    "ejections": e.ejections,
+                }
+                for e in self.endpoints
+            ],
+        }
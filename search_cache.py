@@ -0,0 +1,166 @@
+"""
+检索结果缓存
+
+相同的检索（同一个 vector store、规范化后相同的查询、等价的过滤条件、相同的返回条数）在 TTL 内直接返回上次的结果。
+过滤条件先规范化：and / or 展开嵌套的同类组合、子条件去重排序，只有一个子条件时去掉组合；
+in / nin 的取值去重排序。子条件顺序不同但等价的过滤树命中同一个缓存项。
+vector store 写入新文件时，该 vector store 的缓存项全部失效；失效前开始的检索，结果不会再写入缓存。
+"""
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Optional
+
+import orjson
+
+# 缓存键：(vector_store_id, 规范化的查询, 规范化的过滤条件 JSON, 返回条数)
+SearchKey = tuple[str, str, bytes, int]
+
+
+def normalize_query(query: str) -> str:
+    """查询规范化：NFKC（全角转半角）、忽略大小写、合并空白"""
+    return " ".join(unicodedata.normalize("NFKC", query).casefold().split())
+
+
+def _dumps(value: Any) -> bytes:
+    return orjson.dumps(value, option=orjson.OPT_SORT_KEYS)
+
+
+def canonical_filters(filters: Any) -> Any:
+    """
+    规范化过滤树（等价的过滤条件得到相同的结构）
+
+    Args:
+        filters: vector_stores.search 格式的过滤条件（不检查格式，无法识别的部分原样保留）
+
+    Returns:
+        Any: 规范化后的过滤条件
+    """
+    if not isinstance(filters, dict):
+        return filters
+    kind = filters.get("type")
+    if kind in ("and", "or") and isinstance(filters.get("filters"), list):
+        children = []
+        for child in filters["filters"]:
+            child = canonical_filters(child)
+            if isinstance(child, dict) and child.get("type") == kind and isinstance(child.get("filters"), list):
+                # and(a, and(b, c)) 等价于 and(a, b, c)
+                children.extend(child["filters"])
+            else:
+                children.append(child)
+        unique = {_dumps(child): child for child in children}
+        if len(unique) == 1:
+            return next(iter(unique.values()))
+        return {**filters, "filters": [unique[key] for key in sorted(unique)]}
+    if kind in ("in", "nin") and isinstance(filters.get("value"), list):
+        unique = {_dumps(value): value for value in filters["value"]}
+        return {**filters, "value": [unique[key] for key in sorted(unique)]}
+    return filters
+
+
+def make_search_key(
+    vector_store_id: str,
+    query: str,
+    filters: Optional[dict[str, Any]],
+    max_num_results: int,
+) -> SearchKey:
+    """根据检索参数生成缓存键"""
+    return vector_store_id, normalize_query(query), _dumps(canonical_filters(filters)), max_num_results
+
+
+class SearchCache:
+    """带 TTL 的 LRU 检索结果缓存，按 vector store 失效"""
+
+    def __init__(self, max_entries: int = 10000, ttl: float = 300.0):
+        """
+        Args:
+            max_entries: 最多缓存的检索数，超出时淘汰最久未使用的
+            ttl: 缓存项的有效期（秒）
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        # 缓存键 -> (过期时间, 结果)
+        self._entries: OrderedDict[SearchKey, tuple[float, list[dict[str, Any]]]] = OrderedDict()
+        # vector_store_id -> 该 vector store 的缓存键（失效时只处理这些键，不扫描全部缓存项）
+        self._store_keys: dict[str, set[SearchKey]] = {}
+        # vector_store_id -> 失效次数（检索开始时记下，写入时不一致说明期间有新文件）
+        self._generations: dict[str, int] = {}
+        self.hits = 0
+        self.misses = 0
+        self.expirations = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def generation(self, vector_store_id: str) -> int:
+        """vector store 当前的失效次数，检索前获取并在 put 时传入"""
+        return self._generations.get(vector_store_id, 0)
+
+    def get(self, key: SearchKey) -> Optional[list[dict[str, Any]]]:
+        """
+        查询缓存
+
+        Args:
+            key: make_search_key 生成的缓存键
+
+        Returns:
+            Optional[list[dict]]: 命中且未过期的检索结果（调用方不能修改）
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        if entry[0] <= time.monotonic():
+            self._remove(key)
+            self.expirations += 1
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, key: SearchKey, results: list[dict[str, Any]], generation: int) -> None:
+        """
+        写入检索结果
+
+        Args:
+            key: 缓存键
+            results: 检索结果
+            generation: 检索开始前 generation() 的返回值，vector store 此后已失效时不写入
+        """
+        if generation != self.generation(key[0]):
+            return
+        self._entries[key] = (time.monotonic() + self.ttl, results)
+        self._entries.move_to_end(key)
+        self._store_keys.setdefault(key[0], set()).add(key)
+        while len(self._entries) > self.max_entries:
+            self._remove(next(iter(self._entries)))
+            self.evictions += 1
+
+    def _remove(self, key: SearchKey) -> None:
+        del self._entries[key]
+        keys = self._store_keys[key[0]]
+        keys.discard(key)
+        if not keys:
+            del self._store_keys[key[0]]
+
+    def invalidate(self, vector_store_id: str) -> None:
+        """vector store 写入了新文件：删除它的全部缓存项（耗时只与该 vector store 的缓存项数有关）"""
+        self._generations[vector_store_id] = self.generation(vector_store_id) + 1
+        self.invalidations += 1
+        for key in self._store_keys.pop(vector_store_id, ()):
+            del self._entries[key]
+
+    def stats(self) -> dict[str, Any]:
+        """缓存项数与命中统计"""
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "expirations": self.expirations,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
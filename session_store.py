@@ -0,0 +1,501 @@
+"""
+会话状态存储
+
+保存 session_id -> 上一次 response_id 的映射，提供三种实现：
+- MemorySessionStore: 进程内 LRU + TTL，适合单 worker
+- SQLiteSessionStore: 本地 SQLite 文件（WAL 模式），同一台机器的多个 worker 共享
+- RedisSessionStore: 直接使用 RESP 协议的 Redis 客户端，多机共享
+
+所有实现的内存 / 条目数都受配置约束，并通过 stats() 暴露命中与淘汰统计。
+SessionLocks 负责同一会话内请求的串行化。
+"""
+import asyncio
+import re
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, Callable, Optional
+from urllib.parse import unquote, urlparse
+
+
+class SessionStore(ABC):
+    """会话存储接口"""
+
+    def __init__(self, max_entries: int, ttl: float):
+        """
+        Args:
+            max_entries: 最多保存的会话数
+            ttl: 会话过期时间（秒），<= 0 表示不过期
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    @abstractmethod
+    async def get(self, session_id: str) -> Optional[str]:
+        """获取会话的上一次 response_id"""
+
+    @abstractmethod
+    async def set(self, session_id: str, response_id: str) -> None:
+        """保存会话的最新 response_id"""
+
+    @abstractmethod
+    async def delete(self, session_id: str) -> bool:
+        """删除会话，返回会话是否存在"""
+
+    @abstractmethod
+    async def size(self) -> int:
+        """当前保存的会话数"""
+
+    async def stats(self) -> dict[str, Any]:
+        """命中与淘汰统计"""
+        return {
+            "backend": self.backend,
+            "size": await self.size(),
+            "max_entries": self.max_entries,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+    async def close(self) -> None:
+        """释放资源"""
+
+    def _expires_at(self) -> float:
+        return time.time() + self.ttl if self.ttl > 0 else float("inf")
+
+
+class MemorySessionStore(SessionStore):
+    """进程内 LRU + TTL 会话存储"""
+
+    backend = "memory"
+
+    def __init__(self, max_entries: int, ttl: float):
+        super().__init__(max_entries, ttl)
+        # session_id -> (response_id, 过期时间)，按最近访问排序
+        self._data: OrderedDict[str, tuple[str, float]] = OrderedDict()
+
+    async def get(self, session_id: str) -> Optional[str]:
+        item = self._data.get(session_id)
+        if item is None:
+            self.misses += 1
+            return None
+        response_id, expires_at = item
+        if expires_at <= time.time():
+            del self._data[session_id]
+            self.expirations += 1
+            self.misses += 1
+            return None
+        self._data.move_to_end(session_id)
+        self.hits += 1
+        return response_id
+
+    async def set(self, session_id: str, response_id: str) -> None:
+        self._data[session_id] = (response_id, self._expires_at())
+        self._data.move_to_end(session_id)
+        while len(self._data) > self.max_entries:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    async def delete(self, session_id: str) -> bool:
+        return self._data.pop(session_id, None) is not None
+
+    async def size(self) -> int:
+        return len(self._data)
+
+
+class SQLiteSessionStore(SessionStore):
+    """
+    SQLite 会话存储
+
+    按最近访问时间淘汰，每写入 max_entries / 100 次清理一次过期和超出上限的会话。
+    数据库调用在线程池中执行，不阻塞事件循环。
+    """
+
+    backend = "sqlite"
+
+    def __init__(self, path: str, max_entries: int, ttl: float):
+        super().__init__(max_entries, ttl)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            " session_id TEXT PRIMARY KEY,"
+            " response_id TEXT NOT NULL,"
+            " accessed_at REAL NOT NULL,"
+            " expires_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS sessions_accessed_at ON sessions (accessed_at)")
+        self._lock = threading.Lock()
+        self._prune_interval = max(1, max_entries // 100)
+        self._writes = 0
+
+    def _get(self, session_id: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT response_id, expires_at FROM sessions WHERE session_id = ?", (session_id,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            if row[1] <= now:
+                self._conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._conn.execute(
+                "UPDATE sessions SET accessed_at = ? WHERE session_id = ?", (now, session_id)
+            )
+            self.hits += 1
+            return row[0]
+
+    def _set(self, session_id: str, response_id: str) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO sessions (session_id, response_id, accessed_at, expires_at)"
+                " VALUES (?, ?, ?, ?)"
+                " ON CONFLICT (session_id) DO UPDATE SET"
+                " response_id = excluded.response_id,"
+                " accessed_at = excluded.accessed_at,"
+                " expires_at = excluded.expires_at",
+                (session_id, response_id, time.time(), self._expires_at()),
+            )
+            self._writes += 1
+            if self._writes % self._prune_interval == 0:
+                self._prune()
+
+    def _prune(self) -> None:
+        cursor = self._conn.execute("DELETE FROM sessions WHERE expires_at <= ?", (time.time(),))
+        self.expirations += cursor.rowcount
+        cursor = self._conn.execute(
+            "DELETE FROM sessions WHERE session_id IN ("
+            " SELECT session_id FROM sessions ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,),
+        )
+        self.evictions += cursor.rowcount
+
+    def _delete(self, session_id: str) -> bool:
+        with self._lock:
+            cursor = self._conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+            return cursor.rowcount > 0
+
+    def _size(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+
+    async def get(self, session_id: str) -> Optional[str]:
+        return await asyncio.to_thread(self._get, session_id)
+
+    async def set(self, session_id: str, response_id: str) -> None:
+        await asyncio.to_thread(self._set, session_id, response_id)
+
+    async def delete(self, session_id: str) -> bool:
+        return await asyncio.to_thread(self._delete, session_id)
+
+    async def size(self) -> int:
+        return await asyncio.to_thread(self._size)
+
+    async def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+class RedisError(Exception):
+    """Redis 返回的错误"""
+
+
+class RedisSessionStore(SessionStore):
+    """
+    Redis 会话存储
+
+    使用 RESP 协议直接通信，可连接 Redis 或任何兼容 RESP 的服务。
+    会话以 SET ... EX ttl 保存；条目数上限由服务端的 maxmemory 策略保证，
+    max_entries 仅用于统计展示。
+    """
+
+    backend = "redis"
+
+    def __init__(self, url: str, max_entries: int, ttl: float, prefix: str = "session:"):
+        super().__init__(max_entries, ttl)
+        parsed = urlparse(url)
+        self.host = parsed.hostname or "127.0.0.1"
+        self.port = parsed.port or 6379
+        self.password = unquote(parsed.password) if parsed.password else None
+        self.db = int(parsed.path.lstrip("/") or 0)
+        self.prefix = prefix
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._lock = asyncio.Lock()
+
+    async def _connect(self) -> None:
+        self._reader, self._writer = await asyncio.open_connection(self.host, self.port)
+        try:
+            if self.password:
+                await self._roundtrip("AUTH", self.password)
+            if self.db:
+                await self._roundtrip("SELECT", str(self.db))
+        except BaseException:
+            # 认证或选库失败的连接不能继续使用
+            self._discard_connection()
+            raise
+
+    async def _read_reply(self) -> Any:
+        line = await self._reader.readline()
+        if not line:
+            raise ConnectionError("Redis 连接已关闭")
+        prefix, body = line[:1], line[1:-2]
+        if prefix == b"+":
+            return body.decode()
+        if prefix == b"-":
+            raise RedisError(body.decode())
+        if prefix == b":":
+            return int(body)
+        if prefix == b"$":
+            length = int(body)
+            if length < 0:
+                return None
+            data = await self._reader.readexactly(length + 2)
+            return data[:-2].decode()
+        if prefix == b"*":
+            length = int(body)
+            if length < 0:
+                return None
+            return [await self._read_reply() for _ in range(length)]
+        raise RedisError(f"无法解析的响应: {line!r}")
+
+    async def _roundtrip(self, *args: str) -> Any:
+        parts = [f"*{len(args)}\r\n".encode()]
+        for arg in args:
+            data = arg.encode()
+            parts.append(b"$%d\r\n%s\r\n" % (len(data), data))
+        self._writer.write(b"".join(parts))
+        await self._writer.drain()
+        return await self._read_reply()
+
+    async def command(self, *args: str) -> Any:
+        """
+        执行一条 Redis 命令
+
+        连接断开或等待回复时被取消（如客户端断开）时丢弃连接，下一次命令自动重连；
+        否则未读取的回复会被下一条命令当作自己的回复。
+        """
+        async with self._lock:
+            try:
+                if self._writer is None:
+                    await self._connect()
+                return await self._roundtrip(*args)
+            except RedisError:
+                # 完整读取了错误回复，连接仍然可用
+                raise
+            except BaseException:
+                self._discard_connection()
+                raise
+
+    async def get(self, session_id: str) -> Optional[str]:
+        response_id = await self.command("GET", self.prefix + session_id)
+        if response_id is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return response_id
+
+    async def set(self, session_id: str, response_id: str) -> None:
+        if self.ttl > 0:
+            # 毫秒精度，不足 1 秒的 TTL 不会被取整为 0
+            await self.command("SET", self.prefix + session_id, response_id, "PX", str(max(1, int(self.ttl * 1000))))
+        else:
+            await self.command("SET", self.prefix + session_id, response_id)
+
+    async def delete(self, session_id: str) -> bool:
+        return await self.command("DEL", self.prefix + session_id) > 0
+
+    async def size(self) -> int:
+        # 只统计带前缀的会话键（同一个库中可能还有其他数据），SCAN 分批遍历不阻塞服务端
+        pattern = re.sub(r"([*?\[\]\\])", r"\\\1", self.prefix) + "*"
+        cursor, count = "0", 0
+        while True:
+            cursor, keys = await self.command("SCAN", cursor, "MATCH", pattern, "COUNT", "1000")
+            count += len(keys)
+            if cursor == "0":
+                return count
+
+    async def stats(self) -> dict[str, Any]:
+        stats = await super().stats()
+        # 服务端统计的淘汰 / 过期数量
+        info = await self.command("INFO", "stats")
+        for line in info.splitlines():
+            key, _, value = line.partition(":")
+            if key == "evicted_keys":
+                stats["evictions"] = int(value)
+            elif key == "expired_keys":
+                stats["expirations"] = int(value)
+        return stats
+
+    def _discard_connection(self) -> None:
+        """立即关闭连接（不等待关闭完成，可以在取消时调用）"""
+        if self._writer is not None:
+            self._writer.close()
+        self._reader = None
+        self._writer = None
+
+    async def _close_connection(self) -> None:
+        if self._writer is not None:
+            self._writer.close()
+            try:
+                await self._writer.wait_closed()
+            except (ConnectionError, OSError):
+                pass
+        self._reader = None
+        self._writer = None
+
+    async def close(self) -> None:
+        async with self._lock:
+            await self._close_connection()
+
+
+def create_session_store(
+    backend: str,
+    max_entries: int,
+    ttl: float,
+    sqlite_path: str = "sessions.db",
+    redis_url: str = "redis://127.0.0.1:6379/0",
+) -> SessionStore:
+    """
+    根据配置创建会话存储
+
+    Args:
+        backend: memory / sqlite / redis
+        max_entries: 最多保存的会话数
+        ttl: 会话过期时间（秒）
+        sqlite_path: SQLite 数据库文件路径
+        redis_url: Redis 连接地址
+
+    Returns:
+        SessionStore: 会话存储实例
+    """
+    if backend == "memory":
+        return MemorySessionStore(max_entries, ttl)
+    if backend == "sqlite":
+        return SQLiteSessionStore(sqlite_path, max_entries, ttl)
+    if backend == "redis":
+        return RedisSessionStore(redis_url, max_entries, ttl)
+    raise ValueError(f"不支持的会话存储类型: {backend}")
+
+
+class SessionBusyError(Exception):
+    """会话正在处理其他请求"""
+
+
+class SessionLease:
+    """会话锁的持有凭证，请求结束时释放"""
+
+    def __init__(self, locks: "SessionLocks", session_id: str):
+        self.session_id = session_id
+        # cancel 策略下，同一会话的新请求到来时被设置
+        self.cancelled = asyncio.Event()
+        self._locks = locks
+        self._released = False
+        self._callbacks: list[Callable[[], None]] = []
+
+    def cancel(self) -> None:
+        """通知持有者取消当前请求"""
+        self.cancelled.set()
+        for callback in self._callbacks:
+            callback()
+
+    def on_cancel(self, callback: Callable[[], None]) -> None:
+        """注册取消时的回调（用于唤醒正在等待的流）"""
+        self._callbacks.append(callback)
+
+    def release(self) -> None:
+        """释放会话锁（可重复调用）"""
+        if not self._released:
+            self._released = True
+            self._locks._release(self)
+
+
+class _SessionEntry:
+    __slots__ = ("lock", "holder", "waiters")
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.holder: Optional[SessionLease] = None
+        self.waiters = 0
+
+
+class SessionLocks:
+    """
+    按会话串行化请求
+
+    同一 session_id 的请求依次执行，避免并发请求读取到相同的
+    previous_response_id 而分叉对话；不同会话之间互不影响。
+    会话空闲后立即删除对应的锁，内存只与活跃会话数有关。
+
+    策略：
+    - queue: 排队等待，超过 wait_timeout 仍未轮到则拒绝
+    - reject: 会话忙时立即拒绝
+    - cancel: 通知正在进行的请求取消，然后排队等待
+    """
+
+    POLICIES = ("queue", "reject", "cancel")
+
+    def __init__(self, policy: str = "queue", wait_timeout: float = 60.0):
+        if policy not in self.POLICIES:
+            raise ValueError(f"不支持的会话并发策略: {policy}")
+        self.policy = policy
+        self.wait_timeout = wait_timeout
+        self._entries: dict[str, _SessionEntry] = {}
+
+    async def acquire(self, session_id: str) -> SessionLease:
+        """
+        获取会话锁
+
+        Args:
+            session_id: 会话 ID
+
+        Returns:
+            SessionLease: 锁的持有凭证
+
+        Raises:
+            SessionBusyError: 会话忙且按策略拒绝，或排队超时
+        """
+        entry = self._entries.get(session_id)
+        if entry is None:
+            entry = self._entries[session_id] = _SessionEntry()
+        if entry.lock.locked():
+            if self.policy == "reject":
+                raise SessionBusyError(f"会话 {session_id} 正在处理其他请求")
+            if self.policy == "cancel" and entry.holder is not None:
+                entry.holder.cancel()
+        entry.waiters += 1
+        try:
+            await asyncio.wait_for(entry.lock.acquire(), self.wait_timeout)
+        except TimeoutError:
+            raise SessionBusyError(f"会话 {session_id} 排队超时") from None
+        finally:
+            entry.waiters -= 1
+            if entry.waiters == 0 and not entry.lock.locked():
+                self._entries.pop(session_id, None)
+        lease = SessionLease(self, session_id)
+        entry.holder = lease
+        return lease
+
+    def _release(self, lease: SessionLease) -> None:
+        entry = self._entries[lease.session_id]
+        entry.holder = None
+        entry.lock.release()
+        if entry.waiters == 0:
+            del self._entries[lease.session_id]
+
+    def active(self) -> int:
+        """当前持有锁或排队中的会话数"""
+        return len(self._entries)
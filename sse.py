@@ -0,0 +1,249 @@
+"""
+SSE 帧编码
+
+将 Responses API 的流式事件翻译为发送给前端的 SSE 帧（bytes）。
+固定的生命周期帧在导入时预先编码，带数据的帧使用 orjson 序列化。
+"""
+import time
+from typing import Any, Callable, Optional
+
+import orjson
+
+
+def encode_frame(payload: Any) -> bytes:
+    """将数据编码为一个 SSE 帧"""
+    return b"data: " + orjson.dumps(payload) + b"\n\n"
+
+
+# 流结束帧
+DONE_FRAME = b"data: [DONE]\n\n"
+
+# 同一会话的新请求取消了当前请求
+CANCELLED_FRAME = encode_frame({"type": "cancelled"})
+
+# 上游事件类型 -> 不携带数据的前端帧类型
+_FIXED_NAMES: dict[str, str] = {
+    "response.in_progress": "in_progress",
+    "response.output_item.added": "output_item_added",
+    "response.content_part.added": "content_part_added",
+    "response.output_text.done": "text_done",
+    "response.content_part.done": "content_part_done",
+    "response.output_item.done": "output_item_done",
+    "response.completed": "completed",
+    "response.web_search_call.in_progress": "web_search_in_progress",
+    "response.web_search_call.searching": "web_search_searching",
+    "response.web_search_call.completed": "web_search_completed",
+    "response.output_text.annotation.added": "annotation_added",
+    "response.reasoning_summary_part.added": "reasoning_summary_part_added",
+    "response.reasoning_summary_text.done": "reasoning_summary_text_done",
+    "response.reasoning_summary_part.done": "reasoning_summary_part_done",
+    "response.incomplete": "incomplete",
+}
+
+# 上游事件类型 -> 预编码的固定帧
+FIXED_FRAMES: dict[str, bytes] = {
+    upstream: encode_frame({"type": name}) for upstream, name in _FIXED_NAMES.items()
+}
+
+# 上游增量事件类型 -> 前端帧类型（由 FrameCoalescer 合并发送）
+DELTA_TYPES: dict[str, str] = {
+    "response.output_text.delta": "delta",
+    "response.reasoning_summary_text.delta": "reasoning_delta",
+}
+
+
+# 函数调用参数的事件（工具由服务端执行，不转发给前端）
+FUNCTION_CALL_EVENTS: frozenset[str] = frozenset({
+    "response.function_call_arguments.delta",
+    "response.function_call_arguments.done",
+})
+
+
+def _encode_created(event: Any) -> bytes:
+    return encode_frame({"type": "created", "id": event.response.id})
+
+
+# 已提示过的未知事件类型（每种只打印一次，不在热路径上反复输出）
+_reported_unknown: set[str] = set()
+
+
+def _encode_unknown(event: Any) -> bytes:
+    if event.type not in _reported_unknown:
+        _reported_unknown.add(event.type)
+        print(f"未知事件类型: {event.type}（之后不再提示）")
+    return encode_frame({"type": "unknown", "event": str(event)})
+
+
+# 上游事件类型 -> 带数据帧的编码函数
+PAYLOAD_HANDLERS: dict[str, Callable[[Any], bytes]] = {
+    "response.created": _encode_created,
+}
+
+# 上游事件类型 -> 前端帧类型（未列出的事件为 unknown）
+EVENT_NAMES: dict[str, str] = {
+    **_FIXED_NAMES,
+    **DELTA_TYPES,
+    "response.created": "created",
+}
+
+# 不影响回答内容的中间生命周期帧，慢消费者策略为 drop 时可以丢弃
+LIFECYCLE_NAMES: frozenset[str] = frozenset({
+    "in_progress", "output_item_added", "content_part_added",
+    "content_part_done", "output_item_done",
+    "web_search_in_progress", "web_search_searching", "web_search_completed",
+    "file_search_searching", "file_search_completed",
+    "reasoning_summary_part_added", "reasoning_summary_part_done",
+})
+
+# 事件详细程度 -> 发送的前端帧类型（error 与 [DONE] 总是发送）
+VERBOSITY_LEVELS: dict[str, Optional[frozenset[str]]] = {
+    "minimal": frozenset({"created", "delta", "text_done", "completed", "incomplete"}),
+    "standard": frozenset({
+        "created", "delta", "text_done", "completed", "incomplete",
+        "reasoning_delta", "annotation_added",
+        "web_search_in_progress", "web_search_searching", "web_search_completed",
+        "file_search_searching", "file_search_completed",
+    }),
+    "full": None,
+}
+
+
+def resolve_subscription(verbosity: str, events: Optional[list[str]] = None) -> Optional[frozenset[str]]:
+    """
+    解析客户端订阅的前端帧类型
+
+    Args:
+        verbosity: 事件详细程度（minimal / standard / full）
+        events: 显式订阅的帧类型，优先于 verbosity
+
+    Returns:
+        Optional[frozenset[str]]: 订阅的帧类型，None 表示全部发送
+    """
+    if events is not None:
+        return frozenset(events)
+    return VERBOSITY_LEVELS[verbosity]
+
+
+def encode_event(event: Any) -> bytes:
+    """
+    编码一个非增量事件
+
+    Args:
+        event: Responses API 流式事件
+
+    Returns:
+        bytes: SSE 帧
+    """
+    frame = FIXED_FRAMES.get(event.type)
+    if frame is not None:
+        return frame
+    return PAYLOAD_HANDLERS.get(event.type, _encode_unknown)(event)
+
+
+def encode_error(message: str) -> bytes:
+    """编码错误帧"""
+    return encode_frame({"type": "error", "message": message})
+
+
+class FrameCoalescer:
+    """
+    帧合并器
+
+    连续的同类 delta 合并为一个帧；已编码的小帧先放入发送缓冲区，
+    在时间窗口到期或缓冲区达到字节上限时打包成一次写出，
+    减少高并发下的写次数。window_ms 为 0 时每个帧立即发送。
+    holding 为 True 时（客户端积压）只缓冲不写出，由调用方在处理完积压后 flush。
+    """
+
+    def __init__(self, window_ms: int, max_bytes: int):
+        self.window = window_ms / 1000
+        self.max_bytes = max_bytes
+        self._frames: list[bytes] = []
+        self._kind: Optional[str] = None
+        self._parts: list[str] = []
+        self._delta_id: Optional[int] = None
+        self._size = 0
+        self._started: Optional[float] = None
+        self.holding = False
+
+    def add_delta(self, kind: str, text: str, event_id: Optional[int] = None) -> Optional[bytes]:
+        """
+        加入一个增量
+
+        Args:
+            kind: 帧类型（delta / reasoning_delta）
+            text: 增量文本
+            event_id: 事件序号，合并后的帧使用最后一个增量的序号
+
+        Returns:
+            Optional[bytes]: 需要立即写出的数据
+        """
+        if kind != self._kind:
+            self._close_delta()
+            self._kind = kind
+        self._parts.append(text)
+        self._delta_id = event_id
+        self._size += len(text.encode())
+        return self._schedule()
+
+    def add_frame(self, frame: bytes, urgent: bool = False, event_id: Optional[int] = None) -> Optional[bytes]:
+        """
+        加入一个已编码的帧
+
+        Args:
+            frame: SSE 帧
+            urgent: 是否立即写出（连同缓冲区中已有的内容）
+            event_id: 事件序号，作为 SSE 的 id 字段
+
+        Returns:
+            Optional[bytes]: 需要立即写出的数据
+        """
+        self._close_delta()
+        if event_id is not None:
+            frame = b"id: %d\n" % event_id + frame
+        self._frames.append(frame)
+        self._size += len(frame)
+        if urgent:
+            return self.flush()
+        return self._schedule()
+
+    def append(self, frame: bytes) -> None:
+        """加入一个帧，留到下一次 flush 一起写出（用于流结束前的最后一帧）"""
+        self._close_delta()
+        self._frames.append(frame)
+        self._size += len(frame)
+
+    def flush(self) -> Optional[bytes]:
+        """取出缓冲区中的全部内容，打包为一次写出"""
+        self._close_delta()
+        if not self._frames:
+            return None
+        data = b"".join(self._frames)
+        self._frames = []
+        self._size = 0
+        self._started = None
+        return data
+
+    def timeout(self) -> Optional[float]:
+        """距离时间窗口到期的剩余秒数，缓冲区为空时返回 None"""
+        if self._started is None:
+            return None
+        return max(0.0, self._started + self.window - time.monotonic())
+
+    def _schedule(self) -> Optional[bytes]:
+        if self.holding:
+            return None
+        if self.window <= 0 or self._size >= self.max_bytes:
+            return self.flush()
+        if self._started is None:
+            self._started = time.monotonic()
+        return None
+
+    def _close_delta(self) -> None:
+        if self._parts:
+            frame = encode_frame({"type": self._kind, "text": "".join(self._parts)})
+            if self._delta_id is not None:
+                frame = b"id: %d\n" % self._delta_id + frame
+            self._frames.append(frame)
+            self._parts = []
+        self._kind = None
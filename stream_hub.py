@@ -0,0 +1,357 @@
+"""
+上游流的扇出广播
+
+每个上游 responses.create 流由一个独立任务读取，事件发布到 Broadcast，
+客户端通过 Subscription 按自己的进度读取。相同的首轮提问共享同一个 Broadcast
+（single-flight），上游负载与并发客户端数量无关。
+
+每个事件有递增的序号（作为 SSE 的 id），Broadcast 只保留最近的 max_events 个事件；
+上游结束后按 response_id 保留一段时间，断线的客户端可以带 Last-Event-ID 续传。
+
+读取上游与写给客户端互不阻塞：订阅者落后的事件数即其发送队列深度，
+落后超过缓冲区的事件会被丢弃（计入 lost），由调用方按慢消费者策略处理。
+"""
+import asyncio
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Optional
+
+
+# 慢消费者策略（见 main.relay_subscription）
+SLOW_CONSUMER_POLICIES = ("coalesce", "drop", "disconnect")
+
+
+@dataclass(slots=True)
+class StreamEvent:
+    """广播中的一个事件"""
+
+    # 前端帧类型（created / delta / completed ...）
+    name: str
+    # 已编码的 SSE 帧（增量事件为 None）
+    frame: Optional[bytes] = None
+    # 增量文本（仅 delta / reasoning_delta）
+    text: Optional[str] = None
+
+
+class Subscription:
+    """一个客户端对广播的订阅"""
+
+    def __init__(self, broadcast: "Broadcast", position: int = 0):
+        self.broadcast = broadcast
+        # 下一个要读取的事件序号
+        self.position = position
+        # 因落后超过环形缓冲区而跳过的事件数
+        self.lost = 0
+        # 按慢消费者策略丢弃的帧数
+        self.dropped = 0
+        # 等待客户端写出的累计秒数
+        self.blocked = 0.0
+        # 读取时观察到的最大队列深度
+        self.max_lag = 0
+        # 是否因读取过慢被断开
+        self.too_slow = False
+        # 客户端是否已断开连接
+        self.disconnected = False
+        self.wakeup = asyncio.Event()
+
+    @property
+    def lag(self) -> int:
+        """尚未读取的事件数（发送队列深度）"""
+        return self.broadcast.next_seq - self.position
+
+    def take(self) -> tuple[int, list[StreamEvent]]:
+        """
+        取出尚未读取的事件
+
+        Returns:
+            tuple[int, list[StreamEvent]]: (第一个事件的序号, 事件列表)
+        """
+        self.wakeup.clear()
+        broadcast = self.broadcast
+        start = max(self.position, broadcast.base)
+        self.lost += start - self.position
+        end = broadcast.next_seq
+        if end - self.position > self.max_lag:
+            self.max_lag = end - self.position
+        self.position = end
+        if start == end:
+            return start, []
+        return start, broadcast.events[start - broadcast.base:]
+
+    @property
+    def finished(self) -> bool:
+        """上游已结束且所有事件都已读取"""
+        return self.broadcast.done and self.position == self.broadcast.next_seq
+
+    async def wait(self, timeout: Optional[float] = None) -> bool:
+        """
+        等待新事件
+
+        Args:
+            timeout: 最长等待秒数，None 表示一直等待
+
+        Returns:
+            bool: 是否被唤醒（False 表示超时）
+        """
+        try:
+            await asyncio.wait_for(self.wakeup.wait(), timeout)
+            return True
+        except TimeoutError:
+            return False
+
+    def close(self) -> None:
+        """取消订阅"""
+        self.broadcast._unsubscribe(self)
+
+
+class Broadcast:
+    """
+    一个上游流的事件广播
+
+    最后一个订阅者离开且上游尚未结束时，等待 grace 秒（留给客户端断线重连），
+    仍没有订阅者则取消读取上游的任务；还没有 response_id 的流无法续传，立即取消。
+    """
+
+    def __init__(self, registry: "BroadcastRegistry", key: Optional[str]):
+        self.key = key
+        self.events: list[StreamEvent] = []
+        # events[0] 的序号
+        self.base = 0
+        self.done = False
+        self.finished_at: Optional[float] = None
+        self.response_id: Optional[str] = None
+        # 本次广播用过的全部 response_id（工具调用后的续写会产生新的 response）
+        self.response_ids: list[str] = []
+        self.task: Optional[asyncio.Task] = None
+        # 事件时间线（timeline.Timeline），未开启追踪时为 None
+        self.timeline: Any = None
+        self._registry = registry
+        self._subscriptions: set[Subscription] = set()
+        self._idle_handle: Optional[asyncio.TimerHandle] = None
+
+    @property
+    def next_seq(self) -> int:
+        """下一个事件的序号"""
+        return self.base + len(self.events)
+
+    def publish(self, event: StreamEvent) -> None:
+        """发布事件并唤醒所有订阅者"""
+        self.events.append(event)
+        max_events = self._registry.max_events
+        if len(self.events) > 2 * max_events:
+            # 成批丢弃最早的事件，均摊 O(1)
+            drop = len(self.events) - max_events
+            del self.events[:drop]
+            self.base += drop
+        for subscription in self._subscriptions:
+            subscription.wakeup.set()
+
+    def set_response_id(self, response_id: str) -> None:
+        """记录 response_id，之后可以按它续传"""
+        self.response_id = response_id
+        self.response_ids.append(response_id)
+        self._registry._register_response(self)
+
+    def finish(self) -> None:
+        """标记上游结束"""
+        self.done = True
+        self.finished_at = time.monotonic()
+        if self._idle_handle is not None:
+            self._idle_handle.cancel()
+        self._registry._finish(self)
+        for subscription in self._subscriptions:
+            subscription.wakeup.set()
+
+    def subscribe(self, position: int = 0) -> Subscription:
+        """
+        新增订阅者
+
+        Args:
+            position: 从哪个序号开始读取
+        """
+        if self._idle_handle is not None:
+            self._idle_handle.cancel()
+            self._idle_handle = None
+        subscription = Subscription(self, position)
+        self._subscriptions.add(subscription)
+        return subscription
+
+    def _unsubscribe(self, subscription: Subscription) -> None:
+        if subscription not in self._subscriptions:
+            return
+        self._subscriptions.discard(subscription)
+        self._registry._record(subscription)
+        if self._subscriptions or self.done:
+            return
+        grace = self._registry.grace
+        if grace > 0 and self.response_id is not None:
+            self._idle_handle = asyncio.get_running_loop().call_later(grace, self._cancel_if_idle)
+        else:
+            self._cancel_if_idle()
+
+    def _cancel_if_idle(self) -> None:
+        self._idle_handle = None
+        if self._subscriptions or self.done:
+            return
+        # 没有客户端在读了，停止上游请求，新的相同请求不再加入这个广播
+        self._registry._remove(self)
+        if self.task is not None:
+            self._registry.cancelled += 1
+            self.task.cancel()
+
+
+class BroadcastRegistry:
+    """
+    广播登记
+
+    - 按回答缓存键索引进行中的首轮提问（single-flight）
+    - 按 response_id 索引进行中和最近结束的流（断线续传）
+    """
+
+    def __init__(
+        self,
+        max_events: int = 8192,
+        retention: float = 120.0,
+        max_responses: int = 1000,
+        grace: float = 5.0,
+    ):
+        """
+        Args:
+            max_events: 每个流保留的最近事件数
+            retention: 流结束后保留的秒数
+            max_responses: 最多保留的已结束流数量
+            grace: 最后一个订阅者离开后，等待重连的秒数
+        """
+        self.max_events = max_events
+        self.retention = retention
+        self.max_responses = max_responses
+        self.grace = grace
+        self._broadcasts: dict[str, Broadcast] = {}
+        self._responses: dict[str, Broadcast] = {}
+        # 已结束的流，按结束时间排序
+        self._finished: deque[Broadcast] = deque()
+        self.started = 0
+        self.joined = 0
+        self.resumed = 0
+        # 已结束订阅的累计指标
+        self.subscriptions = 0
+        self.blocked_seconds = 0.0
+        self.max_blocked_seconds = 0.0
+        self.max_lag = 0
+        self.lost_events = 0
+        self.dropped_frames = 0
+        self.slow_disconnects = 0
+        self.client_disconnects = 0
+        # 因没有订阅者而取消的上游请求数
+        self.cancelled = 0
+        self._active: set[Broadcast] = set()
+
+    def join(self, key: str) -> Optional[Broadcast]:
+        """
+        查找相同问题正在进行的广播
+
+        只有仍保留全部事件的广播可以加入（新订阅者从第一个事件开始读取）。
+
+        Args:
+            key: 回答缓存键
+
+        Returns:
+            Optional[Broadcast]: 可以加入的广播
+        """
+        broadcast = self._broadcasts.get(key)
+        if broadcast is None or broadcast.base > 0:
+            return None
+        self.joined += 1
+        return broadcast
+
+    def start(self, key: Optional[str]) -> Broadcast:
+        """
+        创建新的广播
+
+        Args:
+            key: 回答缓存键，None 表示不可共享（多轮对话）
+        """
+        broadcast = Broadcast(self, key)
+        self._active.add(broadcast)
+        if key is not None:
+            self._broadcasts[key] = broadcast
+        self.started += 1
+        return broadcast
+
+    def find_response(self, response_id: str) -> Optional[Broadcast]:
+        """按 response_id 查找可以续传的广播"""
+        self._purge()
+        broadcast = self._responses.get(response_id)
+        if broadcast is not None:
+            self.resumed += 1
+        return broadcast
+
+    def _register_response(self, broadcast: Broadcast) -> None:
+        self._purge()
+        self._responses[broadcast.response_id] = broadcast
+
+    def _finish(self, broadcast: Broadcast) -> None:
+        self._active.discard(broadcast)
+        self._remove(broadcast)
+        if broadcast.response_id is not None:
+            self._finished.append(broadcast)
+            self._purge()
+
+    def _purge(self) -> None:
+        deadline = time.monotonic() - self.retention
+        while self._finished and (
+            self._finished[0].finished_at <= deadline or len(self._finished) > self.max_responses
+        ):
+            broadcast = self._finished.popleft()
+            for response_id in broadcast.response_ids:
+                if self._responses.get(response_id) is broadcast:
+                    del self._responses[response_id]
+
+    def _record(self, subscription: Subscription) -> None:
+        self.subscriptions += 1
+        self.blocked_seconds += subscription.blocked
+        self.max_blocked_seconds = max(self.max_blocked_seconds, subscription.blocked)
+        self.max_lag = max(self.max_lag, subscription.max_lag)
+        self.lost_events += subscription.lost
+        self.dropped_frames += subscription.dropped
+        self.slow_disconnects += subscription.too_slow
+        self.client_disconnects += subscription.disconnected
+
+    def _remove(self, broadcast: Broadcast) -> None:
+        self._active.discard(broadcast)
+        if broadcast.key is not None and self._broadcasts.get(broadcast.key) is broadcast:
+            del self._broadcasts[broadcast.key]
+
+    def stats(self) -> dict[str, Any]:
+        """进行中的共享流、可续传的流与加入次数"""
+        return {
+            "inflight": len(self._broadcasts),
+            "resumable": len(self._responses),
+            "started": self.started,
+            "joined": self.joined,
+            "resumed": self.resumed,
+        }
+
+    def consumer_stats(self) -> dict[str, Any]:
+        """客户端发送队列深度与写出阻塞统计"""
+        lags = [
+            subscription.lag
+            for broadcast in self._active
+            for subscription in broadcast._subscriptions
+        ]
+        return {
+            "active_streams": len(self._active),
+            "active_subscriptions": len(lags),
+            "queue_depth": sum(lags),
+            "max_queue_depth": max(lags, default=0),
+            "subscriptions": self.subscriptions,
+            "blocked_seconds": self.blocked_seconds,
+            "max_blocked_seconds": self.max_blocked_seconds,
+            "max_lag": self.max_lag,
+            "lost_events": self.lost_events,
+            "dropped_frames": self.dropped_frames,
+            "slow_disconnects": self.slow_disconnects,
+            "client_disconnects": self.client_disconnects,
+            "cancelled_upstreams": self.cancelled,
+        }
@@ -0,0 +1,150 @@
+"""
+单个请求的事件时间线
+
+读取上游的任务记录每个上游事件到达的时间，向客户端写出时记录每次写出的时间与字节数，
+按 response_id 保存在有界的 LRU 中，用于排查“回答很慢”到底慢在联网搜索、推理还是生成文本。
+时间是相对于发起上游请求的单调时钟毫秒数；可选地在上游结束时追加写入 JSONL 文件做离线分析。
+"""
+import asyncio
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Optional
+
+# 阶段 -> 上游事件类型前缀
+PHASES = {
+    "web_search": ("response.web_search_call.",),
+    "reasoning": ("response.reasoning_summary", "response.reasoning_text."),
+    "text": ("response.output_text.",),
+}
+
+
+class Timeline:
+    """一个上游响应的事件时间线"""
+
+    __slots__ = ("response_id", "started", "started_at", "ended", "max_events", "events", "dropped", "_clients")
+
+    def __init__(self, max_events: int = 4096):
+        self.response_id: Optional[str] = None
+        self.started = time.monotonic()
+        # 墙上时间，便于和日志对照
+        self.started_at = time.time()
+        self.ended: Optional[float] = None
+        self.max_events = max_events
+        # (毫秒, 上游事件类型) 或 (毫秒, 客户端序号, 写出字节数)
+        self.events: list[tuple] = []
+        # 超出 max_events 未记录的事件数
+        self.dropped = 0
+        self._clients = 0
+
+    def _offset(self) -> float:
+        return round((time.monotonic() - self.started) * 1000, 3)
+
+    def upstream(self, event_type: str) -> None:
+        """记录一个上游事件到达"""
+        if len(self.events) < self.max_events:
+            self.events.append((self._offset(), event_type))
+        else:
+            self.dropped += 1
+
+    def new_client(self) -> int:
+        """分配一个客户端序号（同一响应可能有多个客户端：合并的相同提问、断线续传）"""
+        self._clients += 1
+        return self._clients
+
+    def frame(self, client: int, size: int) -> None:
+        """记录一次向客户端写出"""
+        if len(self.events) < self.max_events:
+            self.events.append((self._offset(), client, size))
+        else:
+            self.dropped += 1
+
+    def finish(self) -> None:
+        """标记上游结束"""
+        self.ended = time.monotonic()
+
+    def phases(self) -> dict[str, dict[str, float]]:
+        """每个阶段第一个与最后一个上游事件的时间（毫秒）"""
+        phases: dict[str, dict[str, float]] = {}
+        for event in self.events:
+            if len(event) != 2:
+                continue
+            offset, event_type = event
+            for phase, prefixes in PHASES.items():
+                if event_type.startswith(prefixes):
+                    span = phases.setdefault(phase, {"start": offset, "end": offset})
+                    span["end"] = offset
+                    break
+        return phases
+
+    def to_dict(self) -> dict[str, Any]:
+        """时间线的 JSON 表示"""
+        first_frame = next((e[0] for e in self.events if len(e) == 3), None)
+        return {
+            "response_id": self.response_id,
+            "started_at": self.started_at,
+            "duration_ms": round((self.ended - self.started) * 1000, 3) if self.ended is not None else None,
+            "first_event_ms": self.events[0][0] if self.events else None,
+            "first_frame_ms": first_frame,
+            "phases": self.phases(),
+            "dropped": self.dropped,
+            "events": [
+                {"t": e[0], "upstream": e[1]} if len(e) == 2 else {"t": e[0], "client": e[1], "bytes": e[2]}
+                for e in self.events
+            ],
+        }
+
+
+class TraceStore:
+    """按 response_id 保存最近的时间线"""
+
+    def __init__(self, max_responses: int = 1000, max_events: int = 4096, export_path: str = ""):
+        """
+        Args:
+            max_responses: 最多保留的时间线数，超出时淘汰最早的
+            max_events: 每条时间线最多记录的事件数
+            export_path: 上游结束时追加写入的 JSONL 文件，为空表示不导出
+        """
+        self.max_responses = max_responses
+        self.max_events = max_events
+        self.export_path = export_path
+        self._timelines: OrderedDict[str, Timeline] = OrderedDict()
+        self._export_lock = threading.Lock()
+        self.exported = 0
+
+    def start(self) -> Timeline:
+        """开始一条新的时间线（拿到 response_id 后再调用 register）"""
+        return Timeline(self.max_events)
+
+    def register(self, response_id: str, timeline: Timeline) -> None:
+        """按 response_id 保存时间线"""
+        timeline.response_id = response_id
+        self._timelines[response_id] = timeline
+        self._timelines.move_to_end(response_id)
+        while len(self._timelines) > self.max_responses:
+            self._timelines.popitem(last=False)
+
+    def get(self, response_id: str) -> Optional[Timeline]:
+        """查找时间线"""
+        return self._timelines.get(response_id)
+
+    def finish(self, timeline: Timeline) -> None:
+        """
+        标记上游结束，需要时在线程池中导出（只包含此时已写出的帧）
+
+        Args:
+            timeline: 结束的时间线
+        """
+        timeline.finish()
+        if self.export_path and timeline.response_id is not None:
+            line = json.dumps(timeline.to_dict(), ensure_ascii=False)
+            asyncio.get_running_loop().run_in_executor(None, self._export, line)
+
+    def _export(self, line: str) -> None:
+        try:
+            with self._export_lock, open(self.export_path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+            self.exported += 1
+        except OSError as e:
+            print(f"导出请求时间线失败: {e}")
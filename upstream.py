@@ -0,0 +1,123 @@
+"""
+上游 HTTP 连接池
+
+显式配置 OpenAI 客户端底层 httpx 连接池（连接数、keep-alive、HTTP/2、超时），
+并在启动时预先建立连接，部署后的第一批请求不再承担 DNS + TLS 握手的延迟。
+"""
+import asyncio
+import importlib.util
+from typing import Any
+
+import httpx
+
+
+def _http2_available(http2: bool) -> bool:
+    # HTTP/2 依赖可选的 h2 包（pip install "httpx[http2]"）
+    if http2 and importlib.util.find_spec("h2") is None:
+        print("未安装 h2，上游连接使用 HTTP/1.1")
+        return False
+    return http2
+
+
+def _pool_options(
+    max_connections: int,
+    max_keepalive: int,
+    keepalive_expiry: float,
+    http2: bool,
+    connect_timeout: float,
+    read_timeout: float,
+    write_timeout: float,
+    pool_timeout: float,
+) -> dict[str, Any]:
+    return {
+        "limits": httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive,
+            keepalive_expiry=keepalive_expiry,
+        ),
+        "timeout": httpx.Timeout(
+            connect=connect_timeout,
+            read=read_timeout,
+            write=write_timeout,
+            pool=pool_timeout,
+        ),
+        "http2": _http2_available(http2),
+    }
+
+
+def create_async_http_client(
+    max_connections: int = 100,
+    max_keepalive: int = 20,
+    keepalive_expiry: float = 60.0,
+    http2: bool = False,
+    connect_timeout: float = 5.0,
+    read_timeout: float = 300.0,
+    write_timeout: float = 30.0,
+    pool_timeout: float = 10.0,
+) -> httpx.AsyncClient:
+    """
+    创建异步 httpx 客户端（用于 AsyncOpenAI 的 http_client）
+
+    Args:
+        max_connections: 最大连接数
+        max_keepalive: 最多保持的空闲连接数
+        keepalive_expiry: 空闲连接保持秒数
+        http2: 是否启用 HTTP/2（需要 h2，未安装时退回 HTTP/1.1）
+        connect_timeout: 建立连接超时（秒）
+        read_timeout: 两次读取之间的超时（秒），需覆盖推理 / 联网搜索期间没有事件的时间
+        write_timeout: 发送请求超时（秒）
+        pool_timeout: 等待连接池空闲连接的超时（秒）
+
+    Returns:
+        httpx.AsyncClient: 配置好连接池的客户端
+    """
+    return httpx.AsyncClient(**_pool_options(
+        max_connections, max_keepalive, keepalive_expiry, http2,
+        connect_timeout, read_timeout, write_timeout, pool_timeout,
+    ))
+
+
+def create_sync_http_client(
+    max_connections: int = 100,
+    max_keepalive: int = 20,
+    keepalive_expiry: float = 60.0,
+    http2: bool = False,
+    connect_timeout: float = 5.0,
+    read_timeout: float = 300.0,
+    write_timeout: float = 30.0,
+    pool_timeout: float = 10.0,
+) -> httpx.Client:
+    """创建同步 httpx 客户端（用于 OpenAI 的 http_client），参数同 create_async_http_client"""
+    return httpx.Client(**_pool_options(
+        max_connections, max_keepalive, keepalive_expiry, http2,
+        connect_timeout, read_timeout, write_timeout, pool_timeout,
+    ))
+
+
+async def warm_up(http_client: httpx.AsyncClient, url: str, connections: int, timeout: float = 5.0) -> int:
+    """
+    预先建立到上游的连接
+
+    同时发出 connections 个 HEAD 请求，每个请求占用一个连接，
+    完成后连接回到连接池保持 keep-alive（HTTP/2 下多个请求复用同一连接）。
+    任何 HTTP 状态码都说明连接已建立；失败只打印提示，不影响启动。
+
+    Args:
+        http_client: 要预热的客户端
+        url: 上游地址
+        connections: 预先建立的连接数
+        timeout: 每个请求的超时（秒）
+
+    Returns:
+        int: 成功建立的连接数
+    """
+    async def open_one() -> bool:
+        try:
+            await http_client.head(url, timeout=timeout)
+            return True
+        except httpx.HTTPError as e:
+            print(f"预热上游连接失败: {e!r}")
+            return False
+
+    results = await asyncio.gather(*[open_one() for _ in range(connections)])
+    return sum(results)